@@ -2,9 +2,12 @@
 Custom JWT authentication utilities using PyJWT
 """
 import jwt
+import uuid
 from datetime import datetime, timedelta
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from chat.metrics import jwt_decode_seconds
+from .revocation import is_revoked, is_stale
 
 User = get_user_model()
 
@@ -19,6 +22,8 @@ def generate_access_token(user):
         'email': user.email,
         'exp': datetime.utcnow() + timedelta(days=1),
         'iat': datetime.utcnow(),
+        'jti': uuid.uuid4().hex,
+        'ep': user.token_epoch,
         'type': 'access'
     }
     
@@ -39,6 +44,8 @@ def generate_refresh_token(user):
         'user_id': user.id,
         'exp': datetime.utcnow() + timedelta(days=7),
         'iat': datetime.utcnow(),
+        'jti': uuid.uuid4().hex,
+        'ep': user.token_epoch,
         'type': 'refresh'
     }
     
@@ -57,11 +64,12 @@ def decode_token(token):
     Returns payload if valid, None if invalid
     """
     try:
-        payload = jwt.decode(
-            token,
-            settings.SECRET_KEY,
-            algorithms=['HS256']
-        )
+        with jwt_decode_seconds.time():
+            payload = jwt.decode(
+                token,
+                settings.SECRET_KEY,
+                algorithms=['HS256']
+            )
         return payload
     except jwt.ExpiredSignatureError:
         return None
@@ -73,15 +81,25 @@ def get_user_from_token(token):
     """
     Get user object from JWT token
     """
+    return get_user_and_payload(token)[0]
+
+
+def get_user_and_payload(token):
+    """
+    Get (user, payload) from a JWT token, or (None, None) if it is invalid
+    or revoked
+    """
     payload = decode_token(token)
-    if not payload:
-        return None
+    if not payload or is_revoked(payload):
+        return None, None
     
     try:
         user = User.objects.get(id=payload.get('user_id'))
-        return user
     except User.DoesNotExist:
-        return None
+        return None, None
+    if is_stale(payload, user):
+        return None, None
+    return user, payload
 
 
 def verify_token(token):
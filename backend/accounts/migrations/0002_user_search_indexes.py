@@ -0,0 +1,48 @@
+from django.db import migrations
+
+
+SEARCH_COLUMNS = ['username', 'first_name', 'last_name', 'email']
+
+
+def create_search_indexes(apps, schema_editor):
+    """
+    Index the columns used by the user directory prefix search.
+
+    PostgreSQL gets trigram GIN indexes matching the UPPER(col) LIKE
+    expression Django emits for istartswith. SQLite gets NOCASE indexes,
+    which its LIKE optimisation can use for case-insensitive prefixes.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for column in SEARCH_COLUMNS:
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS accounts_user_{column}_trgm '
+                f'ON accounts_user USING gin (UPPER("{column}"::text) gin_trgm_ops)'
+            )
+    elif vendor == 'sqlite':
+        for column in SEARCH_COLUMNS:
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS accounts_user_{column}_nocase '
+                f'ON accounts_user ("{column}" COLLATE NOCASE)'
+            )
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    suffix = {'postgresql': 'trgm', 'sqlite': 'nocase'}.get(vendor)
+    if suffix is None:
+        return
+    for column in SEARCH_COLUMNS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS accounts_user_{column}_{suffix}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 11:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_user_avatar_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='token_epoch',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -6,9 +6,15 @@ class User(AbstractUser):
     """Custom User model with additional fields"""
     email = models.EmailField(unique=True)
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
+    # Resized copies of `avatar`, keyed by variant name, plus the 'source'
+    # file they were generated from. Filled in by accounts.thumbnails.
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     bio = models.TextField(max_length=500, blank=True)
     is_online = models.BooleanField(default=False)
     last_seen = models.DateTimeField(auto_now=True)
+    # Carried by every issued token; incrementing it revokes them all
+    # (see accounts.revocation)
+    token_epoch = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
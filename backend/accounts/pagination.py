@@ -0,0 +1,127 @@
+"""
+Keyset (seek) pagination for large, append-mostly tables
+"""
+import base64
+import json
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginate by the last seen sort key instead of an OFFSET.
+
+    Each page is a single indexed range scan no matter how deep the client
+    pages. `ordering` must be ascending and unique, so that the key of the
+    last row identifies the position exactly. Several querysets can be
+    paginated back to back as sections, e.g. contacts before everyone else.
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    ordering = ('id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_sections([queryset], request, view)
+
+    def paginate_sections(self, sections, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        section, position = self.decode_cursor(request)
+
+        page = []
+        self.next_position = None
+        while section < len(sections) and len(page) < page_size:
+            queryset = sections[section].order_by(*self.ordering)
+            if position is not None:
+                queryset = queryset.filter(self._after(position))
+            remaining = page_size - len(page)
+            rows = list(queryset[:remaining + 1])
+            page.extend(rows[:remaining])
+
+            if len(rows) > remaining:
+                self.next_position = (section, self._key(page[-1]))
+                break
+
+            section, position = section + 1, None
+
+        if self.next_position is None and section < len(sections) and page:
+            # The page filled up exactly at a section boundary
+            self.next_position = (section, None)
+
+        return page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.base_url,
+            self.cursor_query_param,
+            self.encode_cursor(*self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def encode_cursor(self, section, position):
+        raw = json.dumps({'s': section, 'k': position}, separators=(',', ':'), default=str)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return 0, None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            section, position = int(data['s']), data['k']
+            if position is not None and len(position) != len(self.ordering):
+                raise ValueError
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        return section, position
+
+    def _key(self, obj):
+        return [getattr(obj, field) for field in self.ordering]
+
+    def _after(self, position):
+        """Build `(f1, f2, ...) > (v1, v2, ...)` as an OR of ANDs"""
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            term = Q(**{f'{field}__gt': position[i]})
+            for prior, value in zip(self.ordering[:i], position[:i]):
+                term &= Q(**{prior: value})
+            condition |= term
+        return condition
+
+
+class UserSearchPagination(KeysetPagination):
+    """Small pages ordered by username for the typeahead picker"""
+    page_size = 20
+    max_page_size = 100
+    ordering = ('username',)
@@ -0,0 +1,100 @@
+"""
+Token revocation that costs no database query per request.
+
+Two mechanisms, both checked in get_user_from_token:
+- Per-user token epochs. Every token carries the user's `token_epoch` from
+  when it was issued, and "log out everywhere" increments the column. The
+  user row is loaded to authenticate anyway, so comparing the epoch is free
+  and survives cache flushes.
+- A revoked-jti set for logging out a single session. Revoked ids are kept
+  in the shared cache until the token would have expired anyway, and each
+  process remembers the answers in memory: revocations until expiry and
+  non-revocations for AUTH_REVOCATION_LOCAL_TTL seconds. Another worker
+  therefore honours a logout within that many seconds. WebSocket
+  connections using the token are closed right away via the channel layer.
+"""
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+REVOKED_PREFIX = 'auth:revoked:'
+
+
+class RevokedTokens:
+    """In-process view of the revoked-jti set, backed by the shared cache"""
+    
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _remember(self, jti, revoked, until):
+        with self._lock:
+            self._entries.pop(jti, None)
+            self._entries[jti] = (revoked, until)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def is_revoked(self, jti):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(jti)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        
+        expires_at = cache.get(REVOKED_PREFIX + jti)
+        if expires_at is not None:
+            self._remember(jti, True, expires_at)
+            return True
+        self._remember(jti, False, now + settings.AUTH_REVOCATION_LOCAL_TTL)
+        return False
+    
+    def revoke(self, jti, expires_at):
+        """Revoke `jti` until `expires_at` (unix time), when it lapses anyway"""
+        timeout = max(1, int(expires_at - time.time()) + 1)
+        cache.set(REVOKED_PREFIX + jti, expires_at, timeout)
+        self._remember(jti, True, expires_at)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+revoked_tokens = RevokedTokens()
+
+
+def is_revoked(payload):
+    """Whether a decoded token's jti has been revoked"""
+    jti = payload.get('jti')
+    return bool(jti) and revoked_tokens.is_revoked(jti)
+
+
+def is_stale(payload, user):
+    """Whether a token was issued before the user's last logout from all sessions"""
+    return payload.get('ep', 0) != user.token_epoch
+
+
+def revoke_token(payload):
+    """Log out one session: revoke this token and close sockets opened with it"""
+    jti = payload.get('jti')
+    if not jti:
+        return
+    revoked_tokens.revoke(jti, payload['exp'])
+    notify_revoked(payload['user_id'], jti)
+
+
+def revoke_all(user):
+    """Log out everywhere: invalidate every token issued to `user` so far"""
+    type(user).objects.filter(pk=user.pk).update(token_epoch=F('token_epoch') + 1)
+    user.refresh_from_db(fields=['token_epoch'])
+    notify_revoked(user.pk, None)
+
+
+def notify_revoked(user_id, jti):
+    """Close the user's live connections using `jti` (all of them for None)"""
+    from chat.rooms import send_to_user_on_commit
+    
+    send_to_user_on_commit(user_id, 'session_revoked', {'type': 'session_revoked'}, jti=jti)
@@ -1,11 +1,119 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
+from .thumbnails import avatar_url
 
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+def parse_field_spec(value):
+    """Turn `a,b.c,b.d` into {'a': {}, 'b': {'c': {}, 'd': {}}}"""
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for part in filter(None, (p.strip() for p in path.split('.'))):
+            node = node.setdefault(part, {})
+    return tree
+
+
+def requested_fields(request):
+    """
+    The (fields, expand) trees asked for in the query string.
+
+    `fields` is None when the client wants the default shape. Only reads
+    are trimmed; writes always see every field.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None, {}
+    fields = request.query_params.get('fields')
+    expand = request.query_params.get('expand')
+    return (
+        parse_field_spec(fields) if fields else None,
+        parse_field_spec(expand) if expand else {}
+    )
+
+
+def wants_field(fields, *names):
+    """Whether any of `names` is part of a (possibly sparse) response"""
+    return fields is None or any(name in fields for name in names)
+
+
+class DynamicFieldsMixin:
+    """
+    Sparse fieldsets for serializers.
+
+    `?fields=id,name,participants.username` keeps only the listed fields
+    (dotted names reach into nested serializers) and `?expand=sender`
+    swaps an id for the nested object declared in Meta.expandable_fields.
+    Trimming happens before serialization, so dropped method fields and
+    relations are never evaluated. The same options can be passed as
+    `fields=`, `expand=` and `omit=` keyword arguments.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        expand = kwargs.pop('expand', None)
+        omit = kwargs.pop('omit', ())
+        super().__init__(*args, **kwargs)
+        if fields is None and expand is None:
+            fields, expand = requested_fields(self.context.get('request'))
+        self._field_spec = (fields, expand or {}, set(omit))
+    
+    def get_fields(self):
+        fields = super().get_fields()
+        only, expand, omit = self._field_spec
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        
+        for name in expand:
+            if name in expandable:
+                serializer_class, options = expandable[name]
+                fields[name] = serializer_class(
+                    read_only=True,
+                    fields=(only or {}).get(name) or None,
+                    **options
+                )
+        
+        if only is not None:
+            for name in list(fields):
+                if name not in only and name not in expand:
+                    del fields[name]
+            for name, nested in only.items():
+                if nested and name in fields and name not in expand:
+                    self._trim_nested(fields[name], nested)
+        
+        for name in omit:
+            fields.pop(name, None)
+        return fields
+    
+    @staticmethod
+    def _trim_nested(field, only):
+        target = getattr(field, 'child', field)
+        if isinstance(target, DynamicFieldsMixin):
+            target._field_spec = (only, {}, set())
+        elif isinstance(target, serializers.BaseSerializer):
+            for name in list(target.fields):
+                if name not in only:
+                    del target.fields[name]
+
+
+class AvatarField(serializers.Field):
+    """
+    Read-only URL of a user's avatar thumbnail.
+
+    Point `source` at the user object, e.g. `AvatarField(source='sender')`.
+    """
+    
+    def __init__(self, variant='sm', **kwargs):
+        self.variant = variant
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+    
+    def to_representation(self, user):
+        return avatar_url(user, self.variant, self.context.get('request'))
+
+
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for user details"""
     full_name = serializers.ReadOnlyField()
     
@@ -19,6 +127,17 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'is_online', 'last_seen', 'created_at']
 
 
+class UserSearchSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Slim user shape for directory search results"""
+    full_name = serializers.ReadOnlyField()
+    avatar = AvatarField(source='*')
+    
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'email', 'full_name', 'avatar', 'is_online']
+        read_only_fields = fields
+
+
 class RegisterSerializer(serializers.ModelSerializer):
     """Serializer for user registration"""
     password = serializers.CharField(
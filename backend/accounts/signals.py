@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import User
+from .thumbnails import schedule_avatar_thumbnails
+
+
+@receiver(post_save, sender=User)
+def refresh_avatar_thumbnails(sender, instance, **kwargs):
+    """Regenerate thumbnails whenever the stored avatar file changes"""
+    if not instance.avatar:
+        if instance.avatar_variants:
+            User.objects.filter(pk=instance.pk).update(avatar_variants={})
+        return
+
+    if (instance.avatar_variants or {}).get('source') != instance.avatar.name:
+        schedule_avatar_thumbnails(instance)
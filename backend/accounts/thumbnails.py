@@ -0,0 +1,91 @@
+"""
+Avatar thumbnail generation.
+
+Uploaded avatars are stored as-is; a small background pool then renders a
+fixed set of square, re-encoded variants. Variant filenames embed a hash of
+their content, so a URL never changes meaning and can be cached forever.
+"""
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+AVATAR_SIZES = getattr(settings, 'AVATAR_THUMBNAIL_SIZES', {'sm': 64, 'md': 128, 'lg': 256})
+AVATAR_FORMAT = 'WEBP'
+AVATAR_QUALITY = 80
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'AVATAR_THUMBNAIL_WORKERS', 2),
+    thread_name_prefix='avatar-thumbnails'
+)
+
+
+def avatar_url(user, variant=None, request=None):
+    """
+    URL of the requested avatar variant, falling back to the original
+    while thumbnails are still being generated
+    """
+    if user is None or not user.avatar:
+        return None
+
+    name = user.avatar.name
+    variants = user.avatar_variants or {}
+    if variant and variants.get('source') == name and variant in variants:
+        name = variants[variant]
+
+    url = default_storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def schedule_avatar_thumbnails(user):
+    """Queue thumbnail generation once the avatar change is committed"""
+    user_id, source = user.pk, user.avatar.name
+    transaction.on_commit(
+        lambda: _executor.submit(generate_avatar_thumbnails, user_id, source)
+    )
+
+
+def render_thumbnail(image, size):
+    """Center-crop to a square and re-encode at `size` pixels"""
+    thumb = ImageOps.fit(image, (size, size), method=Image.LANCZOS)
+    buffer = BytesIO()
+    thumb.save(buffer, format=AVATAR_FORMAT, quality=AVATAR_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def generate_avatar_thumbnails(user_id, source):
+    """Render every variant of `source` and attach them to the user"""
+    from chat.versioning import bump_user
+    from .models import User
+
+    try:
+        with default_storage.open(source, 'rb') as f:
+            image = Image.open(f)
+            image = ImageOps.exif_transpose(image)
+            image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+        variants = {'source': source}
+        for variant, size in AVATAR_SIZES.items():
+            data = render_thumbnail(image, size)
+            digest = hashlib.sha256(data).hexdigest()[:16]
+            name = f'avatars/thumbs/{digest}-{size}.{AVATAR_FORMAT.lower()}'
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(data))
+            variants[variant] = name
+
+        # Skip the write if the avatar was replaced while we were working
+        if User.objects.filter(pk=user_id, avatar=source).update(avatar_variants=variants):
+            bump_user(user_id)
+    except Exception:
+        logger.exception('Failed to generate avatar thumbnails for user %s', user_id)
+    finally:
+        close_old_connections()
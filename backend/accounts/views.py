@@ -2,8 +2,17 @@ from rest_framework import generics, status, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth import authenticate, get_user_model
-from .serializers import RegisterSerializer, UserSerializer, UserUpdateSerializer
+from django.db.models import Q
+from chat.models import Participant
+from .pagination import UserSearchPagination
+from .serializers import (
+    RegisterSerializer,
+    UserSerializer,
+    UserSearchSerializer,
+    UserUpdateSerializer
+)
 from .jwt_utils import generate_access_token, generate_refresh_token, decode_token, get_user_from_token
+from .revocation import is_revoked, is_stale, revoke_all, revoke_token
 
 User = get_user_model()
 
@@ -79,6 +88,12 @@ class TokenRefreshView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
         
+        if is_revoked(payload) or is_stale(payload, user):
+            return Response(
+                {'error': 'Invalid or expired refresh token'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        
         # Generate new tokens
         new_access_token = generate_access_token(user)
         new_refresh_token = generate_refresh_token(user)
@@ -128,13 +143,58 @@ class UserDetailView(generics.RetrieveUpdateAPIView):
 
 
 class UserListView(generics.ListAPIView):
-    """List all users for creating conversations"""
-    serializer_class = UserSerializer
+    """
+    Search users for creating conversations.
+
+    `?q=` matches a prefix of the username, first name, last name or email
+    (or "first last" for full names). People the caller already shares a
+    conversation with are listed first.
+    """
+    serializer_class = UserSearchSerializer
+    pagination_class = UserSearchPagination
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
         # Exclude current user from the list
-        return User.objects.exclude(id=self.request.user.id)
+        queryset = User.objects.exclude(id=self.request.user.id).only(
+            'id', 'username', 'email', 'first_name', 'last_name',
+            'avatar', 'avatar_variants', 'is_online'
+        )
+        
+        query = self.request.query_params.get('q', '').strip()
+        if query:
+            queryset = queryset.filter(self.search_filter(query))
+        return queryset
+    
+    @staticmethod
+    def search_filter(query):
+        """Prefix lookups only, so the search indexes can serve them"""
+        terms = query.split()
+        if len(terms) >= 2:
+            return Q(
+                first_name__istartswith=terms[0],
+                last_name__istartswith=' '.join(terms[1:])
+            )
+        return (
+            Q(username__istartswith=query) |
+            Q(first_name__istartswith=query) |
+            Q(last_name__istartswith=query) |
+            Q(email__istartswith=query)
+        )
+    
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        contact_ids = Participant.objects.filter(
+            conversation__participants__user=request.user
+        ).exclude(user=request.user).values('user_id')
+        
+        page = self.paginator.paginate_sections(
+            [queryset.filter(id__in=contact_ids), queryset.exclude(id__in=contact_ids)],
+            request,
+            view=self
+        )
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
 class LogoutView(APIView):
@@ -142,9 +202,23 @@ class LogoutView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def post(self, request):
-        # With stateless JWT, we just return success
-        # Client should remove tokens from storage
-        # For token blacklisting, you'd need to implement a blacklist model
+        """
+        Revoke the access token of this request and the `refresh` token in
+        the body, or every token of the user with `"all": true`. WebSocket
+        connections opened with a revoked token are closed.
+        """
+        if str(request.data.get('all', '')).lower() in ('1', 'true'):
+            revoke_all(request.user)
+            return Response(
+                {"message": "Logged out of all sessions."},
+                status=status.HTTP_200_OK
+            )
+        
+        for token in (request.auth, request.data.get('refresh')):
+            payload = decode_token(token) if isinstance(token, str) else None
+            if payload and payload.get('user_id') == request.user.id:
+                revoke_token(payload)
+        
         return Response(
             {"message": "Successfully logged out."},
             status=status.HTTP_200_OK
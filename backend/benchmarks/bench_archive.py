@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Measure message archiving and history paging through the archive.
+
+Seeds a throwaway SQLite database with CONVERSATIONS two-person
+conversations of MESSAGES messages each. The messages are spread evenly
+over the last DAYS days, and every tenth one has an attachment. The
+benchmark then archives everything older than --retention-days and
+reports:
+- archive throughput
+- bytes on disk per archived message
+- median latency and queries of a hot history page and of an archived one
+
+With --verify it instead fetches every history page of every
+conversation before and after archiving, in normal and compact form. It
+exits non-zero if any page differs.
+
+Usage:
+    python benchmarks/bench_archive.py [--conversations 20] [--messages 2000]
+                                       [--days 365] [--retention-days 30]
+                                       [--batch-size 500] [--requests 50]
+    python benchmarks/bench_archive.py --verify
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_project.settings')
+os.environ.setdefault('USE_MEMORY_CHANNELS', 'True')
+os.environ['DB_NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+os.environ['CHAT_ARCHIVE_ROOT'] = tempfile.mkdtemp()
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from chat.archive import run_retention
+from chat.models import Attachment, AttachmentBlob, Conversation, Message, Participant
+
+
+def seed(conversations, messages, days):
+    call_command('migrate', verbosity=0)
+    alice, bob = User.objects.bulk_create([
+        User(username=name, email=f'{name}@example.com', first_name=name.title(), last_name='Bench')
+        for name in ('alice', 'bob')
+    ])
+    blob = AttachmentBlob.objects.create(sha256='0' * 64, path='00/00/' + '0' * 64, size=1024)
+    attachment = Attachment.objects.create(blob=blob, uploaded_by=alice, filename='notes.txt')
+    now = timezone.now()
+    step = timedelta(days=days) / messages
+    convs = Conversation.objects.bulk_create([
+        Conversation(created_by=alice) for _ in range(conversations)
+    ])
+    Participant.objects.bulk_create([
+        Participant(conversation=conv, user=user) for conv in convs for user in (alice, bob)
+    ])
+    for conv in convs:
+        # created_at is auto_now_add, so backdate after the insert
+        created = Message.objects.bulk_create([
+            Message(conversation=conv, sender=(alice, bob)[i % 2], content=f'message {i} ' * 8,
+                    client_nonce=f'{conv.id}-{i}' if i % 3 == 0 else None)
+            for i in range(messages)
+        ])
+        for i, message in enumerate(created):
+            message.created_at = message.updated_at = now - step * (messages - i)
+        Message.objects.bulk_update(created, ['created_at', 'updated_at'], batch_size=500)
+        Message.attachments.through.objects.bulk_create([
+            Message.attachments.through(message_id=message.id, attachment_id=attachment.id)
+            for message in created[::10]
+        ])
+    return alice, convs
+
+
+def client_for(user):
+    client = APIClient(SERVER_NAME=settings.ALLOWED_HOSTS[0])
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(user)}')
+    return client
+
+
+def history(client, conversation_id, compact=False):
+    url = f'/api/chat/messages/?conversation={conversation_id}' + ('&compact=1' if compact else '')
+    pages = []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+        pages.append(response.json())
+        url = pages[-1]['next']
+    return pages
+
+
+def measure(client, url, requests):
+    """Return (median ms, queries of the last request)"""
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+    return statistics.median(timings), len(ctx.captured_queries)
+
+
+def archive_size():
+    total = 0
+    for root, _, files in os.walk(settings.CHAT_ARCHIVE_ROOT):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def benchmark(args):
+    user, convs = seed(args.conversations, args.messages, args.days)
+    client = client_for(user)
+    hot_url = f'/api/chat/messages/?conversation={convs[0].id}'
+    last_page = -(-args.messages // settings.REST_FRAMEWORK['PAGE_SIZE'])
+    cold_url = f'{hot_url}&page={last_page}'
+
+    before = Message.objects.count()
+    start = time.perf_counter()
+    batches = sum(1 for _ in run_retention(batch_size=args.batch_size))
+    elapsed = time.perf_counter() - start
+    moved = before - Message.objects.count()
+
+    print(f"{args.conversations} conversations x {args.messages} messages over {args.days} days, "
+          f"{args.retention_days} days kept hot")
+    print("-" * 72)
+    print(f"archived {moved} messages in {batches} batches: {elapsed:.2f}s, "
+          f"{moved / elapsed:,.0f} messages/s, {archive_size() / max(moved, 1):.0f} bytes/message on disk")
+    print(f"{'page':<12} {'median ms':>11} {'queries':>9}")
+    for label, url in (('hot', hot_url), ('archived', cold_url)):
+        median, queries = measure(client, url, args.requests)
+        print(f"{label:<12} {median:>11.2f} {queries:>9}")
+
+
+def verify(args):
+    user, convs = seed(args.conversations, args.messages, args.days)
+    client = client_for(user)
+    before = {(conv.id, compact): history(client, conv.id, compact) for conv in convs for compact in (False, True)}
+    moved = sum(count for _, count in run_retention(batch_size=args.batch_size))
+    print(f"archived {moved} of {args.conversations * args.messages} messages")
+    for (conversation_id, compact), pages in before.items():
+        after = history(client, conversation_id, compact)
+        if after != pages:
+            print(f"MISMATCH in conversation {conversation_id} (compact={compact})")
+            print(json.dumps({'before': pages, 'after': after}, indent=2)[:2000])
+            sys.exit(1)
+    print(f"{len(before)} histories matched page for page after archiving")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--conversations', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--retention-days', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--verify', action='store_true', help='compare history before and after archiving')
+    args = parser.parse_args()
+
+    settings.CHAT_RATE_LIMITS = {name: (1e9, 1e9) for name in settings.CHAT_RATE_LIMITS}
+    settings.CHAT_RETENTION_DAYS = args.retention_days
+
+    if args.verify:
+        verify(args)
+    else:
+        benchmark(args)
+
+
+if __name__ == '__main__':
+    main()
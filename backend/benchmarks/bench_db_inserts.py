@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Benchmark concurrent message inserts against the configured database.
+
+Each scenario runs THREADS workers that insert MESSAGES rows apiece, the
+way ChatConsumer.save_message does from database_sync_to_async threads.
+With the default SQLite engine the benchmark uses a throwaway database file
+and compares the rollback journal against WAL; with DB_ENGINE=postgresql it
+compares reconnecting per call (CONN_MAX_AGE=0) against persistent
+connections.
+
+Usage:
+    python benchmarks/bench_db_inserts.py [--threads 8] [--messages 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_project.settings')
+
+if os.getenv('DB_ENGINE', 'sqlite') == 'sqlite':
+    os.environ['DB_NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection, connections
+from accounts.models import User
+from chat.models import Conversation, Message, Participant
+
+
+def setup_conversation():
+    call_command('migrate', verbosity=0)
+    suffix = int(time.time() * 1000)
+    users = [
+        User.objects.create_user(
+            username=f'bench_{suffix}_{i}',
+            email=f'bench_{suffix}_{i}@example.com',
+            password='bench-password'
+        )
+        for i in range(2)
+    ]
+    conversation = Conversation.objects.create(created_by=users[0])
+    for user in users:
+        Participant.objects.create(conversation=conversation, user=user)
+    return conversation, users
+
+
+def run_scenario(conversation, sender, threads, messages, reconnect):
+    """Insert threads * messages rows and return rows per second"""
+    errors = []
+
+    def worker():
+        try:
+            for i in range(messages):
+                Message.objects.create(
+                    conversation=conversation,
+                    sender=sender,
+                    content=f'benchmark message {i}'
+                )
+                if reconnect:
+                    connection.close()
+        except Exception as e:  # noqa: BLE001 - report and keep going
+            errors.append(e)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    inserted = threads * messages - len(errors)
+    return inserted / elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=settings.ASGI_THREADS)
+    parser.add_argument('--messages', type=int, default=200)
+    args = parser.parse_args()
+
+    conversation, users = setup_conversation()
+    connections.close_all()
+
+    if connection.vendor == 'sqlite':
+        scenarios = [
+            ('journal=delete, reconnect per call', {'journal_mode': 'delete', 'synchronous': 'full'}, True),
+            ('journal=delete, persistent', {'journal_mode': 'delete', 'synchronous': 'full'}, False),
+            ('journal=wal, persistent', dict(settings.SQLITE_PRAGMAS), False),
+        ]
+    else:
+        scenarios = [
+            ('reconnect per call', None, True),
+            ('persistent', None, False),
+        ]
+
+    print(f"Engine: {connection.vendor}, {args.threads} threads x {args.messages} inserts")
+    print("-" * 60)
+    for label, pragmas, reconnect in scenarios:
+        if pragmas is not None:
+            settings.SQLITE_PRAGMAS = pragmas
+        rate, errors = run_scenario(conversation, users[0], args.threads, args.messages, reconnect)
+        print(f"{label:<40} {rate:>10.0f} msg/s  ({len(errors)} errors)")
+        connections.close_all()
+
+    if connection.vendor != 'sqlite':
+        Message.objects.filter(conversation=conversation).delete()
+        conversation.delete()
+        User.objects.filter(id__in=[u.id for u in users]).delete()
+
+
+if __name__ == '__main__':
+    main()
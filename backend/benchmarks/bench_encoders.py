@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+Compare the DRF serializers with the fast encoders (chat.encoders).
+
+Seeds a throwaway SQLite database with one user in CONVERSATIONS group
+conversations of PARTICIPANTS members each and MESSAGES messages in the
+first one. Every fifth message has attachments and some members have
+avatars. For three shapes it times loading and encoding a page both ways
+and reports rows/s:
+- message history pages (PAGE_SIZE rows)
+- message broadcasts (one row, as the consumer sends them)
+- conversation list pages (PAGE_SIZE rows)
+
+That both produce the same output is checked by chat.tests.test_encoders.
+
+Usage:
+    python benchmarks/bench_encoders.py [--conversations 50] [--participants 8]
+                                        [--messages 500] [--seconds 2]
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_project.settings')
+os.environ.setdefault('USE_MEMORY_CHANNELS', 'True')
+os.environ['DB_NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+os.environ['CHAT_INBOX_CACHE'] = ''
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+from rest_framework.request import Request
+from accounts.models import User
+from chat.encoders import (
+    CONVERSATION_COLUMNS, MESSAGE_COLUMNS, encode_conversations, encode_messages, message_row
+)
+from chat.membership import listed_members, member_count
+from chat.models import Attachment, AttachmentBlob, Conversation, Message, Participant
+from chat.serializers import ConversationListSerializer, MessageSerializer
+
+# Stored avatar names and thumbnails, including ones that need quoting
+AVATARS = [
+    ('', {}),
+    ('avatars/plain.png', {}),
+    ('avatars/with space ü.png', {}),
+    ('avatars/thumbed.png', {'source': 'avatars/thumbed.png', 'sm': 'avatars/thumbs/thumbed_sm.webp'}),
+    ('avatars/replaced.png', {'source': 'avatars/old.png', 'sm': 'avatars/thumbs/old_sm.webp'}),
+]
+
+
+def seed(conversations, participants, messages):
+    call_command('migrate', verbosity=0)
+    users = User.objects.bulk_create([
+        User(username=f'bench_{i}', email=f'bench_{i}@example.com',
+             first_name='Bench' if i % 3 else '', last_name=str(i) if i % 2 else '',
+             avatar=AVATARS[i % len(AVATARS)][0], avatar_variants=AVATARS[i % len(AVATARS)][1])
+        for i in range(participants)
+    ])
+    owner = users[0]
+    convs = Conversation.objects.bulk_create([
+        Conversation(name=f'Room {i}' if i % 4 else None, is_group=True, created_by=owner)
+        for i in range(conversations)
+    ])
+    Participant.objects.bulk_create([
+        Participant(conversation=conv, user=user)
+        for conv in convs for user in users
+    ])
+
+    blobs = AttachmentBlob.objects.bulk_create([
+        AttachmentBlob(sha256=f'{i:064x}', path=f'00/00/{i:064x}', size=1024 * (i + 1))
+        for i in range(3)
+    ])
+    attachments = [
+        Attachment.objects.create(blob=blob, uploaded_by=owner, filename=f'file {i}.txt', content_type='text/plain')
+        for i, blob in enumerate(blobs)
+    ]
+
+    now = timezone.now()
+    room = convs[0]
+    created = Message.objects.bulk_create([
+        Message(conversation=room, sender=users[i % len(users)], content=f'benchmark message {i} ' * 4,
+                client_nonce=f'nonce-{i}' if i % 3 == 0 else None, is_read=i % 2 == 0)
+        for i in range(messages)
+    ] + [
+        Message(conversation=conv, sender=users[1], content='latest ' * 30)
+        for conv in convs[1:]
+    ])
+    # created_at is auto_now_add; spread the history over a year
+    for i, message in enumerate(created[:messages]):
+        message.created_at = message.updated_at = now - timedelta(days=365) * (messages - i) / messages
+    Message.objects.bulk_update(created[:messages], ['created_at', 'updated_at'], batch_size=500)
+    Message.attachments.through.objects.bulk_create([
+        Message.attachments.through(message_id=message.id, attachment_id=attachment.id)
+        for message in created[:messages:5] for attachment in attachments[:1 + message.id % 3]
+    ])
+    return users, room
+
+
+def drf_request(user, path):
+    request = Request(APIRequestFactory(SERVER_NAME=settings.ALLOWED_HOSTS[0]).get(path))
+    request.user = user
+    return request
+
+
+def rate(build, seconds):
+    """Rows per second of repeated build() calls, which return a row count"""
+    rows, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        rows += build()
+    return rows / (time.perf_counter() - start)
+
+
+def history_page(user, room, size, fast):
+    request = drf_request(user, f'/api/chat/messages/?conversation={room.id}')
+    queryset = Message.objects.filter(conversation=room)
+    if fast:
+        return len(encode_messages(list(queryset.values(*MESSAGE_COLUMNS)[:size]), request))
+    page = queryset.select_related('sender').prefetch_related('attachments__blob')[:size]
+    return len(MessageSerializer(page, many=True, context={'request': request}).data)
+
+
+def broadcast(messages, fast):
+    # As the consumer has it: a saved message with its sender loaded
+    message = next(messages)
+    if fast:
+        encode_messages([message_row(message)])
+    else:
+        MessageSerializer(message).data
+    return 1
+
+
+def conversation_page(user, size, fast):
+    request = drf_request(user, '/api/chat/conversations/')
+    queryset = Conversation.objects.filter(participants__user=user).distinct()
+    if fast:
+        rows = queryset.annotate(member_count=member_count()).values(*CONVERSATION_COLUMNS)
+        return len(encode_conversations(list(rows[:size]), user))
+    page = queryset.annotate(member_count=member_count()).prefetch_related(
+        Prefetch('participants', queryset=Participant.objects.filter(user=user), to_attr='own_participants'),
+        Prefetch('participants', queryset=listed_members(user.id)[:settings.CHAT_LIST_PARTICIPANTS], to_attr='listed_members'),
+    )[:size]
+    return len(ConversationListSerializer(page, many=True, context={'request': request}).data)
+
+
+def benchmark(args):
+    users, room = seed(args.conversations, args.participants, args.messages)
+    owner = users[0]
+    size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    messages = itertools.cycle(Message.objects.filter(conversation=room).select_related('sender'))
+
+    print(f"{args.conversations} conversations x {args.participants} participants, "
+          f"{args.messages} messages, pages of {size}, {args.seconds:.0f}s per run")
+    print("-" * 64)
+    print(f"{'shape':<22} {'serializer rows/s':>18} {'encoder rows/s':>15} {'speedup':>8}")
+    for label, build in (
+        ('message history', lambda fast: history_page(owner, room, size, fast)),
+        ('message broadcast', lambda fast: broadcast(messages, fast)),
+        ('conversation list', lambda fast: conversation_page(owner, size, fast)),
+    ):
+        slow = rate(lambda: build(False), args.seconds)
+        fast = rate(lambda: build(True), args.seconds)
+        print(f"{label:<22} {slow:>18,.0f} {fast:>15,.0f} {fast / slow:>7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--conversations', type=int, default=50)
+    parser.add_argument('--participants', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    settings.CHAT_RATE_LIMITS = {name: (1e9, 1e9) for name in settings.CHAT_RATE_LIMITS}
+
+    benchmark(args)
+
+
+if __name__ == '__main__':
+    main()
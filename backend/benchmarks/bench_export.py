@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Measure conversation export throughput and show its memory stays flat.
+
+Seeds a throwaway SQLite database with one conversation per size in
+--sizes. For each size and output (NDJSON, CSV, gzipped NDJSON) it streams
+the export the endpoint and management command use. It reports rows per
+second, output bytes and, in a separate pass, the peak Python heap traced
+while streaming. The peak should not grow with the number of messages.
+
+Usage:
+    python benchmarks/bench_export.py [--sizes 1000,10000,100000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_project.settings')
+os.environ.setdefault('USE_MEMORY_CHANNELS', 'True')
+os.environ['DB_NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+
+import django
+
+django.setup()
+
+from django.core.management import call_command
+from accounts.models import User
+from chat.export import export_chunks
+from chat.models import Conversation, Message, Participant
+
+VARIANTS = [('ndjson', False), ('csv', False), ('ndjson', True)]
+
+
+def seed(sizes):
+    call_command('migrate', verbosity=0)
+    alice, bob = User.objects.bulk_create([
+        User(username=name, email=f'{name}@example.com') for name in ('alice', 'bob')
+    ])
+    conversations = {}
+    for size in sizes:
+        conv = Conversation.objects.create(created_by=alice)
+        Participant.objects.bulk_create([
+            Participant(conversation=conv, user=user) for user in (alice, bob)
+        ])
+        for start in range(0, size, 5000):
+            Message.objects.bulk_create([
+                Message(conversation=conv, sender=(alice, bob)[i % 2], content=f'message number {i} of the export')
+                for i in range(start, min(start + 5000, size))
+            ])
+        conversations[size] = conv.id
+    return conversations
+
+
+def measure(conversation_id, output, compress):
+    """Return (seconds, output bytes, peak traced KiB)"""
+    start = time.perf_counter()
+    total = sum(len(chunk) for chunk in export_chunks(conversation_id, output, compress))
+    elapsed = time.perf_counter() - start
+    
+    # Tracing slows everything down, so memory gets a pass of its own
+    tracemalloc.start()
+    for _ in export_chunks(conversation_id, output, compress):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, total, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    args = parser.parse_args()
+    
+    sizes = [int(size) for size in args.sizes.split(',')]
+    conversations = seed(sizes)
+    print(f"{'messages':>10} {'output':<12} {'seconds':>9} {'rows/s':>10} {'MB out':>8} {'peak KiB':>9}")
+    print("-" * 64)
+    for size in sizes:
+        for output, compress in VARIANTS:
+            elapsed, total, peak = measure(conversations[size], output, compress)
+            label = output + ('.gz' if compress else '')
+            print(f"{size:>10} {label:<12} {elapsed:>9.2f} {size / elapsed:>10,.0f} "
+                  f"{total / 1e6:>8.2f} {peak:>9,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Measure the conversation list response cache and check it is never stale.
+
+Seeds a throwaway SQLite database with one user in CONVERSATIONS group
+conversations of PARTICIPANTS members each. The benchmark fetches the
+conversation list REQUESTS times with the cache off, in process memory,
+and in the shared Django cache. It reports median and p95 latency,
+queries per request, and hit rate. That the cache is never stale is
+checked by chat.tests.test_inbox_cache.
+
+Usage:
+    python benchmarks/bench_inbox_cache.py [--conversations 50] [--participants 8]
+                                           [--requests 200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_project.settings')
+os.environ.setdefault('USE_MEMORY_CHANNELS', 'True')
+os.environ['DB_NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from chat import response_cache
+from chat.models import Conversation, Message, Participant
+
+LIST_URLS = [
+    '/api/chat/conversations/',
+    '/api/chat/conversations/?fields=id,name,unread_count,last_message_preview',
+]
+
+
+def seed(conversations, participants):
+    call_command('migrate', verbosity=0)
+    users = User.objects.bulk_create([
+        User(username=f'bench_{i}', email=f'bench_{i}@example.com', first_name='Bench', last_name=str(i))
+        for i in range(participants * 2)
+    ])
+    owner = users[0]
+    convs = Conversation.objects.bulk_create([
+        Conversation(name=f'Room {i}', is_group=True, created_by=owner)
+        for i in range(conversations)
+    ])
+    Participant.objects.bulk_create([
+        Participant(conversation=conv, user=user)
+        for conv in convs for user in users[:participants]
+    ])
+    Message.objects.bulk_create([
+        Message(conversation=conv, sender=users[1], content=f'hello from {conv.name}')
+        for conv in convs
+    ])
+    return owner, users, convs
+
+
+def client_for(user):
+    client = APIClient(SERVER_NAME=settings.ALLOWED_HOSTS[0])
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(user)}')
+    return client
+
+
+def use_cache(backend):
+    """Switch the cache store for the following requests"""
+    settings.CHAT_INBOX_CACHE = backend
+    response_cache._cache = None
+
+
+def measure(client, url, requests):
+    """Return (median ms, p95 ms, queries of the last request, hit rate)"""
+    lookups = response_cache.lookups
+    before = dict(lookups._values)
+    timings = []
+    for _ in range(requests):
+        connection.queries_log.clear()
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    hits = lookups._values.get(('hit',), 0) - before.get(('hit',), 0)
+    misses = lookups._values.get(('miss',), 0) - before.get(('miss',), 0)
+    rate = hits / (hits + misses) if hits + misses else 0.0
+    return statistics.median(timings), p95, len(ctx.captured_queries), rate
+
+
+def benchmark(args):
+    owner, _, _ = seed(args.conversations, args.participants)
+    client = client_for(owner)
+    print(f"{args.conversations} conversations x {args.participants} participants, "
+          f"{args.requests} requests each")
+    print("-" * 72)
+    print(f"{'cache':<10} {'url':<24} {'median ms':>11} {'p95 ms':>9} {'queries':>9} {'hits':>6}")
+    for backend in ('', 'memory', 'shared'):
+        use_cache(backend)
+        for index, url in enumerate(LIST_URLS):
+            median, p95, queries, rate = measure(client, url, args.requests)
+            label = 'default' if index == 0 else '?fields='
+            print(f"{backend or 'off':<10} {label:<24} {median:>11.2f} {p95:>9.2f} {queries:>9} {rate:>6.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--conversations', type=int, default=50)
+    parser.add_argument('--participants', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    settings.CHAT_RATE_LIMITS = {name: (1e9, 1e9) for name in settings.CHAT_RATE_LIMITS}
+
+    benchmark(args)
+
+
+if __name__ == '__main__':
+    main()
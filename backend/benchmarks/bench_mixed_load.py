@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+Measure WebSocket message latency while REST traffic hits the same worker.
+
+Seeds a throwaway SQLite database. --ws-clients users each hold a
+WebSocket to a room of their own and send a message every --interval
+seconds. Latency is the time until the room's broadcast of it comes back.
+Meanwhile --rest-clients users load their conversation list
+(--conversations conversations) and a page of message history, back to
+back. Everything runs through the real ASGI stack in one process, with the
+in-memory channel layer and the inbox cache off.
+
+Modes:
+- ws only: no REST traffic, the baseline
+- sync views: REST requests go to the DRF views, each in a thread of its own
+- async views: REST requests go to the same views on --rest-threads
+  database threads of their own (CHAT_REST_DB_THREADS)
+
+Each mode reports WebSocket latency (p50, p95, p99, max) and REST
+throughput and median latency.
+
+Usage:
+    python benchmarks/bench_mixed_load.py [--ws-clients 20] [--rest-clients 50]
+                                          [--conversations 50] [--seconds 10]
+                                          [--interval 0.05] [--rest-threads 4]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_project.settings')
+os.environ.setdefault('USE_MEMORY_CHANNELS', 'True')
+os.environ['DB_NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+os.environ['CHAT_INBOX_CACHE'] = ''
+
+import django
+
+django.setup()
+
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.conf import settings
+from django.core.management import call_command
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from chat.models import Conversation, Message, Participant
+from chat_project.asgi import application
+
+
+def seed(ws_clients, rest_clients, conversations):
+    call_command('migrate', verbosity=0)
+    users = User.objects.bulk_create([
+        User(username=f'mixed_{i}', email=f'mixed_{i}@example.com', first_name='Mixed', last_name=str(i))
+        for i in range(ws_clients + rest_clients + 1)
+    ])
+    ws_users, rest_users, peer = users[:ws_clients], users[ws_clients:-1], users[-1]
+    
+    rooms = Conversation.objects.bulk_create([
+        Conversation(name=f'Room {i}', is_group=True, created_by=user) for i, user in enumerate(ws_users)
+    ])
+    Participant.objects.bulk_create([
+        Participant(conversation=room, user=user) for room, user in zip(rooms, ws_users)
+    ])
+    
+    # Every REST user shares the same inbox of busy conversations with `peer`
+    inbox = Conversation.objects.bulk_create([
+        Conversation(name=f'Inbox {i}', is_group=True, created_by=peer) for i in range(conversations)
+    ])
+    Participant.objects.bulk_create([
+        Participant(conversation=conv, user=user) for conv in inbox for user in rest_users + [peer]
+    ])
+    Message.objects.bulk_create([
+        Message(conversation=conv, sender=peer, content=f'history {i} ' * 6)
+        for conv in inbox for i in range(60)
+    ])
+    return (
+        [(generate_access_token(user), room.id) for user, room in zip(ws_users, rooms)],
+        [generate_access_token(user) for user in rest_users],
+        inbox[0].id
+    )
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else float('nan')
+
+
+async def ws_client(token, room_id, interval, latencies, stop):
+    host = settings.ALLOWED_HOSTS[0]
+    communicator = WebsocketCommunicator(
+        application, f'/ws/chat/{room_id}/?token={token}',
+        headers=[(b'host', host.encode()), (b'origin', f'http://{host}'.encode())]
+    )
+    connected, _ = await communicator.connect(timeout=60)
+    assert connected, 'handshake refused'
+    while not await communicator.receive_nothing(0.2):
+        await communicator.receive_output()
+    
+    sequence = 0
+    while not stop.is_set():
+        content = f'ping {sequence}'
+        sent = time.perf_counter()
+        await communicator.send_json_to({'type': 'message', 'content': content})
+        while True:
+            frame = json.loads(await communicator.receive_from(timeout=60))
+            frames = frame if isinstance(frame, list) else [frame]
+            if any(f.get('type') == 'message' and f['message']['content'] == content for f in frames):
+                break
+        latencies.append(time.perf_counter() - sent)
+        sequence += 1
+        await asyncio.sleep(interval)
+    await communicator.disconnect()
+
+
+async def rest_client(token, paths, timings, stop):
+    host = settings.ALLOWED_HOSTS[0]
+    headers = [(b'host', host.encode()), (b'authorization', f'Bearer {token}'.encode())]
+    while not stop.is_set():
+        for path in paths:
+            start = time.perf_counter()
+            communicator = HttpCommunicator(application, 'GET', path, headers=headers)
+            response = await communicator.get_response(timeout=60)
+            assert response['status'] == 200, (path, response['status'])
+            timings.append(time.perf_counter() - start)
+
+
+async def run(ws_credentials, rest_tokens, paths, args, rest):
+    latencies, timings = [], []
+    stop = asyncio.Event()
+    tasks = [
+        asyncio.ensure_future(ws_client(token, room_id, args.interval, latencies, stop))
+        for token, room_id in ws_credentials
+    ]
+    if rest:
+        tasks += [
+            asyncio.ensure_future(rest_client(token, paths, timings, stop))
+            for token in rest_tokens
+        ]
+    await asyncio.sleep(args.seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return latencies, timings
+
+
+def report(label, latencies, timings, seconds):
+    ms = [latency * 1000 for latency in latencies]
+    rest = (f"{len(timings) / seconds:>8.0f} {statistics.median(timings) * 1000:>9.1f}"
+            if timings else f"{'-':>8} {'-':>9}")
+    print(f"{label:<14} {len(ms):>7} {percentile(ms, 0.5):>8.1f} {percentile(ms, 0.95):>8.1f} "
+          f"{percentile(ms, 0.99):>8.1f} {max(ms):>8.1f} {rest}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--ws-clients', type=int, default=20)
+    parser.add_argument('--rest-clients', type=int, default=50)
+    parser.add_argument('--conversations', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--interval', type=float, default=0.05)
+    parser.add_argument('--rest-threads', type=int, default=4)
+    args = parser.parse_args()
+    
+    settings.CHAT_RATE_LIMITS = {name: (1e9, 1e9) for name in settings.CHAT_RATE_LIMITS}
+    settings.DEBUG = False
+    settings.CHAT_REST_DB_THREADS = args.rest_threads
+    
+    ws_credentials, rest_tokens, history_id = seed(args.ws_clients, args.rest_clients, args.conversations)
+    paths = ['/api/chat/conversations/', f'/api/chat/messages/?conversation={history_id}']
+    print(f"{args.ws_clients} WebSocket senders every {args.interval * 1000:.0f}ms, "
+          f"{args.rest_clients} REST clients, {args.seconds:.0f}s per mode, "
+          f"{settings.CHAT_WS_DB_THREADS} WebSocket / {args.rest_threads} REST database threads")
+    print("-" * 72)
+    print(f"{'mode':<14} {'ws msgs':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'REST r/s':>8} {'REST p50':>9}")
+    for label, rest, async_views in (
+        ('ws only', False, True),
+        ('sync views', True, False),
+        ('async views', True, True),
+    ):
+        settings.CHAT_ASYNC_VIEWS = async_views
+        latencies, timings = asyncio.run(run(ws_credentials, rest_tokens, paths, args, rest))
+        report(label, latencies, timings, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
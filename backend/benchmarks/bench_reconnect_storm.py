@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Simulate a reconnect storm against one worker, with and without admission
+control, then a graceful drain.
+
+Seeds a throwaway SQLite database with CLIENTS users in rooms of ROOM_SIZE
+members. Every client then opens a WebSocket at the same instant, as they
+would after a worker restart. The connections run through the real ASGI
+stack with the in-memory channel layer. A client told to come back later
+waits its `retry_after` and tries again. The configured base delay and
+jitter are multiplied by --time-scale to keep the run short; the part of
+the hint derived from the measured backlog is not scaled.
+
+Each mode reports:
+- how long the whole storm took to connect
+- handshake attempts and rejections
+- the peak number of concurrent handshakes
+- p50 and p95 of the time clients waited in database threads
+
+The drain phase then closes every socket over --drain-seconds and reports
+how the closes were spread.
+
+Usage:
+    python benchmarks/bench_reconnect_storm.py [--clients 10000] [--room-size 100]
+                                               [--time-scale 0.05] [--drain-seconds 2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_project.settings')
+os.environ.setdefault('USE_MEMORY_CHANNELS', 'True')
+os.environ['DB_NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+
+import django
+
+django.setup()
+
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management import call_command
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from chat import admission, metrics
+from chat.models import Conversation, Participant
+from chat_project.asgi import application
+
+
+def seed(clients, room_size):
+    call_command('migrate', verbosity=0)
+    users = User.objects.bulk_create([
+        User(username=f'storm_{i}', email=f'storm_{i}@example.com')
+        for i in range(clients)
+    ])
+    rooms = Conversation.objects.bulk_create([
+        Conversation(name=f'Room {i}', is_group=True, created_by=users[0])
+        for i in range(0, clients, room_size)
+    ])
+    Participant.objects.bulk_create([
+        Participant(conversation=rooms[i // room_size], user=user)
+        for i, user in enumerate(users)
+    ])
+    return [
+        (generate_access_token(user), rooms[i // room_size].id)
+        for i, user in enumerate(users)
+    ]
+
+
+def histogram_quantile(histogram, q):
+    """Approximate quantile (bucket upper bound) from a chat.metrics Histogram"""
+    counts, _, total = histogram._values.get((), ([0], 0, 0))
+    if not total:
+        return 0.0
+    target = total * q
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + (float('inf'),), counts):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return float('inf')
+
+
+async def client(token, room_id, stats):
+    """Connect until admitted; return the open communicator"""
+    host = settings.ALLOWED_HOSTS[0]
+    while True:
+        stats['attempts'] += 1
+        communicator = WebsocketCommunicator(
+            application, f'/ws/chat/{room_id}/?token={token}',
+            headers=[(b'host', host.encode()), (b'origin', f'http://{host}'.encode())]
+        )
+        connected, _ = await communicator.connect(timeout=600)
+        assert connected, 'handshake refused'
+        # A rejected handshake is followed at once by the hint and the close
+        if await communicator.receive_nothing(0):
+            return communicator
+        hint = json.loads((await communicator.receive_output())['text'])
+        await communicator.receive_output()
+        stats['rejected'] += 1
+        await asyncio.sleep(hint['retry_after'])
+
+
+async def storm(credentials):
+    stats = {'attempts': 0, 'rejected': 0}
+    start = time.perf_counter()
+    communicators = await asyncio.gather(*(
+        client(token, room_id, stats) for token, room_id in credentials
+    ))
+    elapsed = time.perf_counter() - start
+    return communicators, elapsed, stats
+
+
+async def drain(communicators, seconds):
+    control = admission.get_admission()
+    start = time.perf_counter()
+    
+    async def wait_closed(communicator):
+        while True:
+            output = await communicator.receive_output(timeout=seconds + 600)
+            if output['type'] == 'websocket.close':
+                return time.perf_counter() - start
+    
+    waiters = [asyncio.ensure_future(wait_closed(c)) for c in communicators]
+    await control.drain(get_channel_layer(), seconds)
+    closed_at = sorted(await asyncio.gather(*waiters))
+    await asyncio.gather(*(c.disconnect(timeout=600) for c in communicators))
+    return closed_at
+
+
+def run_mode(label, credentials, args, concurrency, queue):
+    settings.CHAT_HANDSHAKE_CONCURRENCY = concurrency
+    settings.CHAT_HANDSHAKE_QUEUE = queue
+    for histogram in (metrics.db_wait_seconds, metrics.db_exec_seconds):
+        histogram._values.clear()
+    
+    async def main():
+        communicators, elapsed, stats = await storm(credentials)
+        control = admission.get_admission()
+        print(f"{label:<12} {elapsed:>9.2f} {stats['attempts']:>9} {stats['rejected']:>9} "
+              f"{control.peak_in_flight:>9} "
+              f"{histogram_quantile(metrics.db_wait_seconds, 0.5) * 1000:>9.1f} "
+              f"{histogram_quantile(metrics.db_wait_seconds, 0.95) * 1000:>9.1f}")
+        if args.drain:
+            return await drain(communicators, args.drain_seconds)
+        await asyncio.gather(*(c.disconnect(timeout=600) for c in communicators))
+    
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--room-size', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--queue', type=int, default=500)
+    parser.add_argument('--time-scale', type=float, default=0.05,
+                        help='multiplier applied to the configured retry delay and jitter')
+    parser.add_argument('--drain-seconds', type=float, default=2.0)
+    args = parser.parse_args()
+    
+    # Measure handshakes only: no rate limits, presence traffic or query log
+    settings.CHAT_RATE_LIMITS = {name: (1e9, 1e9) for name in settings.CHAT_RATE_LIMITS}
+    settings.CHAT_LARGE_ROOM_SIZE = 1
+    settings.DEBUG = False
+    settings.CHAT_HANDSHAKE_RETRY_AFTER *= args.time_scale
+    settings.CHAT_HANDSHAKE_RETRY_JITTER *= args.time_scale
+    
+    credentials = seed(args.clients, args.room_size)
+    print(f"{args.clients} clients in rooms of {args.room_size}, retry delays x{args.time_scale}")
+    print("-" * 72)
+    print(f"{'mode':<12} {'seconds':>9} {'attempts':>9} {'rejected':>9} {'peak':>9} "
+          f"{'db p50ms':>9} {'db p95ms':>9}")
+    args.drain = False
+    run_mode('uncapped', credentials, args, concurrency=10 ** 9, queue=0)
+    args.drain = True
+    closed_at = run_mode('admission', credentials, args, args.concurrency, args.queue)
+    
+    print()
+    print(f"drain over {args.drain_seconds}s: first close {closed_at[0]:.2f}s, "
+          f"median {statistics.median(closed_at):.2f}s, last {closed_at[-1]:.2f}s")
+    buckets = [0] * 10
+    for at in closed_at:
+        buckets[min(9, int(at / (closed_at[-1] or 1) * 10))] += 1
+    print('closes per tenth of the drain:', ' '.join(str(count) for count in buckets))
+
+
+if __name__ == '__main__':
+    main()
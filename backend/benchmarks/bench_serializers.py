@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Compare REST payload size and latency for default and trimmed responses.
+
+Seeds a throwaway SQLite database with one user in CONVERSATIONS group
+conversations of PARTICIPANTS members each and MESSAGES messages in the
+first one, then fetches the conversation list and a page of message
+history as the full default payload, as a sparse fieldset (?fields=) and,
+for messages, in compact mode (?compact=1). Reports bytes per response,
+median and p95 latency, and queries per request.
+
+Usage:
+    python benchmarks/bench_serializers.py [--conversations 50] [--participants 8]
+                                           [--messages 200] [--requests 50]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_project.settings')
+os.environ.setdefault('USE_MEMORY_CHANNELS', 'True')
+os.environ['DB_NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from chat.models import Conversation, Message, Participant
+
+
+def seed(conversations, participants, messages):
+    call_command('migrate', verbosity=0)
+    users = User.objects.bulk_create([
+        User(username=f'bench_{i}', email=f'bench_{i}@example.com', first_name='Bench', last_name=str(i))
+        for i in range(participants)
+    ])
+    owner = users[0]
+    convs = Conversation.objects.bulk_create([
+        Conversation(name=f'Room {i}', is_group=True, created_by=owner)
+        for i in range(conversations)
+    ])
+    Participant.objects.bulk_create([
+        Participant(conversation=conv, user=user)
+        for conv in convs for user in users
+    ])
+    Message.objects.bulk_create([
+        Message(conversation=conv, sender=users[i % len(users)], content=f'benchmark message {i} ' * 4)
+        for conv in convs[:1] for i in range(messages)
+    ] + [
+        Message(conversation=conv, sender=users[1], content='latest')
+        for conv in convs[1:]
+    ])
+    return owner, convs[0]
+
+
+def measure(client, url, requests):
+    """Return (bytes, median ms, p95 ms, queries) for repeated GETs of url"""
+    timings = []
+    for _ in range(requests):
+        connection.queries_log.clear()
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    return len(response.content), statistics.median(timings), p95, len(ctx.captured_queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--conversations', type=int, default=50)
+    parser.add_argument('--participants', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    # The benchmark measures serialization, not the API rate limits
+    settings.CHAT_RATE_LIMITS = {name: (1e9, 1e9) for name in settings.CHAT_RATE_LIMITS}
+    settings.CHAT_INBOX_CACHE = ''
+
+    owner, room = seed(args.conversations, args.participants, args.messages)
+    client = APIClient(SERVER_NAME=settings.ALLOWED_HOSTS[0])
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(owner)}')
+
+    scenarios = [
+        ('conversations, default', '/api/chat/conversations/'),
+        ('conversations, ?fields=', '/api/chat/conversations/?fields=id,name,unread_count,last_message_preview'),
+        ('messages, default', f'/api/chat/messages/?conversation={room.id}'),
+        ('messages, ?fields=', f'/api/chat/messages/?conversation={room.id}&fields=id,sender,content,created_at'),
+        ('messages, ?compact=1', f'/api/chat/messages/?conversation={room.id}&compact=1'),
+    ]
+
+    print(f"{args.conversations} conversations x {args.participants} participants, "
+          f"{args.messages} messages, {args.requests} requests each")
+    print("-" * 78)
+    print(f"{'scenario':<28} {'bytes':>9} {'median ms':>11} {'p95 ms':>9} {'queries':>9}")
+    for label, url in scenarios:
+        size, median, p95, queries = measure(client, url, args.requests)
+        print(f"{label:<28} {size:>9} {median:>11.2f} {p95:>9.2f} {queries:>9}")
+
+
+if __name__ == '__main__':
+    main()
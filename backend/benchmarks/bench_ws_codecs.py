@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Compare JSON and MessagePack WebSocket frames.
+
+For message, typing and status events this reports bytes on the wire and
+CPU time per frame to encode and decode with each wire format, then the
+CPU cost of fanning one message out to RECEIVERS connections when every
+connection encodes it itself versus encoding it once per broadcast.
+
+Usage:
+    python benchmarks/bench_ws_codecs.py [--frames 20000] [--receivers 500]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat import codecs
+
+# Same shape as ChatConsumer's broadcast payloads
+EVENTS = {
+    'message': {
+        'type': 'message',
+        'message': {
+            'id': 184467,
+            'conversation': 912,
+            'sender': 4021,
+            'sender_username': 'jane.doe',
+            'sender_name': 'Jane Doe',
+            'sender_avatar': 'http://localhost:8000/media/avatars/thumbs/5f2b9c1e0a7d4e3b-64.webp',
+            'content': 'Are we still on for the review at 3? I pushed the fixes from this morning.',
+            'attachments': [],
+            'is_read': False,
+            'created_at': '2026-10-19T09:41:27.118304Z',
+            'updated_at': '2026-10-19T09:41:27.118331Z',
+        },
+    },
+    'typing': {
+        'type': 'typing',
+        'user_id': 4021,
+        'username': 'jane.doe',
+        'is_typing': True,
+    },
+    'status': {
+        'type': 'user_status',
+        'user_id': 4021,
+        'username': 'jane.doe',
+        'is_online': True,
+    },
+}
+
+
+def cpu_per_call(fn, repeat):
+    """CPU microseconds per call of fn()"""
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - start) / repeat * 1e6
+
+
+def decode_frame(frame):
+    if isinstance(frame, bytes):
+        return codecs.decode(bytes_data=frame)
+    return codecs.decode(text_data=frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--receivers', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{args.frames} frames per measurement")
+    print("-" * 66)
+    print(f"{'event':<10} {'format':<9} {'bytes':>7} {'encode us':>11} {'decode us':>11}")
+    for name, payload in EVENTS.items():
+        for wire_format in codecs.FORMATS:
+            frame = codecs.encode(payload, wire_format)
+            assert decode_frame(frame) == payload
+            size = len(frame if isinstance(frame, bytes) else frame.encode())
+            encode_us = cpu_per_call(lambda: codecs.encode(payload, wire_format), args.frames)
+            decode_us = cpu_per_call(lambda: decode_frame(frame), args.frames)
+            print(f"{name:<10} {wire_format:<9} {size:>7} {encode_us:>11.2f} {decode_us:>11.2f}")
+
+    payload = EVENTS['message']
+    repeat = max(1, args.frames // args.receivers)
+    per_connection = cpu_per_call(
+        lambda: [codecs.encode(payload, codecs.JSON) for _ in range(args.receivers)],
+        repeat
+    )
+    once = cpu_per_call(lambda: codecs.encode_frames(payload), repeat)
+
+    print()
+    print(f"Fan-out of one message to {args.receivers} receivers")
+    print("-" * 66)
+    print(f"{'encode per connection (JSON)':<40} {per_connection:>12.1f} us")
+    print(f"{'encode once per broadcast (both formats)':<40} {once:>12.1f} us")
+
+
+if __name__ == '__main__':
+    main()
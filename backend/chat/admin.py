@@ -1,45 +1,164 @@
+from urllib.parse import urlencode
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections, router
+from django.db.models import Max
+from django.http import FileResponse, Http404
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from . import profiling
 from .models import Conversation, Participant, Message
 
 
-class ParticipantInline(admin.TabularInline):
-    model = Participant
-    extra = 1
-    readonly_fields = ['joined_at', 'last_read_at']
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for changelists of large tables.
+    
+    Counts stop at COUNT_LIMIT rows, so a filtered list pages through its
+    first COUNT_LIMIT matches at most. An unfiltered list that goes past
+    the limit uses an estimate of the table size instead: the planner's
+    row estimate on PostgreSQL, MAX(pk) elsewhere.
+    """
+    COUNT_LIMIT = 10000
+    
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        counted = queryset.order_by()[:self.COUNT_LIMIT + 1].count()
+        if counted <= self.COUNT_LIMIT or queryset.query.where:
+            return min(counted, self.COUNT_LIMIT)
+        return max(self.estimate(queryset.model), counted)
+    
+    @staticmethod
+    def estimate(model):
+        connection = connections[router.db_for_read(model)]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            return max(row[0], 0) if row else 0
+        return model._default_manager.aggregate(highest=Max('pk'))['highest'] or 0
+
 
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings shared by the chat tables"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
 
-class MessageInline(admin.TabularInline):
-    model = Message
-    extra = 0
-    readonly_fields = ['sender', 'content', 'created_at']
-    can_delete = False
+
+def changelist_link(model, label, **filters):
+    url = reverse(f'admin:chat_{model}_changelist')
+    return format_html('<a href="{}?{}">{}</a>', url, urlencode(filters), label)
 
 
 @admin.register(Conversation)
-class ConversationAdmin(admin.ModelAdmin):
+class ConversationAdmin(LargeTableAdmin):
     list_display = ['id', 'name', 'is_group', 'created_by', 'created_at', 'updated_at']
     list_filter = ['is_group', 'created_at']
-    search_fields = ['name', 'participants__user__username']
-    inlines = [ParticipantInline, MessageInline]
-    readonly_fields = ['created_at', 'updated_at']
+    list_select_related = ['created_by']
+    # Prefix lookups only; see the 0003 migration for the indexes
+    search_fields = ['=id', '^name']
+    raw_id_fields = ['created_by']
+    readonly_fields = ['created_at', 'updated_at', 'members_link', 'messages_link']
+    
+    # Members and messages are paged in their own changelists instead of
+    # being inlined here, since a conversation can hold millions of rows
+    def members_link(self, obj):
+        return changelist_link('participant', 'View members', conversation__id__exact=obj.pk)
+    members_link.short_description = 'Members'
+    
+    def messages_link(self, obj):
+        return changelist_link('message', 'View messages', conversation__id__exact=obj.pk)
+    messages_link.short_description = 'Messages'
+
+
+def conversation_label(obj):
+    """Needs select_related('conversation'); Conversation.__str__ queries participants"""
+    return obj.conversation.name or f'Conversation #{obj.conversation_id}'
+conversation_label.short_description = 'Conversation'
+conversation_label.admin_order_field = 'conversation_id'
 
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
-    list_display = ['id', 'conversation', 'sender', 'content_preview', 'created_at']
+class MessageAdmin(LargeTableAdmin):
+    list_display = ['id', conversation_label, 'sender', 'content_preview', 'created_at']
     list_filter = ['created_at', 'is_read']
-    search_fields = ['content', 'sender__username']
-    readonly_fields = ['created_at', 'updated_at']
+    list_select_related = ['conversation', 'sender']
+    search_fields = ['=id', '^sender__username']
+    # Same order as -created_at, but served by the primary key index
+    ordering = ['-id']
     
     def content_preview(self, obj):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
     content_preview.short_description = 'Content'
+    
+    # Messages are read-only here; they can still be deleted for moderation
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Participant)
-class ParticipantAdmin(admin.ModelAdmin):
-    list_display = ['id', 'conversation', 'user', 'joined_at', 'unread_count']
+class ParticipantAdmin(LargeTableAdmin):
+    list_display = ['id', conversation_label, 'user', 'joined_at', 'last_read_at']
     list_filter = ['joined_at']
-    search_fields = ['user__username', 'conversation__name']
+    list_select_related = ['conversation', 'user']
+    search_fields = ['^user__username', '^conversation__name']
+    raw_id_fields = ['conversation', 'user']
     readonly_fields = ['joined_at']
+    ordering = ['-id']
+
+
+def profile_list(request):
+    """Saved profiles, newest first"""
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Profiles',
+        'profiles': profiling.list_profiles(),
+        'keep': settings.PROFILE_KEEP,
+    }
+    return TemplateResponse(request, 'admin/chat/profiles.html', context)
+
+
+def profile_detail(request, profile_id):
+    """Flamegraph, call tree, SQL timeline and hottest functions of one profile"""
+    profile = profiling.load_profile(profile_id)
+    if profile is None:
+        raise Http404('No such profile')
+    flame = profiling.flame_rows(profile['tree'])
+    duration = profile['duration_ms'] or 1e-9
+    sql = [
+        {
+            **query,
+            'left': round(query['start_ms'] / duration * 100, 4),
+            'width': max(round(query['duration_ms'] / duration * 100, 4), 0.2),
+        }
+        for query in profile['sql']
+    ]
+    context = {
+        **admin.site.each_context(request),
+        'title': f"Profile {profile['id']}",
+        'profile': profile,
+        'flame': flame,
+        'flame_height': (max(row['depth'] for row in flame) + 1) * 18,
+        'tree': profiling.tree_rows(profile['tree']),
+        'sql': sql,
+    }
+    return TemplateResponse(request, 'admin/chat/profile_detail.html', context)
+
 
+def profile_download(request, profile_id):
+    """Raw cProfile output, for snakeviz, pstats or speedscope"""
+    path = profiling.prof_path(profile_id)
+    if path is None:
+        raise Http404('No such profile')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id}.prof')
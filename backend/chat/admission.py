@@ -0,0 +1,244 @@
+"""
+Handshake admission control and graceful drain for WebSocket workers.
+
+A worker restart makes every client reconnect at once, and each handshake
+costs a JWT decode, a participant query and a presence UPDATE. The
+AdmissionMiddleware lets at most CHAT_HANDSHAKE_CONCURRENCY handshakes per
+process run at a time. Up to CHAT_HANDSHAKE_QUEUE more wait for a slot,
+for at most CHAT_HANDSHAKE_QUEUE_TIMEOUT seconds. Everything beyond that is
+turned away cheaply, before any authentication or database work. A
+rejected client is accepted and sent
+    {"type": "reconnect", "reason": "busy", "retry_after": <seconds>}
+then closed with 1013 (Try Again Later). `retry_after` is at least
+CHAT_HANDSHAKE_RETRY_AFTER plus random jitter. Under a storm it is
+larger: each rejected client is given the next free slot at the rate the
+worker has been completing handshakes, so the clients already turned away
+come back spread out instead of all together.
+
+On SIGTERM the worker stops admitting handshakes and closes its sockets
+gradually over CHAT_DRAIN_SECONDS. Each socket gets a `reconnect` frame
+with reason "restart" and its own jittered delay, and is closed with 1012
+(Service Restart). Then the previous SIGTERM handler runs, so the server
+shuts down as it normally would.
+"""
+import asyncio
+import logging
+import math
+import random
+import signal
+import weakref
+from django.conf import settings
+from . import codecs, metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSE_TRY_AGAIN_LATER = 1013
+CLOSE_SERVICE_RESTART = 1012
+
+# Seconds between drain batches
+DRAIN_TICK = 0.1
+
+# Weight of the newest handshake in the moving average of their duration
+DURATION_WEIGHT = 0.05
+
+handshakes = metrics.Counter(
+    'chat_handshakes_total', 'WebSocket handshakes by admission result', ['result']
+)
+
+
+def retry_after(busy=True, backlog_seconds=0):
+    """Jittered reconnect delay in seconds"""
+    base = max(settings.CHAT_HANDSHAKE_RETRY_AFTER, backlog_seconds) if busy else 0
+    return round(base + random.uniform(0, settings.CHAT_HANDSHAKE_RETRY_JITTER), 3)
+
+
+class AdmissionControl:
+    """Handshake slots, the live sockets and the drain state of one event loop"""
+    
+    def __init__(self, loop, concurrency, queue_size, queue_timeout):
+        self.loop = loop
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak_in_flight = 0
+        self.draining = False
+        self.live = set()
+        # Until handshakes have been timed, assume a full queue drains just
+        # within its timeout
+        self.handshake_seconds = queue_timeout * concurrency / max(queue_size, 1)
+        self.next_retry_at = 0.0
+        self._slots = asyncio.Semaphore(concurrency)
+    
+    async def acquire(self):
+        """Take a handshake slot, waiting in the queue if needed; False if rejected"""
+        if self.draining:
+            return False
+        if not self._slots.locked():
+            await self._slots.acquire()
+            handshakes.inc('admitted')
+        else:
+            if self.waiting >= self.queue_size:
+                return False
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                self.waiting -= 1
+            if self.draining:
+                self._slots.release()
+                return False
+            handshakes.inc('queued')
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return True
+    
+    def release(self, started):
+        self.in_flight -= 1
+        self._slots.release()
+        duration = self.loop.time() - started
+        self.handshake_seconds += (duration - self.handshake_seconds) * DURATION_WEIGHT
+    
+    def retry_delay(self):
+        """
+        Seconds until a rejected client should come back: after the queued
+        and running handshakes, and after every client rejected before it
+        """
+        now = self.loop.time()
+        per_slot = self.handshake_seconds / self.concurrency
+        backlog = (self.waiting + self.in_flight) * per_slot
+        self.next_retry_at = max(self.next_retry_at, now + backlog) + per_slot
+        return self.next_retry_at - now
+    
+    def register(self, consumer):
+        """Track an accepted socket so a drain can close it"""
+        self.live.add(consumer)
+    
+    def unregister(self, consumer):
+        self.live.discard(consumer)
+    
+    async def drain(self, channel_layer, seconds):
+        """Ask every live socket to reconnect, spread evenly over `seconds`"""
+        self.draining = True
+        consumers = list(self.live)
+        random.shuffle(consumers)
+        ticks = max(1, int(seconds / DRAIN_TICK))
+        batch = max(1, math.ceil(len(consumers) / ticks))
+        logger.info('Draining %d WebSocket connections over %ss', len(consumers), seconds)
+        for start in range(0, len(consumers), batch):
+            for consumer in consumers[start:start + batch]:
+                await channel_layer.send(consumer.channel_name, {
+                    'type': 'server_draining',
+                    'retry_after': retry_after(busy=False),
+                })
+            await asyncio.sleep(DRAIN_TICK)
+
+
+_controls = weakref.WeakKeyDictionary()
+
+
+def get_admission():
+    """The AdmissionControl of the running event loop"""
+    loop = asyncio.get_running_loop()
+    control = _controls.get(loop)
+    if control is None:
+        control = _controls[loop] = AdmissionControl(
+            loop,
+            settings.CHAT_HANDSHAKE_CONCURRENCY,
+            settings.CHAT_HANDSHAKE_QUEUE,
+            settings.CHAT_HANDSHAKE_QUEUE_TIMEOUT
+        )
+        install_drain_handler(control)
+    return control
+
+
+def install_drain_handler(control):
+    """Drain on SIGTERM, then hand the signal to the server's own handler"""
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+        control.loop.add_signal_handler(signal.SIGTERM, lambda: control.loop.create_task(
+            drain_and_exit(control, previous)
+        ))
+    except (ValueError, RuntimeError, NotImplementedError):
+        # Not the main thread or no signal support (tests, Windows)
+        pass
+
+
+async def drain_and_exit(control, previous):
+    if control.draining:
+        return
+    from channels.layers import get_channel_layer
+    
+    try:
+        await control.drain(get_channel_layer(), settings.CHAT_DRAIN_SECONDS)
+    finally:
+        control.loop.remove_signal_handler(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, previous)
+        signal.raise_signal(signal.SIGTERM)
+
+
+async def reject(scope, receive, send, delay):
+    """Accept, send a reconnect hint and close, before any auth or DB work"""
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    subprotocol, wire_format = codecs.negotiate(scope.get('subprotocols'))
+    frame = codecs.encode({'type': 'reconnect', 'reason': 'busy', 'retry_after': delay}, wire_format)
+    await send({'type': 'websocket.accept', 'subprotocol': subprotocol})
+    if isinstance(frame, bytes):
+        await send({'type': 'websocket.send', 'bytes': frame})
+    else:
+        await send({'type': 'websocket.send', 'text': frame})
+    await send({'type': 'websocket.close', 'code': CLOSE_TRY_AGAIN_LATER})
+
+
+class AdmissionMiddleware:
+    """ASGI middleware limiting concurrent WebSocket handshakes per worker"""
+    
+    def __init__(self, inner):
+        self.inner = inner
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await self.inner(scope, receive, send)
+        
+        control = get_admission()
+        if not await control.acquire():
+            handshakes.inc('rejected')
+            return await reject(scope, receive, send, retry_after(
+                backlog_seconds=control.retry_delay()
+            ))
+        
+        # The slot is held until the handshake is answered either way
+        started = control.loop.time()
+        released = False
+        
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                control.release(started)
+        
+        async def tracked_send(message):
+            if message['type'] in ('websocket.accept', 'websocket.close'):
+                release()
+            await send(message)
+        
+        try:
+            return await self.inner(scope, receive, tracked_send)
+        finally:
+            release()
+
+
+@metrics.register_collector
+def _admission_stats():
+    controls = list(_controls.values())
+    in_flight = sum(control.in_flight for control in controls)
+    waiting = sum(control.waiting for control in controls)
+    live = sum(len(control.live) for control in controls)
+    yield 'chat_handshakes_in_flight', 'gauge', 'WebSocket handshakes being processed', in_flight
+    yield 'chat_handshakes_waiting', 'gauge', 'WebSocket handshakes queued for a slot', waiting
+    yield 'chat_admitted_sockets', 'gauge', 'Accepted WebSocket connections tracked for drain', live
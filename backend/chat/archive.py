@@ -0,0 +1,295 @@
+"""
+Tiered message retention: old messages move out of the Message table into
+compressed, append-only archive files.
+
+Each conversation keeps `retention_days` of history hot (empty uses
+CHAT_RETENTION_DAYS, 0 keeps everything). `manage.py archive_messages`
+moves older messages in batches of at most CHAT_ARCHIVE_BATCH_SIZE, one
+transaction per batch. A batch is appended to the conversation's file
+`<CHAT_ARCHIVE_ROOT>/<xx>/<conversation_id>.ndjson.gz` as one gzip member
+of NDJSON lines. An ArchiveSegment row records its byte range, id range and
+time range, and the hot rows are deleted. The newest message of a
+conversation always stays hot, so previews and inbox order never need the
+archive.
+
+Files are only appended to. A batch that fails after writing its member
+leaves bytes that no segment points at, so readers never see them; its
+messages are still hot and go into a later segment.
+
+MessageHistory puts a conversation's archive behind its hot queryset, so
+paging through the history endpoint carries on into the archive once it
+passes the hot window.
+"""
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+from functools import lru_cache
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import ArchiveSegment, Attachment, Conversation, Message
+from .versioning import coalesce_bumps
+
+# Conversations checked for due messages per query
+CONVERSATION_CHUNK_SIZE = 500
+
+# Decompressed segments kept per process; a segment never changes
+SEGMENT_CACHE_SIZE = 64
+
+MESSAGE_FIELDS = ('id', 'sender_id', 'content', 'is_read', 'client_nonce', 'created_at', 'updated_at')
+
+
+def archive_root():
+    return os.fspath(settings.CHAT_ARCHIVE_ROOT)
+
+
+def archive_path(conversation_id):
+    """Path of a conversation's archive file, relative to CHAT_ARCHIVE_ROOT"""
+    return os.path.join(f'{conversation_id % 256:02x}', f'{conversation_id}.ndjson.gz')
+
+
+def remove_archive(conversation_id):
+    try:
+        os.remove(os.path.join(archive_root(), archive_path(conversation_id)))
+    except FileNotFoundError:
+        pass
+
+
+def encode_record(row, attachment_ids):
+    return {
+        'id': row['id'],
+        'sender_id': row['sender_id'],
+        'content': row['content'],
+        'attachment_ids': attachment_ids,
+        'is_read': row['is_read'],
+        'nonce': row['client_nonce'],
+        'created_at': row['created_at'].isoformat(),
+        'updated_at': row['updated_at'].isoformat(),
+    }
+
+
+def decode_record(record, conversation_id):
+    message = Message(
+        id=record['id'],
+        conversation_id=conversation_id,
+        sender_id=record['sender_id'],
+        content=record['content'],
+        is_read=record['is_read'],
+        client_nonce=record['nonce'],
+        created_at=parse_datetime(record['created_at']),
+        updated_at=parse_datetime(record['updated_at']),
+    )
+    message._state.adding = False
+    return message
+
+
+def append_segment(conversation_id, records):
+    """Append `records` as one gzip member; return (path, offset, length)"""
+    path = archive_path(conversation_id)
+    full_path = os.path.join(archive_root(), path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    data = gzip.compress(b''.join(
+        json.dumps(record, separators=(',', ':')).encode() + b'\n' for record in records
+    ))
+    with open(full_path, 'ab') as f:
+        offset = f.tell()
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return path, offset, len(data)
+
+
+@lru_cache(maxsize=SEGMENT_CACHE_SIZE)
+def read_segment(path, offset, length, first_id):
+    """The records of one segment, oldest first; `first_id` only keys the cache"""
+    with open(os.path.join(archive_root(), path), 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    return tuple(json.loads(line) for line in gzip.decompress(data).splitlines())
+
+
+def archive_batch(conversation_id, cutoff, batch_size):
+    """Move up to `batch_size` messages older than `cutoff` into the archive"""
+    with transaction.atomic():
+        # Keeps two archivers off the same conversation (SQLite allows a
+        # single writer anyway)
+        list(Conversation.objects.select_for_update().filter(id=conversation_id).values_list('id'))
+        
+        newest = Message.objects.filter(
+            conversation_id=conversation_id
+        ).aggregate(newest=Max('created_at'))['newest']
+        if newest is None:
+            return 0
+        rows = list(Message.objects.filter(
+            conversation_id=conversation_id,
+            created_at__lt=min(cutoff, newest)
+        ).order_by('created_at', 'id').values(*MESSAGE_FIELDS)[:batch_size])
+        if not rows:
+            return 0
+        
+        ids = [row['id'] for row in rows]
+        attachment_ids = {}
+        links = Message.attachments.through.objects.filter(
+            message_id__in=ids
+        ).values_list('message_id', 'attachment_id')
+        for message_id, attachment_id in links:
+            attachment_ids.setdefault(message_id, []).append(attachment_id)
+        
+        path, offset, length = append_segment(conversation_id, [
+            encode_record(row, sorted(attachment_ids.get(row['id'], []))) for row in rows
+        ])
+        ArchiveSegment.objects.create(
+            conversation_id=conversation_id,
+            path=path,
+            offset=offset,
+            length=length,
+            message_count=len(rows),
+            first_id=rows[0]['id'],
+            last_id=rows[-1]['id'],
+            first_created_at=rows[0]['created_at'],
+            last_created_at=rows[-1]['created_at'],
+        )
+        with coalesce_bumps():
+            Message.objects.filter(id__in=ids).delete()
+    return len(rows)
+
+
+def due_conversations(chunk, now):
+    """Ids among `chunk` of (id, retention_days) with messages past retention"""
+    cutoffs = {}
+    for conversation_id, days in chunk:
+        days = settings.CHAT_RETENTION_DAYS if days is None else days
+        if days:
+            cutoffs.setdefault(days, []).append(conversation_id)
+    
+    due = {}
+    for days, ids in cutoffs.items():
+        cutoff = now - timedelta(days=days)
+        for conversation_id in Message.objects.filter(
+            conversation_id__in=ids,
+            created_at__lt=cutoff
+        ).order_by().values_list('conversation_id', flat=True).distinct():
+            due[conversation_id] = cutoff
+    return sorted(due.items())
+
+
+def run_retention(batch_size=None, max_batches=None, pause=0, now=None):
+    """
+    Archive every conversation's messages past retention.
+    
+    Yields (conversation_id, moved) per batch; stops after `max_batches`
+    batches and sleeps `pause` seconds between them.
+    """
+    batch_size = batch_size or settings.CHAT_ARCHIVE_BATCH_SIZE
+    now = now or timezone.now()
+    batches = 0
+    last_id = 0
+    while True:
+        chunk = list(Conversation.objects.filter(id__gt=last_id).order_by('id').values_list(
+            'id', 'retention_days'
+        )[:CONVERSATION_CHUNK_SIZE])
+        if not chunk:
+            return
+        last_id = chunk[-1][0]
+        
+        for conversation_id, cutoff in due_conversations(chunk, now):
+            while True:
+                if max_batches is not None and batches >= max_batches:
+                    return
+                moved = archive_batch(conversation_id, cutoff, batch_size)
+                if not moved:
+                    break
+                batches += 1
+                yield conversation_id, moved
+                if pause:
+                    time.sleep(pause)
+                if moved < batch_size:
+                    break
+
+
+def attach_related(messages):
+    """Load senders and attachments of archived messages in two queries"""
+    senders = get_user_model().objects.in_bulk({m.sender_id for m in messages})
+    attachment_ids = {i for m in messages for i in m.archived_attachment_ids}
+    attachments = Attachment.objects.select_related('blob').in_bulk(attachment_ids) if attachment_ids else {}
+    
+    loaded = []
+    for message in messages:
+        sender = senders.get(message.sender_id)
+        if sender is None:
+            # The hot table would have dropped these with the sender
+            continue
+        message.sender = sender
+        queryset = message.attachments.get_queryset()
+        queryset._result_cache = [
+            attachments[i] for i in message.archived_attachment_ids if i in attachments
+        ]
+        queryset._prefetch_done = True
+        message._prefetched_objects_cache = {'attachments': queryset}
+        loaded.append(message)
+    return loaded
+
+
+class MessageHistory:
+    """
+    A conversation's hot messages (newest first) followed by its archive.
+    
+    Supports count() and slicing, which is all Django's Paginator needs.
+    """
+    
+    def __init__(self, queryset, conversation_id, user):
+        self.queryset = queryset
+        self.conversation_id = conversation_id
+        # Newest first; the participant join keeps outsiders out as the hot
+        # queryset does
+        self.segments = list(ArchiveSegment.objects.filter(
+            conversation_id=conversation_id,
+            conversation__participants__user=user
+        ).order_by('-last_created_at', '-id').values_list(
+            'path', 'offset', 'length', 'first_id', 'message_count'
+        ))
+        self._hot_count = None
+    
+    def hot_count(self):
+        if self._hot_count is None:
+            self._hot_count = self.queryset.count()
+        return self._hot_count
+    
+    def count(self):
+        return self.hot_count() + sum(segment[-1] for segment in self.segments)
+    
+    def __len__(self):
+        return self.count()
+    
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        stop = self.count() if index.stop is None else index.stop
+        hot_count = self.hot_count()
+        
+        messages = list(self.queryset[start:min(stop, hot_count)]) if start < hot_count else []
+        if stop > hot_count:
+            messages += self.archived(max(start - hot_count, 0), stop - hot_count)
+        return messages
+    
+    def archived(self, start, stop):
+        """Archived messages `start` to `stop`, counting from the newest"""
+        messages = []
+        position = 0
+        for path, offset, length, first_id, count in self.segments:
+            if position >= stop:
+                break
+            if position + count > start:
+                records = read_segment(path, offset, length, first_id)[::-1]
+                for record in records[max(start - position, 0):stop - position]:
+                    message = decode_record(record, self.conversation_id)
+                    message.archived_attachment_ids = record['attachment_ids']
+                    messages.append(message)
+            position += count
+        return attach_related(messages)
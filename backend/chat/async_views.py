@@ -0,0 +1,43 @@
+"""
+The hottest REST endpoints (conversation list, message history,
+mark-read and message send) served from their own database threads.
+
+Under ASGI every sync view runs in a thread asgiref starts for the
+request, so REST bursts are sized by nothing but the traffic. These
+endpoints instead get async views that run the unchanged DRF view,
+dispatch and all, on one of CHAT_REST_DB_THREADS threads (chat.pools).
+Requests beyond the pool wait on the event loop without a thread, and
+the consumers' CHAT_WS_DB_THREADS threads are never taken.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .pools import rest_view
+
+# Router URL names served from the REST threads
+ROUTES = {'conversation-list', 'conversation-mark-read', 'message-list'}
+
+
+def fast_path(view_func):
+    """An async view running `view_func` on a REST thread"""
+    pooled = rest_view(view_func)
+    fallback = sync_to_async(view_func)
+    
+    async def view(request, *args, **kwargs):
+        if not settings.CHAT_ASYNC_VIEWS:
+            return await fallback(request, *args, **kwargs)
+        return await pooled(request, *args, **kwargs)
+    
+    # What DRF's view function carries, for csrf and the request metrics
+    view.cls = view_func.cls
+    view.initkwargs = view_func.initkwargs
+    view.actions = view_func.actions
+    view.csrf_exempt = True
+    return view
+
+
+def with_fast_paths(urlpatterns):
+    """The router's URL patterns, with the hot endpoints served from REST threads"""
+    for pattern in urlpatterns:
+        if pattern.name in ROUTES:
+            pattern.callback = fast_path(pattern.callback)
+    return urlpatterns
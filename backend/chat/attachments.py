@@ -0,0 +1,243 @@
+"""
+Chunked, resumable uploads into content-addressed attachment storage.
+
+A client opens an UploadSession, then PATCHes byte ranges in order. The
+partial file on disk is the source of truth for how much has arrived, so an
+interrupted client resumes from `received`. When the last byte lands the
+file is hashed, moved to `<root>/<aa>/<bb>/<sha256>` (or dropped, if that
+content already exists) and an Attachment is created for it.
+
+Each chunk is appended under an exclusive lock on the partial file
+(flock, or msvcrt on Windows), so two PATCHes at the same offset cannot
+both be written. Sessions left unfinished for ATTACHMENT_UPLOAD_EXPIRY
+seconds are deleted with their partial files by `expire_uploads()` (the
+`expire_uploads` command).
+"""
+import hashlib
+import os
+import re
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import Attachment, AttachmentBlob, UploadSession
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+COPY_BUFFER_SIZE = 64 * 1024
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class UploadOffsetMismatch(Exception):
+    """The chunk does not start where the stored upload ends"""
+    
+    def __init__(self, expected):
+        super().__init__(f'Expected chunk at offset {expected}')
+        self.expected = expected
+
+
+def attachment_root():
+    return os.fspath(settings.ATTACHMENT_ROOT)
+
+
+def part_path(session):
+    return os.path.join(attachment_root(), 'partial', f'{session.id}.part')
+
+
+def blob_path(sha256):
+    return os.path.join(sha256[:2], sha256[2:4], sha256)
+
+
+def received_bytes(session):
+    try:
+        return os.path.getsize(part_path(session))
+    except FileNotFoundError:
+        return 0
+
+
+def parse_content_range(header):
+    """Parse `bytes start-end/total` into (start, length, total)"""
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        return None
+    start, end, total = (int(g) for g in match.groups())
+    if end < start:
+        return None
+    return start, end - start + 1, total
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range `Range` header into (start, length).
+
+    Returns None when there is no usable range (serve the whole file) and
+    raises ValueError when the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or size == 0:
+        return None
+    first, last = match.groups()
+    if first == '' and last == '':
+        return None
+    if first == '':
+        # Suffix range: the final N bytes
+        length = min(int(last), size)
+        if length == 0:
+            raise ValueError('Unsatisfiable range')
+        return size - length, length
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError('Unsatisfiable range')
+    return start, end - start + 1
+
+
+@contextmanager
+def locked(f):
+    """Hold an exclusive lock on open file `f`, waiting for other writers"""
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+        return
+    # msvcrt locks a byte range from the current position, and LK_LOCK
+    # gives up after 10 seconds, so keep trying for byte 0
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            break
+        except OSError:
+            continue
+    try:
+        yield
+    finally:
+        f.flush()
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def write_chunk(session, stream, offset, length):
+    """
+    Append `length` bytes from `stream` at `offset`, never holding more
+    than COPY_BUFFER_SIZE in memory. Returns the new received size.
+    """
+    path = part_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Concurrent writers of the same session queue for the lock, then see
+    # the size the previous one left
+    with open(path, 'ab') as f, locked(f):
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            raise UploadOffsetMismatch(current)
+
+        remaining = length
+        while remaining > 0:
+            chunk = stream.read(min(COPY_BUFFER_SIZE, remaining))
+            if not chunk:
+                break
+            f.write(chunk)
+            remaining -= len(chunk)
+        f.flush()
+        return os.fstat(f.fileno()).st_size
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_blob(source_path):
+    """Move a finished upload into content-addressed storage"""
+    sha256 = hash_file(source_path)
+    size = os.path.getsize(source_path)
+
+    blob = AttachmentBlob.objects.filter(sha256=sha256).first()
+    if blob is not None:
+        os.remove(source_path)
+        return blob
+
+    relative = blob_path(sha256)
+    destination = os.path.join(attachment_root(), relative)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    os.replace(source_path, destination)
+
+    try:
+        with transaction.atomic():
+            return AttachmentBlob.objects.create(sha256=sha256, path=relative, size=size)
+    except IntegrityError:
+        # Another upload of the same content won the race; the file we
+        # moved into place is byte-identical, so keep it.
+        return AttachmentBlob.objects.get(sha256=sha256)
+
+
+def complete_upload(session):
+    """Turn a fully received session into an Attachment"""
+    blob = store_blob(part_path(session))
+    attachment = Attachment.objects.create(
+        blob=blob,
+        uploaded_by=session.user,
+        filename=session.filename,
+        content_type=session.content_type
+    )
+    session.attachment = attachment
+    session.received = session.size
+    session.save(update_fields=['attachment', 'received', 'updated_at'])
+    return attachment
+
+
+def expire_uploads(max_age=None):
+    """
+    Delete sessions not written to for `max_age` seconds (default
+    ATTACHMENT_UPLOAD_EXPIRY) and their partial files, plus partial files
+    older than that with no session. Returns (sessions, files) removed.
+    """
+    max_age = settings.ATTACHMENT_UPLOAD_EXPIRY if max_age is None else max_age
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    stale = UploadSession.objects.filter(attachment__isnull=True, updated_at__lt=cutoff)
+
+    files = 0
+    for session in stale.iterator():
+        try:
+            os.remove(part_path(session))
+            files += 1
+        except FileNotFoundError:
+            pass
+    sessions, _ = stale.delete()
+
+    partial = os.path.join(attachment_root(), 'partial')
+    try:
+        names = os.listdir(partial)
+    except FileNotFoundError:
+        names = []
+    live = {f'{pk}.part' for pk in UploadSession.objects.values_list('id', flat=True)}
+    for name in names:
+        path = os.path.join(partial, name)
+        if name not in live and os.path.getmtime(path) < time.time() - max_age:
+            os.remove(path)
+            files += 1
+    return sessions, files
+
+
+def read_file_range(path, start, length, block_size=COPY_BUFFER_SIZE):
+    """Yield `length` bytes of `path` starting at `start`"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(block_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,64 @@
+"""
+Wire formats for WebSocket frames.
+
+Clients that offer the `chat.msgpack` subprotocol exchange binary
+MessagePack frames; everyone else gets JSON text frames. Broadcast events
+carry the payload already encoded in every format, so a message is
+serialized once per broadcast instead of once per receiving connection.
+"""
+import json
+
+import msgpack
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+FORMATS = (JSON, MSGPACK)
+
+# Subprotocol offered in Sec-WebSocket-Protocol -> wire format
+SUBPROTOCOLS = {
+    'chat.msgpack': MSGPACK,
+    'chat.json': JSON,
+}
+
+
+class FrameDecodeError(ValueError):
+    """An inbound frame is not a valid JSON or MessagePack object"""
+
+
+def negotiate(offered):
+    """
+    Pick the wire format for a connection.
+
+    Returns (subprotocol, format); subprotocol is None when the client did
+    not offer one we speak, in which case the connection falls back to JSON.
+    """
+    for subprotocol in offered or ():
+        if subprotocol in SUBPROTOCOLS:
+            return subprotocol, SUBPROTOCOLS[subprotocol]
+    return None, JSON
+
+
+def encode(payload, wire_format):
+    """Encode payload as a text (JSON) or bytes (MessagePack) frame"""
+    if wire_format == MSGPACK:
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload)
+
+
+def encode_frames(payload, formats=FORMATS):
+    """Encode payload once per wire format: {format: frame}"""
+    return {wire_format: encode(payload, wire_format) for wire_format in formats}
+
+
+def decode(text_data=None, bytes_data=None):
+    """Decode an inbound frame; binary frames are MessagePack, text is JSON"""
+    try:
+        if bytes_data is not None:
+            data = msgpack.unpackb(bytes_data, raw=False)
+        else:
+            data = json.loads(text_data)
+    except (TypeError, ValueError) as e:
+        raise FrameDecodeError(str(e)) from e
+    if not isinstance(data, dict):
+        raise FrameDecodeError('frame must be an object')
+    return data
@@ -1,14 +1,83 @@
-import json
+import asyncio
+import logging
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import Conversation, Message, Participant
+from django.db import transaction
+from django.urls import reverse
+from . import codecs, metrics
+from .admission import CLOSE_SERVICE_RESTART, get_admission
+from .encoders import encode_messages, message_row
+from .models import Attachment, Conversation, Message, Participant
+from .fanout import get_fanout
+from .idempotency import clean_nonce, create_once
+from .inbox import large_room_ids
+from .metrics import database_sync_to_async
+from .outbound import OutboundQueue, SlowConsumer
+from .profiling import Profiler, can_profile
+from .rooms import inbox_group_name, room_event, room_group_name, user_group_name
+from .tracing import MessageTrace, mark_delivered, stage_seconds
 from .serializers import MessageSerializer
+from .throttling import get_rate_limiter
+from .versioning import bump_presence
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
+# Close codes (4000-4999 are app-defined)
+CLOSE_REVOKED = 4001
+CLOSE_REMOVED = 4003
+CLOSE_SLOW_CONSUMER = 4008
 
-class ChatConsumer(AsyncWebsocketConsumer):
+
+def clean_attachment_ids(value):
+    """A frame's attachment ids as a list of ints, or None if malformed"""
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(
+        isinstance(pk, int) and not isinstance(pk, bool) for pk in value
+    ):
+        return None
+    return value
+
+
+class LargeRoomInboxMixin:
+    """
+    Inbox deltas of large rooms, received through the process relay from
+    each room's `inbox_<id>` group (see chat.inbox)
+    """
+    
+    async def join_large_room_inboxes(self):
+        self.large_room_inboxes = set()
+        for conversation_id in await database_sync_to_async(large_room_ids)(self.user.id):
+            await self.join_large_room_inbox(conversation_id)
+    
+    async def join_large_room_inbox(self, conversation_id):
+        if conversation_id not in self.large_room_inboxes:
+            self.large_room_inboxes.add(conversation_id)
+            await get_fanout().join(inbox_group_name(conversation_id), self)
+    
+    async def leave_large_room_inboxes(self):
+        for conversation_id in list(getattr(self, 'large_room_inboxes', ())):
+            await self.leave_large_room_inbox(conversation_id)
+    
+    async def leave_large_room_inbox(self, conversation_id):
+        if conversation_id in self.large_room_inboxes:
+            self.large_room_inboxes.discard(conversation_id)
+            await get_fanout().leave(inbox_group_name(conversation_id), self)
+    
+    async def inbox_membership(self, event):
+        """The user joined or left a large room while this socket is open"""
+        if not hasattr(self, 'large_room_inboxes'):
+            return
+        if event['member']:
+            await self.join_large_room_inbox(event['conversation_id'])
+        else:
+            await self.leave_large_room_inbox(event['conversation_id'])
+
+
+class ChatConsumer(LargeRoomInboxMixin, AsyncWebsocketConsumer):
     """WebSocket consumer for real-time chat"""
     
     async def connect(self):
@@ -20,7 +89,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return
         
         self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
-        self.room_group_name = f'chat_{self.conversation_id}'
+        self.room_group_name = room_group_name(self.conversation_id)
+        self.large_room = False
+        self.profile_next = False
         
         # Check if user is participant
         is_participant = await self.check_participant()
@@ -28,117 +99,293 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
-        # Join room group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
+        # Wire format negotiated from Sec-WebSocket-Protocol (JSON by default)
+        self.subprotocol, self.wire_format = codecs.negotiate(self.scope.get('subprotocols'))
+        
+        # Events that arrive before accept() wait here
+        self.outbound = OutboundQueue(
+            maxsize=settings.CHAT_OUTBOUND_QUEUE_SIZE,
+            hard_limit=settings.CHAT_OUTBOUND_HARD_LIMIT,
+            slow_timeout=settings.CHAT_SLOW_CONSUMER_TIMEOUT,
+            ack_window=settings.CHAT_OUTBOUND_ACK_WINDOW
         )
         
+        # Large rooms are joined once per process through the fan-out relay
+        # and get no typing or presence traffic
+        self.large_room = await self.count_members() >= settings.CHAT_LARGE_ROOM_SIZE
+        
+        # Join room group, and the user's own group for logouts
+        await self.join_room()
+        self.token_jti = (self.scope.get('token') or {}).get('jti')
+        self.user_group_name = user_group_name(self.user.id)
+        await self.channel_layer.group_add(self.user_group_name, self.channel_name)
+        await self.join_large_room_inboxes()
+        
         # Update user online status
         await self.update_user_status(True)
         
-        await self.accept()
+        await self.accept(subprotocol=self.subprotocol)
+        self.writer_task = asyncio.create_task(self.drain_outbound())
+        metrics.websocket_connections.inc()
+        get_admission().register(self)
         
         # Notify others that user is online
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
+        if not self.large_room:
+            await self.broadcast('user_status', {
                 'type': 'user_status',
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'is_online': True
-            }
-        )
+            })
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
+        if hasattr(self, 'writer_task'):
+            self.writer_task.cancel()
+            metrics.websocket_connections.dec()
+            get_admission().unregister(self)
+        
         if hasattr(self, 'room_group_name'):
             # Update user online status
             await self.update_user_status(False)
             
             # Notify others that user is offline
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
+            if not self.large_room:
+                await self.broadcast('user_status', {
                     'type': 'user_status',
                     'user_id': self.user.id,
                     'username': self.user.username,
                     'is_online': False
-                }
-            )
+                })
             
             # Leave room group
-            await self.channel_layer.group_discard(
-                self.room_group_name,
-                self.channel_name
-            )
+            await self.leave_room()
+        
+        if hasattr(self, 'user_group_name'):
+            await self.channel_layer.group_discard(self.user_group_name, self.channel_name)
+        await self.leave_large_room_inboxes()
     
-    async def receive(self, text_data):
-        """Receive message from WebSocket"""
+    async def receive(self, text_data=None, bytes_data=None):
+        """Receive a JSON text or MessagePack binary frame from WebSocket"""
         try:
-            data = json.loads(text_data)
-            message_type = data.get('type', 'message')
+            data = codecs.decode(text_data, bytes_data)
+        except codecs.FrameDecodeError:
+            return
+        message_type = data.get('type', 'message')
+        
+        if message_type == 'ack':
+            if hasattr(self, 'outbound'):
+                self.outbound.ack(data.get('received'))
+        elif message_type == 'profile':
+            await self.arm_profiler()
+        elif self.profile_next:
+            self.profile_next = False
+            await self.profile_frame(message_type, data)
+        else:
+            await self.handle_frame(message_type, data)
+    
+    async def handle_frame(self, message_type, data):
+        """Act on one decoded client frame"""
+        if message_type == 'message':
+            metrics.messages_received.inc()
+            trace = MessageTrace()
+            content = data.get('content', '').strip()
+            attachment_ids = clean_attachment_ids(data.get('attachment_ids'))
+            if attachment_ids is None:
+                await self.enqueue('control', codecs.encode_frames({
+                    'type': 'error',
+                    'field': 'attachment_ids',
+                    'error': 'Expected a list of attachment ids.'
+                }, formats=(self.wire_format,)))
+                return
+            if not content and not attachment_ids:
+                return
             
-            if message_type == 'message':
-                content = data.get('content', '').strip()
-                if not content:
-                    return
-                
-                # Save message to database
-                message = await self.save_message(content)
-                
-                if message:
-                    # Broadcast message to room group
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'chat_message',
-                            'message': message
-                        }
-                    )
+            limit, retry_after = await self.check_rate_limit(
+                ('user_messages', self.user.id),
+                ('conversation_messages', self.conversation_id)
+            )
+            if limit:
+                await self.enqueue('control', codecs.encode_frames({
+                    'type': 'throttled',
+                    'limit': limit,
+                    'retry_after': round(retry_after, 3)
+                }, formats=(self.wire_format,)))
+                return
             
-            elif message_type == 'typing':
-                # Broadcast typing indicator
-                is_typing = data.get('is_typing', False)
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'typing_indicator',
-                        'user_id': self.user.id,
-                        'username': self.user.username,
-                        'is_typing': is_typing
-                    }
-                )
+            # Save message to database
+            nonce = clean_nonce(data.get('nonce'))
+            message, created = await self.save_message(content, attachment_ids, nonce)
+            
+            if message and not created:
+                # A retried send: answer the sender alone with the stored message
+                await self.enqueue('message', codecs.encode_frames({
+                    'type': 'message',
+                    'message': message
+                }, formats=(self.wire_format,)))
+            elif message:
+                trace.mark_persisted()
                 
-        except json.JSONDecodeError:
-            pass
+                # Broadcast message to room group
+                await self.broadcast('chat_message', {
+                    'type': 'message',
+                    'message': message
+                }, trace=trace.event_data())
+                trace.mark_published(message['id'], self.conversation_id)
+                metrics.messages_broadcast.inc()
+        
+        elif message_type == 'typing':
+            if self.large_room:
+                return
+            
+            # Typing indicators are best-effort, so excess ones are dropped
+            limit, _ = await self.check_rate_limit(('user_typing', self.user.id))
+            if limit:
+                return
+            
+            # Broadcast typing indicator
+            is_typing = data.get('is_typing', False)
+            await self.broadcast('typing_indicator', {
+                'type': 'typing',
+                'user_id': self.user.id,
+                'username': self.user.username,
+                'is_typing': is_typing
+            }, user_id=self.user.id)
+    
+    async def arm_profiler(self):
+        """Profile the next frame from this connection (staff only)"""
+        allowed = can_profile(self.user)
+        self.profile_next = allowed
+        await self.enqueue('control', codecs.encode_frames({
+            'type': 'profile',
+            'status': 'armed' if allowed else 'forbidden'
+        }, formats=(self.wire_format,)))
+    
+    async def profile_frame(self, message_type, data):
+        """
+        Handle one frame under the profiler.
+        
+        cProfile sees the event loop thread, so other connections' work that
+        interleaves with this frame shows up too; queries run in database
+        threads appear in the SQL timeline.
+        """
+        label = f'{message_type} in conversation {self.conversation_id}'
+        with Profiler('websocket', label, self.user) as profiler:
+            await self.handle_frame(message_type, data)
+        profile_id = await sync_to_async(profiler.save, thread_sensitive=False)()
+        if profile_id:
+            reply = {
+                'type': 'profile',
+                'status': 'saved',
+                'id': profile_id,
+                'url': reverse('admin-profile-detail', args=[profile_id])
+            }
+        else:
+            reply = {'type': 'profile', 'status': 'busy'}
+        await self.enqueue('control', codecs.encode_frames(reply, formats=(self.wire_format,)))
+    
+    async def broadcast(self, handler, payload, **extra):
+        """
+        Send payload to the room group, encoded once in every wire format.
+        
+        Receivers forward the pre-encoded frame for their own format, so
+        fan-out to N connections costs one serialization, not N.
+        """
+        event = room_event(self.conversation_id, handler, payload, **extra)
+        with metrics.channel_layer_send_seconds.time(handler):
+            await self.channel_layer.group_send(self.room_group_name, event)
+    
+    async def join_room(self):
+        if self.large_room:
+            await get_fanout().join(self.room_group_name, self)
+        else:
+            await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        self.in_room = True
+        metrics.group_joins.inc('relay' if self.large_room else 'direct')
+    
+    async def leave_room(self):
+        if not getattr(self, 'in_room', False):
+            return
+        self.in_room = False
+        if self.large_room:
+            await get_fanout().leave(self.room_group_name, self)
+        else:
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        metrics.group_leaves.inc('relay' if self.large_room else 'direct')
     
     async def chat_message(self, event):
         """Send message to WebSocket"""
-        await self.send(text_data=json.dumps({
-            'type': 'message',
-            'message': event['message']
-        }))
+        await self.enqueue('message', event['frames'], trace=event.get('trace'))
     
     async def typing_indicator(self, event):
         """Send typing indicator to WebSocket"""
         # Don't send typing indicator to the sender
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'typing',
-                'user_id': event['user_id'],
-                'username': event['username'],
-                'is_typing': event['is_typing']
-            }))
+            await self.enqueue('typing', event['frames'])
     
     async def user_status(self, event):
         """Send user status update to WebSocket"""
-        await self.send(text_data=json.dumps({
-            'type': 'user_status',
-            'user_id': event['user_id'],
-            'username': event['username'],
-            'is_online': event['is_online']
-        }))
+        await self.enqueue('user_status', event['frames'])
+    
+    async def members_changed(self, event):
+        """Forward a membership change; removed members are disconnected"""
+        if self.user.id in event['removed']:
+            await self.send_frame(event['frames'][self.wire_format])
+            await self.close(code=CLOSE_REMOVED)
+            return
+        await self.enqueue('members', event['frames'])
+    
+    async def inbox_update(self, event):
+        """Forward an unread/preview delta for any of the user's conversations"""
+        await self.enqueue('inbox', event['frames'])
+    
+    async def session_revoked(self, event):
+        """Close connections opened with a revoked token (all of them for jti None)"""
+        if event['jti'] is not None and event['jti'] != self.token_jti:
+            return
+        await self.send_frame(event['frames'][self.wire_format])
+        await self.close(code=CLOSE_REVOKED)
+    
+    async def server_draining(self, event):
+        """The worker is shutting down: ask the client to reconnect elsewhere"""
+        await self.send_frame(codecs.encode({
+            'type': 'reconnect',
+            'reason': 'restart',
+            'retry_after': event['retry_after']
+        }, self.wire_format))
+        await self.close(code=CLOSE_SERVICE_RESTART)
+    
+    async def check_rate_limit(self, *checks):
+        """Take tokens from the given buckets without blocking the event loop"""
+        limiter = get_rate_limiter()
+        if limiter.store.shared:
+            return await sync_to_async(limiter.check, thread_sensitive=False)(*checks)
+        return limiter.check(*checks)
+    
+    async def enqueue(self, kind, frames, trace=None):
+        """Buffer an outgoing event; drop the connection if it can't keep up"""
+        if not hasattr(self, 'outbound'):
+            return
+        try:
+            self.outbound.put(kind, (frames[self.wire_format], trace))
+        except SlowConsumer as e:
+            logger.warning('Disconnecting slow consumer %s: %s', self.channel_name, e)
+            if hasattr(self, 'writer_task'):
+                self.writer_task.cancel()
+            await self.close(code=CLOSE_SLOW_CONSUMER)
+    
+    async def drain_outbound(self):
+        """Writer task: send queued events in priority order"""
+        while True:
+            kind, (frame, trace) = await self.outbound.get()
+            await self.send_frame(frame)
+            mark_delivered(trace, self.channel_name)
+    
+    async def send_frame(self, frame):
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
     
     @database_sync_to_async
     def check_participant(self):
@@ -153,22 +400,96 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return False
     
     @database_sync_to_async
-    def save_message(self, content):
-        """Save message to database"""
+    def count_members(self):
+        return Participant.objects.filter(conversation_id=self.conversation_id).count()
+    
+    @database_sync_to_async
+    def save_message(self, content, attachment_ids=(), nonce=None):
+        """Save message to database; returns (serialized message, created)"""
         try:
             conversation = Conversation.objects.get(id=self.conversation_id)
-            message = Message.objects.create(
-                conversation=conversation,
-                sender=self.user,
-                content=content
-            )
-            serializer = MessageSerializer(message)
-            return serializer.data
+            attachments = list(Attachment.objects.filter(
+                id__in=attachment_ids,
+                uploaded_by=self.user
+            ).select_related('blob'))
+            if not content and not attachments:
+                return None, False
+            
+            def create():
+                message = Message.objects.create(
+                    conversation=conversation,
+                    sender=self.user,
+                    content=content,
+                    client_nonce=nonce
+                )
+                if attachments:
+                    message.attachments.set(attachments)
+                return message
+            
+            with stage_seconds.time('insert'), transaction.atomic():
+                message, created = create_once(self.user.id, conversation.id, nonce, create)
+            with stage_seconds.time('serialize'):
+                if settings.CHAT_FAST_ENCODERS:
+                    # A replayed send carries the attachments it was stored with
+                    row = message_row(message, attachments if created else None)
+                    return encode_messages([row])[0], created
+                serializer = MessageSerializer(message)
+                return serializer.data, created
         except Conversation.DoesNotExist:
-            return None
+            return None, False
     
     @database_sync_to_async
     def update_user_status(self, is_online):
         """Update user online status"""
-        User.objects.filter(id=self.user.id).update(is_online=is_online)
+        changed = User.objects.filter(id=self.user.id).exclude(
+            is_online=is_online
+        ).update(is_online=is_online)
+        if changed:
+            bump_presence(self.user.id)
 
+
+class InboxConsumer(LargeRoomInboxMixin, AsyncWebsocketConsumer):
+    """
+    Per-user socket carrying only inbox deltas (see chat.inbox), for clients
+    with no conversation open. Chat sockets receive the same deltas.
+    """
+    
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user or not self.user.is_authenticated:
+            await self.close()
+            return
+        
+        self.subprotocol, self.wire_format = codecs.negotiate(self.scope.get('subprotocols'))
+        self.token_jti = (self.scope.get('token') or {}).get('jti')
+        self.user_group_name = user_group_name(self.user.id)
+        await self.channel_layer.group_add(self.user_group_name, self.channel_name)
+        await self.join_large_room_inboxes()
+        await self.accept(subprotocol=self.subprotocol)
+        get_admission().register(self)
+    
+    async def disconnect(self, close_code):
+        if hasattr(self, 'user_group_name'):
+            get_admission().unregister(self)
+            await self.channel_layer.group_discard(self.user_group_name, self.channel_name)
+            await self.leave_large_room_inboxes()
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        """The inbox socket is server-to-client only"""
+    
+    async def inbox_update(self, event):
+        await self.send_frame(event['frames'][self.wire_format])
+    
+    async def session_revoked(self, event):
+        if event['jti'] is not None and event['jti'] != self.token_jti:
+            return
+        await self.send_frame(event['frames'][self.wire_format])
+        await self.close(code=CLOSE_REVOKED)
+    
+    server_draining = ChatConsumer.server_draining
+    
+    async def send_frame(self, frame):
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
@@ -0,0 +1,307 @@
+"""
+Fast encoders for message pages, broadcasts and conversation list pages.
+
+MessageSerializer and ConversationListSerializer resolve every field of
+every object through DRF, follow dotted sources and build each avatar URL
+through the storage backend. The encoders here produce the same dicts
+straight from values() rows:
+- Avatar URLs are the storage's base URL, made absolute once per page,
+  followed by the quoted file name.
+- Datetimes are formatted with the DATETIME_FORMAT and time zone looked up
+  once per page.
+- Attachments, last messages, unread counts and participants each come
+  from one query per page.
+
+They only cover the default shape. Requests with `?fields=` or `?expand=`
+still go through the serializers, as does everything when
+CHAT_FAST_ENCODERS is off. chat.tests.test_encoders checks that both
+produce the same output.
+"""
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db.models import OuterRef, Subquery, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from accounts.serializers import requested_fields
+from .inbox import PREVIEW_LENGTH, unread_count
+from .membership import listed_members
+from .models import Conversation, Message, Participant
+from .pagination import ParticipantPagination
+
+MESSAGE_COLUMNS = (
+    'id', 'conversation_id', 'sender_id', 'sender__username', 'sender__first_name',
+    'sender__last_name', 'sender__avatar', 'sender__avatar_variants', 'content',
+    'client_nonce', 'is_read', 'created_at', 'updated_at'
+)
+
+CONVERSATION_COLUMNS = ('id', 'name', 'is_group', 'member_count', 'created_at', 'updated_at')
+
+PARTICIPANT_COLUMNS = (
+    'id', 'conversation_id', 'user_id', 'user__username', 'user__first_name',
+    'user__last_name', 'user__avatar', 'user__avatar_variants', 'user__is_online',
+    'joined_at', 'last_read_at'
+)
+
+ATTACHMENT_COLUMNS = (
+    'message_id', 'attachment_id', 'attachment__filename', 'attachment__content_type',
+    'attachment__blob__size', 'attachment__blob__sha256', 'attachment__created_at'
+)
+
+
+def use_encoders(request):
+    """Whether `request` asks for the default shape the encoders produce"""
+    return settings.CHAT_FAST_ENCODERS and requested_fields(request) == (None, {})
+
+
+def datetime_formatter():
+    """DRF's DateTimeField.to_representation, for the current time zone"""
+    output_format = api_settings.DATETIME_FORMAT
+    if not settings.USE_TZ or output_format is None:
+        return serializers.DateTimeField().to_representation
+    tz = timezone.get_current_timezone()
+    
+    if output_format.lower() == ISO_8601:
+        def format_datetime(value):
+            if not value:
+                return None
+            value = value.astimezone(tz).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return format_datetime
+    
+    def format_datetime(value):
+        return value.astimezone(tz).strftime(output_format) if value else None
+    return format_datetime
+
+
+def avatar_formatter(request=None, variant='sm'):
+    """
+    accounts.thumbnails.avatar_url() for a user's avatar name and variants.
+    File system storage URLs are built from a prefix worked out once.
+    """
+    prefix = None
+    if isinstance(default_storage, FileSystemStorage):
+        base_url = default_storage.base_url
+        if request is None:
+            prefix = base_url
+        elif base_url.startswith('/') and not base_url.startswith('//'):
+            prefix = request.build_absolute_uri(base_url)
+    
+    def avatar(name, variants):
+        if not name:
+            return None
+        variants = variants or {}
+        if variants.get('source') == name and variant in variants:
+            name = variants[variant]
+        path = filepath_to_uri(name).lstrip('/')
+        # Anything urljoin() or build_absolute_uri() would rewrite
+        if prefix is None or ':' in path or '/.' in '/' + path:
+            url = default_storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+        return prefix + path
+    return avatar
+
+
+def full_name(first_name, last_name, username):
+    return f"{first_name} {last_name}".strip() or username
+
+
+def message_row(message, attachments=None):
+    """
+    A Message as one of its MESSAGE_COLUMNS rows, carrying `attachments`
+    (by default the message's own) so they are not looked up again
+    """
+    sender = message.sender
+    if attachments is None:
+        if 'attachments' in getattr(message, '_prefetched_objects_cache', {}):
+            attachments = message.attachments.all()
+        else:
+            attachments = message.attachments.select_related('blob')
+    return {
+        'id': message.id,
+        'conversation_id': message.conversation_id,
+        'sender_id': message.sender_id,
+        'sender__username': sender.username,
+        'sender__first_name': sender.first_name,
+        'sender__last_name': sender.last_name,
+        'sender__avatar': sender.avatar.name,
+        'sender__avatar_variants': sender.avatar_variants,
+        'content': message.content,
+        'client_nonce': message.client_nonce,
+        'is_read': message.is_read,
+        'created_at': message.created_at,
+        'updated_at': message.updated_at,
+        'attachments': [
+            {
+                'id': attachment.id,
+                'filename': attachment.filename,
+                'content_type': attachment.content_type,
+                'size': attachment.blob.size,
+                'sha256': attachment.blob.sha256,
+                'created_at': attachment.created_at,
+            }
+            for attachment in attachments
+        ],
+    }
+
+
+def attachments_by_message(message_ids):
+    """{message id: attachment rows}, newest attachment first, in one query"""
+    attachments = {}
+    if not message_ids:
+        return attachments
+    for row in Message.attachments.through.objects.filter(
+        message_id__in=message_ids
+    ).order_by('-attachment__created_at').values_list(*ATTACHMENT_COLUMNS):
+        attachments.setdefault(row[0], []).append({
+            'id': row[1],
+            'filename': row[2],
+            'content_type': row[3],
+            'size': row[4],
+            'sha256': row[5],
+            'created_at': row[6],
+        })
+    return attachments
+
+
+def message_rows(items):
+    """Rows for a page of message rows and Message objects (archived ones)"""
+    return [item if isinstance(item, dict) else message_row(item) for item in items]
+
+
+def encode_messages(rows, request=None, compact=False):
+    """
+    MessageSerializer(many=True).data for message rows. `compact` leaves
+    out the sender fields as the compact history page does.
+    """
+    format_datetime = datetime_formatter()
+    avatar = avatar_formatter(request)
+    loaded = attachments_by_message([row['id'] for row in rows if 'attachments' not in row])
+    
+    encoded = []
+    for row in rows:
+        data = {'id': row['id'], 'conversation': row['conversation_id'], 'sender': row['sender_id']}
+        if not compact:
+            data['sender_username'] = row['sender__username']
+            data['sender_name'] = full_name(
+                row['sender__first_name'], row['sender__last_name'], row['sender__username']
+            )
+            data['sender_avatar'] = avatar(row['sender__avatar'], row['sender__avatar_variants'])
+        attachments = row['attachments'] if 'attachments' in row else loaded.get(row['id'], ())
+        data['content'] = row['content']
+        data['attachments'] = [
+            {**attachment, 'created_at': format_datetime(attachment['created_at'])}
+            for attachment in attachments
+        ]
+        data['nonce'] = row['client_nonce']
+        data['is_read'] = row['is_read']
+        data['created_at'] = format_datetime(row['created_at'])
+        data['updated_at'] = format_datetime(row['updated_at'])
+        encoded.append(data)
+    return encoded
+
+
+def encode_senders(rows, request=None):
+    """The `senders` table of a compact history page"""
+    avatar = avatar_formatter(request)
+    senders = {}
+    for row in rows:
+        if row['sender_id'] not in senders:
+            senders[row['sender_id']] = {
+                'username': row['sender__username'],
+                'name': full_name(
+                    row['sender__first_name'], row['sender__last_name'], row['sender__username']
+                ),
+                'avatar': avatar(row['sender__avatar'], row['sender__avatar_variants']),
+            }
+    return senders
+
+
+def last_message_previews(conversation_ids):
+    """{conversation id: last_message_preview} in one query"""
+    last_ids = Conversation.objects.filter(id__in=conversation_ids).annotate(
+        last_id=Subquery(
+            Message.objects.filter(conversation_id=OuterRef('pk')).order_by('-created_at').values('id')[:1]
+        )
+    ).values('last_id')
+    return {
+        conversation_id: {
+            'id': message_id,
+            'sender': username,
+            'content': content[:PREVIEW_LENGTH],
+            'created_at': created_at,
+        }
+        for message_id, conversation_id, username, content, created_at in Message.objects.filter(
+            id__in=last_ids
+        ).order_by().values_list('id', 'conversation_id', 'sender__username', 'content', 'created_at')
+    }
+
+
+def page_unread_counts(conversation_ids, user_id):
+    """{conversation id: the user's unread count} in one query"""
+    return dict(Participant.objects.filter(
+        conversation_id__in=conversation_ids,
+        user_id=user_id
+    ).annotate(unread=unread_count()).values_list('conversation_id', 'unread'))
+
+
+def page_listed_members(conversation_ids, user_id):
+    """
+    {conversation id: participant rows} of the members a list item shows,
+    the first CHAT_LIST_PARTICIPANTS of each, in one query
+    """
+    members = {}
+    for row in listed_members(user_id).filter(
+        conversation_id__in=conversation_ids
+    ).annotate(
+        position=Window(RowNumber(), partition_by='conversation_id', order_by=ParticipantPagination.ordering)
+    ).filter(position__lte=settings.CHAT_LIST_PARTICIPANTS).values(*PARTICIPANT_COLUMNS):
+        members.setdefault(row['conversation_id'], []).append(row)
+    return members
+
+
+def encode_conversations(rows, user):
+    """
+    ConversationListSerializer(rows, many=True).data for `user`'s page.
+    Rows carry a `member_count` annotation (membership.member_count()).
+    """
+    ids = [row['id'] for row in rows]
+    format_datetime = datetime_formatter()
+    # Other participants are serialized without the request, so relative
+    avatar = avatar_formatter()
+    
+    participants = page_listed_members(ids, user.id) if ids else {}
+    previews = last_message_previews(ids) if ids else {}
+    unread = page_unread_counts(ids, user.id) if ids else {}
+    
+    encoded = []
+    for row in rows:
+        members = participants.get(row['id'], [])
+        encoded.append({
+            'id': row['id'],
+            'name': row['name'],
+            'is_group': row['is_group'],
+            'participants_count': row['member_count'],
+            'last_message_preview': previews.get(row['id']),
+            'unread_count': unread.get(row['id'], 0),
+            'other_participants': [
+                {
+                    'id': member['id'],
+                    'user_id': member['user_id'],
+                    'username': member['user__username'],
+                    'full_name': full_name(
+                        member['user__first_name'], member['user__last_name'], member['user__username']
+                    ),
+                    'avatar': avatar(member['user__avatar'], member['user__avatar_variants']),
+                    'is_online': member['user__is_online'],
+                    'joined_at': format_datetime(member['joined_at']),
+                    'last_read_at': format_datetime(member['last_read_at']),
+                }
+                for member in members
+            ],
+            'created_at': format_datetime(row['created_at']),
+            'updated_at': format_datetime(row['updated_at']),
+        })
+    return encoded
@@ -0,0 +1,156 @@
+"""
+Streaming export of a conversation's full history as NDJSON or CSV.
+
+Messages come out oldest first: the archived segments (see chat.archive),
+then the hot rows through `iterator(chunk_size=CHAT_EXPORT_CHUNK_SIZE)`,
+which is a server-side cursor on PostgreSQL. Lines are gathered into
+blocks of about BLOCK_SIZE bytes and optionally gzipped as they go. Memory
+therefore stays flat however long the conversation is. A batch archived
+while an export runs may be left out of that export.
+"""
+import csv
+import io
+import json
+import zlib
+from itertools import islice
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from .archive import read_segment
+from .models import ArchiveSegment, Attachment, Message
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+COLUMNS = (
+    'id', 'created_at', 'sender_id', 'sender_username', 'content',
+    'attachments', 'nonce', 'is_read', 'updated_at'
+)
+
+# Bytes of output gathered before a block is handed on (and compressed)
+BLOCK_SIZE = 64 * 1024
+
+
+def export_filename(conversation_id, output, compress):
+    return f'conversation-{conversation_id}.{output}' + ('.gz' if compress else '')
+
+
+def archived_rows(conversation_id):
+    """Archived messages oldest first, one segment in memory at a time"""
+    segments = ArchiveSegment.objects.filter(
+        conversation_id=conversation_id
+    ).order_by('last_created_at', 'id').values_list('path', 'offset', 'length', 'first_id')
+    User = get_user_model()
+    for path, offset, length, first_id in segments.iterator():
+        records = read_segment(path, offset, length, first_id)
+        usernames = dict(User.objects.filter(
+            id__in={r['sender_id'] for r in records}
+        ).values_list('id', 'username'))
+        files = dict(Attachment.objects.filter(
+            id__in={i for r in records for i in r['attachment_ids']}
+        ).values_list('id', 'filename'))
+        for record in records:
+            if record['sender_id'] not in usernames:
+                continue
+            yield {
+                'id': record['id'],
+                'created_at': record['created_at'],
+                'sender_id': record['sender_id'],
+                'sender_username': usernames[record['sender_id']],
+                'content': record['content'],
+                'attachments': [
+                    {'id': i, 'filename': files[i]} for i in record['attachment_ids'] if i in files
+                ],
+                'nonce': record['nonce'],
+                'is_read': record['is_read'],
+                'updated_at': record['updated_at'],
+            }
+
+
+def hot_rows(conversation_id, chunk_size):
+    """Messages still in the Message table, oldest first"""
+    rows = Message.objects.filter(conversation_id=conversation_id).order_by(
+        'created_at', 'id'
+    ).values(
+        'id', 'created_at', 'sender_id', 'sender__username', 'content',
+        'client_nonce', 'is_read', 'updated_at'
+    ).iterator(chunk_size=chunk_size)
+    links = Message.attachments.through.objects
+    while True:
+        batch = list(islice(rows, chunk_size))
+        if not batch:
+            return
+        files = {}
+        for message_id, attachment_id, filename in links.filter(
+            message_id__in=[row['id'] for row in batch]
+        ).order_by('attachment_id').values_list('message_id', 'attachment_id', 'attachment__filename'):
+            files.setdefault(message_id, []).append({'id': attachment_id, 'filename': filename})
+        for row in batch:
+            yield {
+                'id': row['id'],
+                'created_at': row['created_at'].isoformat(),
+                'sender_id': row['sender_id'],
+                'sender_username': row['sender__username'],
+                'content': row['content'],
+                'attachments': files.get(row['id'], []),
+                'nonce': row['client_nonce'],
+                'is_read': row['is_read'],
+                'updated_at': row['updated_at'].isoformat(),
+            }
+
+
+def history_rows(conversation_id, chunk_size=None):
+    chunk_size = chunk_size or settings.CHAT_EXPORT_CHUNK_SIZE
+    yield from archived_rows(conversation_id)
+    yield from hot_rows(conversation_id, chunk_size)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for row in rows:
+        row['attachments'] = ' '.join(f"{a['id']}:{a['filename']}" for a in row['attachments'])
+        writer.writerow([row[column] for column in COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def blocks(lines):
+    """Join lines into encoded blocks of about BLOCK_SIZE bytes"""
+    pending, size = [], 0
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size >= BLOCK_SIZE:
+            yield ''.join(pending).encode()
+            pending, size = [], 0
+    if pending:
+        yield ''.join(pending).encode()
+
+
+def gzipped(chunks):
+    """Compress a byte stream into a gzip file as it is produced"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(conversation_id, output='ndjson', compress=False, chunk_size=None):
+    """The byte chunks of a conversation export"""
+    rows = history_rows(conversation_id, chunk_size)
+    lines = csv_lines(rows) if output == 'csv' else ndjson_lines(rows)
+    chunks = blocks(lines)
+    return gzipped(chunks) if compress else chunks
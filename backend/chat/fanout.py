@@ -0,0 +1,123 @@
+"""
+Per-process fan-out for large rooms.
+
+Normally every connection joins its room group itself, so one group_send
+costs the channel layer one push per member connection. For rooms with at
+least CHAT_LARGE_ROOM_SIZE members each worker process instead joins the
+group once with a relay channel of its own and hands every event it
+receives to its local connections. A broadcast then costs one push per
+process, however many members are online.
+
+If the relay's reader fails (e.g. the channel layer drops its
+connection), it is logged and restarted on a new channel with backoff,
+and every room joined so far is added to that channel again.
+"""
+import asyncio
+import logging
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Process-wide counters, exposed through fanout_stats()
+counters = Counter()
+
+# Seconds before restarting a failed reader, doubling up to the maximum
+RESTART_DELAY = 0.5
+MAX_RESTART_DELAY = 30
+
+
+class ProcessFanout:
+    """Relay channel standing in for this process's connections to large rooms"""
+    
+    def __init__(self):
+        self.channel_layer = None
+        self.channel_name = None
+        self.rooms = defaultdict(set)
+        self._reader = None
+        self._ready = None
+    
+    async def join(self, group, consumer):
+        """Deliver `group` events to `consumer` through the relay channel"""
+        await self._start(consumer.channel_layer)
+        self.rooms[group].add(consumer)
+        # Re-adding on every join also refreshes the layer's group expiry
+        await self.channel_layer.group_add(group, self.channel_name)
+    
+    async def leave(self, group, consumer):
+        members = self.rooms.get(group)
+        if members is None:
+            return
+        members.discard(consumer)
+        if not members:
+            del self.rooms[group]
+            await self.channel_layer.group_discard(group, self.channel_name)
+    
+    async def _start(self, channel_layer):
+        # No awaits before the reader exists, so concurrent joins share it
+        loop = asyncio.get_running_loop()
+        if self._reader is None or self._reader.done() or self._reader.get_loop() is not loop:
+            self.channel_layer = channel_layer
+            self._ready = loop.create_future()
+            self._reader = loop.create_task(self._supervise())
+        await asyncio.shield(self._ready)
+    
+    async def _supervise(self):
+        """Run the reader, restarting it with backoff whenever it fails"""
+        delay = RESTART_DELAY
+        while True:
+            relayed = counters['relayed']
+            try:
+                await self._read()
+            except Exception as e:  # noqa: BLE001 - the relay must outlive layer errors
+                if not self._ready.done():
+                    # Joins waiting for this start fail; later ones wait for the restart
+                    self._ready.set_exception(e)
+                    self._ready.exception()
+                    self._ready = asyncio.get_running_loop().create_future()
+                if counters['relayed'] > relayed:
+                    delay = RESTART_DELAY
+                logger.exception('Fan-out relay reader failed; restarting in %.1fs', delay)
+                counters['restarts'] += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RESTART_DELAY)
+    
+    async def _read(self):
+        self.channel_name = await self.channel_layer.new_channel('fanout')
+        # Groups joined by a previous reader belong to a dead channel
+        for group in list(self.rooms):
+            await self.channel_layer.group_add(group, self.channel_name)
+        if not self._ready.done():
+            self._ready.set_result(None)
+        
+        while True:
+            event = await self.channel_layer.receive(self.channel_name)
+            counters['relayed'] += 1
+            for consumer in list(self.rooms.get(event.get('group'), ())):
+                try:
+                    await consumer.dispatch(event)
+                except Exception:  # noqa: BLE001 - one bad connection must not stop the relay
+                    logger.exception('Fan-out delivery to %s failed', consumer.channel_name)
+                else:
+                    counters['delivered'] += 1
+
+
+_fanout = None
+
+
+def get_fanout():
+    global _fanout
+    if _fanout is None:
+        _fanout = ProcessFanout()
+    return _fanout
+
+
+def fanout_stats():
+    """Snapshot of this process's relay for monitoring"""
+    fanout = get_fanout()
+    return {
+        'rooms': len(fanout.rooms),
+        'connections': sum(len(members) for members in fanout.rooms.values()),
+        'relayed': counters['relayed'],
+        'delivered': counters['delivered'],
+        'restarts': counters['restarts'],
+    }
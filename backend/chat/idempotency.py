@@ -0,0 +1,71 @@
+"""
+Idempotent message creation from client-supplied nonces.
+
+A client may tag a send with a `nonce` of its choosing and reuse it when
+retrying. A retry then gets the message stored the first time instead of
+inserting and broadcasting a second one. Nonces are scoped to the sender
+and the conversation, so reusing one in another conversation stores a new
+message there. Recent nonces are remembered in the cache for
+CHAT_NONCE_TTL seconds, which answers a retry with one primary-key lookup.
+The unique (sender, conversation, client_nonce) constraint catches retries
+that race the first send or arrive after the cache forgot it.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from .models import Message
+
+NONCE_MAX_LENGTH = 64
+
+
+def nonce_key(sender_id, conversation_id, nonce):
+    return f'nonce:{sender_id}:{conversation_id}:{nonce}'
+
+
+def clean_nonce(value):
+    """The nonce from a WebSocket frame, or None if absent or malformed"""
+    if isinstance(value, str) and 0 < len(value) <= NONCE_MAX_LENGTH:
+        return value
+    return None
+
+
+def remember(message):
+    key = nonce_key(message.sender_id, message.conversation_id, message.client_nonce)
+    transaction.on_commit(lambda: cache.set(key, message.id, settings.CHAT_NONCE_TTL))
+
+
+def find_sent(sender_id, conversation_id, nonce):
+    """The message already stored for this nonce, if the cache knows it"""
+    message_id = cache.get(nonce_key(sender_id, conversation_id, nonce))
+    if message_id is None:
+        return None
+    return Message.objects.filter(id=message_id).first()
+
+
+def create_once(sender_id, conversation_id, nonce, create):
+    """
+    Call `create()` to store a message unless `nonce` was already used by
+    this sender in this conversation. Returns (message, created).
+    """
+    if not nonce:
+        return create(), True
+    
+    message = find_sent(sender_id, conversation_id, nonce)
+    if message is not None:
+        return message, False
+    
+    try:
+        with transaction.atomic():
+            message = create()
+    except IntegrityError:
+        message = Message.objects.filter(
+            sender_id=sender_id,
+            conversation_id=conversation_id,
+            client_nonce=nonce
+        ).first()
+        if message is None:
+            raise
+        remember(message)
+        return message, False
+    remember(message)
+    return message, True
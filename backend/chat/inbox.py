@@ -0,0 +1,184 @@
+"""
+Inbox deltas pushed to each member's `user_<id>` group.
+
+When a message is stored, every member of its conversation gets a
+small `inbox` frame with the conversation id, their unread count and a
+preview of the message, so clients can keep badges and the conversation
+list current without polling. The preview is built once per message and
+all the unread counts come from one query; members sharing a count share
+the encoded frames too. Marking a conversation read pushes a zero count
+to the reader's other connections.
+
+Rooms with at least CHAT_LARGE_ROOM_SIZE members get no per-member counts.
+Their members' sockets join the room's `inbox_<id>` group through the
+process relay (see chat.fanout), and each message sends that group one
+frame with `unread_increment: 1` instead. Clients add it to their badge
+unless they sent the message. Sockets learn about rooms they join or
+leave while connected; a room that grows past the threshold is picked up
+on their next connect.
+
+Deltas go to every member's group whether or not they are connected; the
+channel layer drops sends to groups with no sockets. Like other room
+events (see chat.rooms) they are built and sent once the transaction
+commits, from the thread that committed it.
+"""
+import asyncio
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from . import codecs, metrics
+from .models import Message, Participant
+from .rooms import inbox_group_name, user_group_name
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LENGTH = 100
+
+
+def message_preview(message):
+    content = message.content
+    return {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'content': content[:PREVIEW_LENGTH],
+        'truncated': len(content) > PREVIEW_LENGTH,
+        'has_attachments': message.attachments.exists(),
+        'created_at': message.created_at.isoformat(),
+    }
+
+
+def unread_count():
+    """
+    The outer Participant's unread count (Participant.unread_count), for
+    annotate()
+    """
+    return Coalesce(Subquery(
+        Message.objects.filter(
+            conversation_id=OuterRef('conversation_id'),
+            created_at__gt=OuterRef('last_read_at')
+        ).exclude(
+            sender_id=OuterRef('user_id')
+        ).order_by().values('conversation_id').annotate(count=Count('id')).values('count')
+    ), 0)
+
+
+def unread_counts(conversation_id):
+    """{user_id: unread count} for every member, in one query"""
+    return dict(Participant.objects.filter(
+        conversation_id=conversation_id
+    ).annotate(unread=unread_count()).values_list('user_id', 'unread'))
+
+
+def inbox_events(conversation_id, counts, last_message=None):
+    """One inbox_update event per user; users with equal counts share frames"""
+    frames_by_count = {}
+    events = []
+    for user_id, count in counts.items():
+        frames = frames_by_count.get(count)
+        if frames is None:
+            payload = {'type': 'inbox', 'conversation_id': conversation_id, 'unread_count': count}
+            if last_message is not None:
+                payload['last_message'] = last_message
+            frames = frames_by_count[count] = codecs.encode_frames(payload)
+        events.append({'type': 'inbox_update', 'group': user_group_name(user_id), 'frames': frames})
+    return events
+
+
+def large_room_event(conversation_id, last_message):
+    """The single inbox_update event for a message in a large room"""
+    return {
+        'type': 'inbox_update',
+        'group': inbox_group_name(conversation_id),
+        'frames': codecs.encode_frames({
+            'type': 'inbox',
+            'conversation_id': conversation_id,
+            'unread_increment': 1,
+            'last_message': last_message,
+        }),
+    }
+
+
+def is_large_room(conversation_id):
+    return Participant.objects.filter(
+        conversation_id=conversation_id
+    ).count() >= settings.CHAT_LARGE_ROOM_SIZE
+
+
+def large_room_ids(user_id):
+    """Ids of the user's conversations that are large rooms"""
+    return list(Participant.objects.filter(
+        conversation__participants__user_id=user_id
+    ).order_by().values('conversation_id').annotate(
+        members=Count('id')
+    ).filter(members__gte=settings.CHAT_LARGE_ROOM_SIZE).values_list('conversation_id', flat=True))
+
+
+async def send_events(events):
+    channel_layer = get_channel_layer()
+    with metrics.channel_layer_send_seconds.time('inbox_update'):
+        await asyncio.gather(*(
+            channel_layer.group_send(event['group'], event) for event in events
+        ))
+
+
+def push_on_commit(build):
+    """
+    After commit, call `build()` for a list of events and send them. A
+    failed push is logged; the write it follows has already committed.
+    """
+    def send():
+        try:
+            events = build()
+            if events:
+                async_to_sync(send_events)(events)
+        except Exception:
+            logger.exception('Inbox push failed')
+    
+    transaction.on_commit(send)
+
+
+def push_message_on_commit(message):
+    """Send members the delta for a new message after commit"""
+    def build():
+        preview = message_preview(message)
+        if is_large_room(message.conversation_id):
+            return [large_room_event(message.conversation_id, preview)]
+        return inbox_events(
+            message.conversation_id,
+            unread_counts(message.conversation_id),
+            preview
+        )
+    
+    push_on_commit(build)
+
+
+def push_read_on_commit(user_id, conversation_id):
+    """Clear the unread badge on the reader's other connections"""
+    push_on_commit(lambda: inbox_events(conversation_id, {user_id: 0}))
+
+
+def push_membership_on_commit(conversation_id, user_ids, member):
+    """
+    Tell the sockets of users who joined or left a large room to join or
+    leave its inbox group
+    """
+    user_ids = list(user_ids)
+    
+    def build():
+        if member and not is_large_room(conversation_id):
+            return []
+        return [
+            {
+                'type': 'inbox_membership',
+                'group': user_group_name(user_id),
+                'conversation_id': conversation_id,
+                'member': member,
+            }
+            for user_id in user_ids
+        ]
+    
+    push_on_commit(build)
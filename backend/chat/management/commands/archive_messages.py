@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from chat.archive import run_retention
+
+
+class Command(BaseCommand):
+    help = 'Move messages past their retention window into the compressed archive'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='messages per transaction (CHAT_ARCHIVE_BATCH_SIZE)')
+        parser.add_argument('--max-batches', type=int, help='stop after this many batches')
+        parser.add_argument('--pause', type=float, default=0, help='seconds to sleep between batches')
+    
+    def handle(self, *args, **options):
+        moved = batches = 0
+        conversations = set()
+        for conversation_id, count in run_retention(
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            pause=options['pause']
+        ):
+            moved += count
+            batches += 1
+            conversations.add(conversation_id)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Conversation {conversation_id}: archived {count} messages')
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {moved} messages from {len(conversations)} conversations in {batches} batches'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from chat.attachments import expire_uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete unfinished uploads idle for longer than ATTACHMENT_UPLOAD_EXPIRY'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, help='idle seconds (ATTACHMENT_UPLOAD_EXPIRY)')
+    
+    def handle(self, *args, **options):
+        sessions, files = expire_uploads(options['max_age'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {sessions} upload sessions and {files} partial files'
+        ))
@@ -0,0 +1,31 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from chat.export import FORMATS, export_chunks
+from chat.models import Conversation
+
+
+class Command(BaseCommand):
+    help = "Stream a conversation's full history, archive included, as NDJSON or CSV"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('conversation_id', type=int)
+        parser.add_argument('--output', choices=list(FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help='compress the output')
+        parser.add_argument('--file', help='write here instead of to stdout')
+        parser.add_argument('--chunk-size', type=int, help='rows per database fetch (CHAT_EXPORT_CHUNK_SIZE)')
+    
+    def handle(self, *args, **options):
+        conversation_id = options['conversation_id']
+        if not Conversation.objects.filter(id=conversation_id).exists():
+            raise CommandError(f'Conversation {conversation_id} does not exist')
+        
+        chunks = export_chunks(conversation_id, options['output'], options['gzip'], options['chunk_size'])
+        if options['file']:
+            with open(options['file'], 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        else:
+            out = sys.stdout.buffer
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
@@ -0,0 +1,97 @@
+"""
+Bulk membership changes for group conversations.
+
+Ids are validated with one query, rows are written in batches inside the
+caller's transaction, and the room gets a single `members` event for the
+whole change instead of one per member.
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .inbox import push_membership_on_commit
+from .models import Participant
+from .pagination import ParticipantPagination
+from .rooms import send_to_room_on_commit
+from .versioning import bump_conversation, coalesce_bumps
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+
+
+def add_members(conversation, user_ids, actor=None, notify=True):
+    """
+    Add the given users to `conversation`.
+
+    Returns (added, ignored): ids that became members, and ids that do not
+    belong to any user. Users who are already members are skipped.
+    """
+    requested = set(user_ids)
+    with transaction.atomic():
+        valid = set(User.objects.filter(id__in=requested).values_list('id', flat=True))
+        existing = set(Participant.objects.filter(
+            conversation=conversation,
+            user_id__in=valid
+        ).values_list('user_id', flat=True))
+        added = sorted(valid - existing)
+        
+        # ignore_conflicts covers members added concurrently since the check
+        Participant.objects.bulk_create(
+            [Participant(conversation=conversation, user_id=user_id) for user_id in added],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        if added:
+            # bulk_create skips post_save, so bump here
+            bump_conversation(conversation.id, added)
+            push_membership_on_commit(conversation.id, added, member=True)
+            if notify:
+                notify_members_changed(conversation.id, added=added, actor=actor)
+    
+    return added, sorted(requested - valid)
+
+
+def remove_members(conversation, user_ids, actor=None):
+    """Remove the given users from `conversation`; returns the removed ids"""
+    with transaction.atomic(), coalesce_bumps():
+        queryset = Participant.objects.filter(
+            conversation=conversation,
+            user_id__in=set(user_ids)
+        )
+        removed = sorted(queryset.values_list('user_id', flat=True))
+        if removed:
+            queryset.delete()
+            push_membership_on_commit(conversation.id, removed, member=False)
+            notify_members_changed(conversation.id, removed=removed, actor=actor)
+    return removed
+
+
+def notify_members_changed(conversation_id, added=(), removed=(), actor=None):
+    """Tell the room about a membership change after commit"""
+    send_to_room_on_commit(conversation_id, 'members_changed', {
+        'type': 'members',
+        'conversation_id': conversation_id,
+        'added': list(added),
+        'removed': list(removed),
+        'by': actor.id if actor else None,
+    }, removed=list(removed))
+
+
+def member_count():
+    """The number of members of the outer Conversation, for annotate()"""
+    return Coalesce(Subquery(
+        Participant.objects.filter(
+            conversation_id=OuterRef('pk')
+        ).order_by().values('conversation_id').annotate(count=Count('id')).values('count')
+    ), 0)
+
+
+def listed_members(user_id):
+    """
+    Members other than `user_id` in join order, as a conversation list item
+    shows them. Only the first CHAT_LIST_PARTICIPANTS are listed.
+    """
+    return Participant.objects.exclude(
+        user_id=user_id
+    ).select_related('user').order_by(*ParticipantPagination.ordering)
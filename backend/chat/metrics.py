@@ -0,0 +1,273 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms live in plain dicts behind one lock each,
+so recording an event costs a dict update and no I/O. Values are per
+worker process; scrape each worker (or each container) separately.
+GET /metrics renders the current values of this process.
+"""
+import bisect
+import functools
+import hmac
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from .fanout import fanout_stats
+from .outbound import outbound_stats
+
+# Seconds; covers sub-millisecond cache hits up to multi-second stalls
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+_registry = []
+_collectors = []
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in zip(labelnames, values)
+    )
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class: a named family of values keyed by label values"""
+    type = None
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+    
+    def samples(self):
+        """Yield (suffix, label names, label values, value)"""
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield '', self.labelnames, labels, value
+
+
+class Counter(Metric):
+    type = 'counter'
+    
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+    
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+    
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # per-bucket counts (+Inf last), sum, count
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+    
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+    
+    def samples(self):
+        with self._lock:
+            items = [(labels, (list(s[0]), s[1], s[2])) for labels, s in self._values.items()]
+        names = self.labelnames + ('le',)
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield '_bucket', names, labels + (_format_value(bound),), cumulative
+            yield '_sum', self.labelnames, labels, total
+            yield '_count', self.labelnames, labels, count
+
+
+def register_collector(collect):
+    """
+    Add a callback evaluated at scrape time. It returns an iterable of
+    (name, type, documentation, value) for values that are cheaper to
+    read on demand than to track, such as queue depths.
+    """
+    _collectors.append(collect)
+    return collect
+
+
+def render():
+    """All metrics of this process in the text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for suffix, names, values, value in metric.samples():
+            lines.append(f'{metric.name}{suffix}{_format_labels(names, values)} {_format_value(value)}')
+    for collect in _collectors:
+        for name, metric_type, documentation, value in collect():
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.append(f'{name} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Scrape endpoint; requires METRICS_TOKEN. Without a token it is only
+    open when DEBUG is on.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponseForbidden()
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# WebSocket
+websocket_connections = Gauge(
+    'chat_websocket_connections', 'Open WebSocket connections in this worker'
+)
+group_joins = Counter(
+    'chat_group_joins_total', 'Room joins by delivery mode', ['mode']
+)
+group_leaves = Counter(
+    'chat_group_leaves_total', 'Room leaves by delivery mode', ['mode']
+)
+messages_received = Counter(
+    'chat_messages_received_total', 'Chat messages received over WebSocket'
+)
+messages_broadcast = Counter(
+    'chat_messages_broadcast_total', 'Chat messages published to a room'
+)
+channel_layer_send_seconds = Histogram(
+    'chat_channel_layer_send_seconds', 'Time spent in channel layer group_send', ['event']
+)
+
+# Database threads
+db_wait_seconds = Histogram(
+    'chat_db_sync_to_async_wait_seconds', 'Time database_sync_to_async calls wait for a thread'
+)
+db_exec_seconds = Histogram(
+    'chat_db_sync_to_async_exec_seconds', 'Time database_sync_to_async calls run in their thread'
+)
+
+# REST and auth
+http_request_seconds = Histogram(
+    'chat_http_request_seconds', 'REST latency by view and action', ['view', 'action']
+)
+jwt_decode_seconds = Histogram(
+    'chat_jwt_decode_seconds', 'Time to verify and decode a JWT',
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005)
+)
+
+
+_START_TIME = time.time()
+
+
+@register_collector
+def _process_info():
+    yield 'chat_process_start_time_seconds', 'gauge', 'Unix time this worker started', _START_TIME
+    yield 'chat_process_id', 'gauge', 'PID of this worker', os.getpid()
+
+
+# Snapshot values; everything else reported by the stats helpers is cumulative
+_STATS_GAUGES = {'connections', 'queued', 'max_depth', 'rooms'}
+
+
+@register_collector
+def _queue_stats():
+    for prefix, stats in (('outbound', outbound_stats()), ('fanout', fanout_stats())):
+        for key, value in stats.items():
+            if key in _STATS_GAUGES:
+                yield f'chat_{prefix}_{key}', 'gauge', f'{prefix} {key}', value
+            else:
+                yield f'chat_{prefix}_{key}_total', 'counter', f'{prefix} {key}', value
+
+
+_submitted = ContextVar('db_submitted', default=None)
+
+
+class InstrumentedDatabaseSyncToAsync(DatabaseSyncToAsync):
+    """database_sync_to_async that records thread wait and run time"""
+    
+    def __init__(self, func, *args, **kwargs):
+        super().__init__(func, *args, **kwargs)
+        self.func = self._timed(self.func)
+    
+    async def __call__(self, *args, **kwargs):
+        # The function runs in a copy of this context, so it sees the stamp
+        token = _submitted.set(time.perf_counter())
+        try:
+            return await super().__call__(*args, **kwargs)
+        finally:
+            _submitted.reset(token)
+    
+    @staticmethod
+    def _timed(func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            submitted = _submitted.get()
+            if submitted is not None:
+                db_wait_seconds.observe(start - submitted)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                db_exec_seconds.observe(time.perf_counter() - start)
+        return timed
+
+
+def database_sync_to_async(func=None):
+    """
+    Drop-in for channels.db.database_sync_to_async that runs on the
+    CHAT_WS_DB_THREADS pool (chat.pools) instead of a single shared thread
+    """
+    from .pools import ws_executor
+    if func is None:
+        return lambda f: InstrumentedDatabaseSyncToAsync(f, thread_sensitive=False, executor=ws_executor())
+    return InstrumentedDatabaseSyncToAsync(func, thread_sensitive=False, executor=ws_executor())
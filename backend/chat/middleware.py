@@ -1,18 +1,22 @@
+import time
 from urllib.parse import parse_qs
-from channels.db import database_sync_to_async
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
 from channels.middleware import BaseMiddleware
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import get_user_model
-from accounts.jwt_utils import get_user_from_token
+from django.urls import reverse
+from accounts.jwt_utils import get_user_and_payload, get_user_from_token
+from . import metrics, profiling
+from .metrics import database_sync_to_async
 
 User = get_user_model()
 
 
 @database_sync_to_async
-def get_user_from_token_async(token_key):
-    """Get user from JWT token asynchronously"""
-    user = get_user_from_token(token_key)
-    return user if user else AnonymousUser()
+def get_user_and_payload_async(token_key):
+    """Get (user, token payload) from a JWT token asynchronously"""
+    user, payload = get_user_and_payload(token_key)
+    return (user, payload) if user else (AnonymousUser(), None)
 
 
 class JWTAuthMiddleware(BaseMiddleware):
@@ -25,8 +29,102 @@ class JWTAuthMiddleware(BaseMiddleware):
         token = query_params.get('token', [None])[0]
         
         if token:
-            scope['user'] = await get_user_from_token_async(token)
+            scope['user'], scope['token'] = await get_user_and_payload_async(token)
         else:
-            scope['user'] = AnonymousUser()
+            scope['user'], scope['token'] = AnonymousUser(), None
         
         return await super().__call__(scope, receive, send)
+
+
+def view_label(request):
+    """(view, action) for a request: the viewset class and DRF action where there is one"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched', request.method.lower()
+    cls = getattr(match.func, 'cls', None)
+    if cls is None:
+        return match.view_name, request.method.lower()
+    actions = getattr(match.func, 'actions', None) or {}
+    return cls.__name__, actions.get(request.method.lower(), request.method.lower())
+
+
+class RequestMetricsMiddleware:
+    """Record REST latency per view and action for the /metrics endpoint"""
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+    
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        metrics.http_request_seconds.observe(time.perf_counter() - start, *view_label(request))
+        return response
+    
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        metrics.http_request_seconds.observe(time.perf_counter() - start, *view_label(request))
+        return response
+
+
+def profiling_user(request):
+    """The user asking for a profile: session login or a Bearer access token"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    parts = request.headers.get('Authorization', '').split()
+    if len(parts) == 2 and parts[0].lower() == 'bearer':
+        return get_user_from_token(parts[1])
+    return None
+
+
+class ProfilerMiddleware:
+    """
+    Profile one REST request for staff users who ask for it.
+    
+    A profiled request always runs in one thread, the one being profiled:
+    under ASGI the rest of the chain is driven from it with async_to_sync,
+    so the sync work of an async view comes back to that thread too.
+    """
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+    
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not profiling.wants_profile(request):
+            return self.get_response(request)
+        user = profiling_user(request)
+        if not profiling.can_profile(user):
+            return self.get_response(request)
+        return self.profile(request, user, self.get_response)
+    
+    async def __acall__(self, request):
+        if not profiling.wants_profile(request):
+            return await self.get_response(request)
+        user = await sync_to_async(profiling_user)(request)
+        if not profiling.can_profile(user):
+            return await self.get_response(request)
+        return await sync_to_async(self.profile)(request, user, async_to_sync(self.get_response))
+    
+    def profile(self, request, user, get_response):
+        with profiling.Profiler('http', f'{request.method} {request.path}', user) as profiler:
+            response = get_response(request)
+        profile_id = profiler.save()
+        if profile_id:
+            response['X-Profile-Id'] = profile_id
+            response['X-Profile-Url'] = reverse('admin-profile-detail', args=[profile_id])
+        return response
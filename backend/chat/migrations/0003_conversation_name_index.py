@@ -0,0 +1,41 @@
+from django.db import migrations
+
+
+def create_name_index(apps, schema_editor):
+    """
+    Index conversation names for the admin's prefix search.
+
+    Same scheme as the accounts user search indexes: a trigram GIN index
+    on UPPER(name) on PostgreSQL, a NOCASE index on SQLite.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS chat_conversation_name_trgm '
+            'ON chat_conversation USING gin (UPPER("name"::text) gin_trgm_ops)'
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS chat_conversation_name_nocase '
+            'ON chat_conversation ("name" COLLATE NOCASE)'
+        )
+
+
+def drop_name_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    suffix = {'postgresql': 'trgm', 'sqlite': 'nocase'}.get(vendor)
+    if suffix is None:
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS chat_conversation_name_{suffix}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_attachments'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_name_index, drop_name_index),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-19 11:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_conversation_name_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='client_nonce',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(condition=models.Q(('client_nonce__isnull', False)), fields=('sender', 'client_nonce'), name='chat_message_unique_client_nonce'),
+        ),
+    ]
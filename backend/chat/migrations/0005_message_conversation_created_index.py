@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_client_nonce'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'created_at'], name='chat_msg_conv_created_idx'),
+        ),
+    ]
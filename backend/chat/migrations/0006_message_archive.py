@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_conversation_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='retention_days',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.IntegerField()),
+                ('message_count', models.IntegerField()),
+                ('first_id', models.BigIntegerField()),
+                ('last_id', models.BigIntegerField()),
+                ('first_created_at', models.DateTimeField()),
+                ('last_created_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='chat.conversation')),
+            ],
+            options={
+                'ordering': ['conversation', 'first_created_at'],
+                'indexes': [models.Index(fields=['conversation', 'last_created_at'], name='chat_archive_conv_time_idx')],
+            },
+        ),
+    ]
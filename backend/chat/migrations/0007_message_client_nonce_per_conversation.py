@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_archive'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='message',
+            name='chat_message_unique_client_nonce',
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(condition=models.Q(('client_nonce__isnull', False)), fields=('sender', 'conversation', 'client_nonce'), name='chat_message_unique_client_nonce'),
+        ),
+    ]
@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 from django.conf import settings
 
@@ -12,6 +13,9 @@ class Conversation(models.Model):
         null=True,
         related_name='created_conversations'
     )
+    # Days of history kept in the Message table before archiving; empty
+    # uses CHAT_RETENTION_DAYS and 0 keeps everything (see chat.archive)
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -75,14 +79,141 @@ class Message(models.Model):
         on_delete=models.CASCADE,
         related_name='sent_messages'
     )
-    content = models.TextField()
+    content = models.TextField(blank=True)
+    attachments = models.ManyToManyField(
+        'Attachment',
+        blank=True,
+        related_name='messages'
+    )
     is_read = models.BooleanField(default=False)
+    # Client-chosen id of the send, so that retries are not stored twice
+    # (see chat.idempotency)
+    client_nonce = models.CharField(max_length=64, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Unread counts and history pages within a conversation
+            models.Index(fields=['conversation', 'created_at'], name='chat_msg_conv_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['sender', 'conversation', 'client_nonce'],
+                condition=models.Q(client_nonce__isnull=False),
+                name='chat_message_unique_client_nonce'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.sender.username}: {self.content[:50]}"
 
+
+class ArchiveSegment(models.Model):
+    """
+    One batch of archived messages of a conversation.
+    
+    The batch is a gzip member of NDJSON lines at `offset` in the
+    append-only file at `path` (relative to CHAT_ARCHIVE_ROOT); see
+    chat.archive.
+    """
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='archive_segments'
+    )
+    path = models.CharField(max_length=255)
+    offset = models.BigIntegerField()
+    length = models.IntegerField()
+    message_count = models.IntegerField()
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['conversation', 'first_created_at']
+        indexes = [
+            models.Index(
+                fields=['conversation', 'last_created_at'],
+                name='chat_archive_conv_time_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.message_count} messages of conversation {self.conversation_id}"
+
+
+class AttachmentBlob(models.Model):
+    """
+    File contents stored once per SHA-256 digest.
+    
+    `path` is relative to ATTACHMENT_ROOT and derived from the digest, so
+    identical uploads share a single file on disk.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    path = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.sha256
+
+
+class Attachment(models.Model):
+    """A file uploaded by a user, attachable to messages"""
+    blob = models.ForeignKey(
+        AttachmentBlob,
+        on_delete=models.PROTECT,
+        related_name='attachments'
+    )
+    uploaded_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='attachments'
+    )
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return self.filename
+    
+    @property
+    def size(self):
+        return self.blob.size
+
+
+class UploadSession(models.Model):
+    """A resumable, chunked upload that becomes an Attachment once complete"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions'
+    )
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255, blank=True)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    attachment = models.ForeignKey(
+        Attachment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
+    
+    @property
+    def is_complete(self):
+        return self.attachment_id is not None
@@ -0,0 +1,139 @@
+"""
+Bounded, prioritised send queues for WebSocket connections.
+
+Channel-layer handlers enqueue outgoing events instead of awaiting
+`send()` directly, and a per-connection writer task drains the queue.
+Messages are never dropped, while typing and presence events are
+ephemeral: when the queue is full the oldest ephemeral event goes first.
+A client that stays over the limit for too long is disconnected and
+expected to resync from the REST history on reconnect.
+
+`send()` returns as soon as the server has buffered a frame, so on its
+own the queue only fills when the event loop falls behind. Clients that
+report how many frames they have received (`{"type": "ack", "received":
+n}`) get flow control as well: the writer stops once `ack_window` frames
+are unacknowledged, so a client that cannot keep up fills its queue and
+is disconnected. Clients that never ack are only caught by event-loop lag.
+"""
+import asyncio
+import time
+import weakref
+from collections import Counter, deque
+
+# Lower number = delivered first
+PRIORITIES = {
+    'message': 0,
+    'inbox': 1,
+    'user_status': 1,
+    'typing': 2,
+}
+DEFAULT_PRIORITY = 0
+EPHEMERAL_KINDS = frozenset({'user_status', 'typing'})
+
+# Process-wide counters, exposed through outbound_stats()
+counters = Counter()
+_live_queues = weakref.WeakSet()
+
+
+class SlowConsumer(Exception):
+    """The connection has been over its queue limit for too long"""
+
+
+class OutboundQueue:
+    """Per-connection send buffer with priorities and drop-oldest"""
+    
+    def __init__(self, maxsize=100, hard_limit=None, slow_timeout=10.0, ack_window=200):
+        self.maxsize = maxsize
+        self.hard_limit = hard_limit or maxsize * 2
+        self.slow_timeout = slow_timeout
+        self.over_limit_since = None
+        self.ack_window = ack_window
+        # Frames handed to the writer, and the client's count once it acks
+        self.sent = 0
+        self.acked = None
+        self._queues = {
+            priority: deque() for priority in sorted(set(PRIORITIES.values()))
+        }
+        self._size = 0
+        self._ready = asyncio.Event()
+        _live_queues.add(self)
+    
+    def __len__(self):
+        return self._size
+    
+    def put(self, kind, payload):
+        """
+        Queue `payload`, shedding ephemeral events when full.
+
+        Raises SlowConsumer once the queue passes its hard limit or has
+        stayed above `maxsize` for longer than `slow_timeout` seconds.
+        """
+        if self._size >= self.maxsize and not self._drop_oldest_ephemeral():
+            if kind in EPHEMERAL_KINDS:
+                counters[f'dropped_{kind}'] += 1
+                return
+        
+        self._queues[PRIORITIES.get(kind, DEFAULT_PRIORITY)].append((kind, payload))
+        self._size += 1
+        counters['enqueued'] += 1
+        self._ready.set()
+        self._check_limits()
+    
+    def ack(self, received):
+        """Record the client's count of frames received so far"""
+        if isinstance(received, int) and not isinstance(received, bool):
+            self.acked = max(self.acked or 0, min(received, self.sent))
+            self._ready.set()
+    
+    def window_full(self):
+        return self.acked is not None and self.sent - self.acked >= self.ack_window
+    
+    async def get(self):
+        """Wait for and return the highest-priority (kind, payload)"""
+        while not self._size or self.window_full():
+            self._ready.clear()
+            await self._ready.wait()
+        
+        for queue in self._queues.values():
+            if queue:
+                self._size -= 1
+                self.sent += 1
+                if self._size <= self.maxsize:
+                    self.over_limit_since = None
+                return queue.popleft()
+    
+    def _drop_oldest_ephemeral(self):
+        # Shed the least important events first
+        for priority in sorted(self._queues, reverse=True):
+            queue = self._queues[priority]
+            for i, (kind, _) in enumerate(queue):
+                if kind in EPHEMERAL_KINDS:
+                    del queue[i]
+                    self._size -= 1
+                    counters[f'dropped_{kind}'] += 1
+                    return True
+        return False
+    
+    def _check_limits(self):
+        if self._size <= self.maxsize:
+            self.over_limit_since = None
+            return
+        
+        now = time.monotonic()
+        if self.over_limit_since is None:
+            self.over_limit_since = now
+        
+        if self._size > self.hard_limit or now - self.over_limit_since > self.slow_timeout:
+            counters['slow_consumer_disconnects'] += 1
+            raise SlowConsumer(f'{self._size} events queued')
+
+
+def outbound_stats():
+    """Snapshot of queue depths and drop counters for this process"""
+    depths = [len(queue) for queue in _live_queues]
+    return {
+        'connections': len(depths),
+        'queued': sum(depths),
+        'max_depth': max(depths, default=0),
+        **counters,
+    }
@@ -0,0 +1,14 @@
+"""
+Pagination for chat endpoints
+"""
+from django.conf import settings
+from accounts.pagination import KeysetPagination
+
+
+class ParticipantPagination(KeysetPagination):
+    """Members of a conversation in join order"""
+    ordering = ('id',)
+    max_page_size = 500
+
+    def __init__(self):
+        self.page_size = settings.CHAT_PARTICIPANTS_PAGE_SIZE
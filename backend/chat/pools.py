@@ -0,0 +1,82 @@
+"""
+Database threads, sized separately for REST and WebSocket work.
+
+ORM code always runs in a thread. Left to asgiref, every ASGI request gets
+a new thread of its own and all consumers share a single one, so neither
+side can be sized. A burst of REST traffic also competes with the
+consumers for the same database.
+
+- Consumers run their database calls (`chat.metrics.database_sync_to_async`)
+  on the CHAT_WS_DB_THREADS threads of `ws_executor()`.
+- The hot REST views (chat.async_views) run whole, through `rest_view()`,
+  on the CHAT_REST_DB_THREADS threads of `rest_executor()`. Requests
+  beyond the pool wait on the event loop without a thread.
+
+Both go through sync_to_async with an executor of their own. Every one of
+these threads keeps its own persistent connection.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from . import metrics, profiling
+
+rest_wait_seconds = metrics.Histogram(
+    'chat_rest_db_thread_wait_seconds', 'Time hot REST requests wait for a database thread'
+)
+
+_ws_executor = None
+_rest_executor = None
+
+
+def ws_executor():
+    """The thread pool for consumer database calls"""
+    global _ws_executor
+    if _ws_executor is None:
+        _ws_executor = ThreadPoolExecutor(
+            settings.CHAT_WS_DB_THREADS, thread_name_prefix='ws-db'
+        )
+    return _ws_executor
+
+
+def rest_executor():
+    """The thread pool for the hot REST views"""
+    global _rest_executor
+    if _rest_executor is None:
+        _rest_executor = ThreadPoolExecutor(
+            settings.CHAT_REST_DB_THREADS, thread_name_prefix='rest-db'
+        )
+    return _rest_executor
+
+
+def rest_view(view_func):
+    """Sync `view_func` as a coroutine function running on a REST thread"""
+    def run(submitted, request, *args, **kwargs):
+        rest_wait_seconds.observe(time.perf_counter() - submitted)
+        # What request_started and request_finished do for this thread's
+        # connection
+        close_old_connections()
+        try:
+            response = view_func(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+        finally:
+            close_old_connections()
+    
+    async def view(request, *args, **kwargs):
+        if profiling.is_active():
+            # Back to the thread ProfilerMiddleware is profiling
+            pooled = sync_to_async(run)
+        else:
+            pooled = sync_to_async(run, thread_sensitive=False, executor=rest_executor())
+        return await pooled(time.perf_counter(), request, *args, **kwargs)
+    return view
+
+
+@metrics.register_collector
+def _pool_stats():
+    for name, executor in (('rest', _rest_executor), ('ws', _ws_executor)):
+        queued = executor._work_queue.qsize() if executor is not None else 0
+        yield f'chat_{name}_db_calls_queued', 'gauge', f'{name.upper()} database calls waiting for a thread', queued
@@ -0,0 +1,282 @@
+"""
+Opt-in profiling of single requests and WebSocket events.
+
+Staff users can ask for one REST request (`X-Profile: 1` header or
+`?_profile=1`) or the next WebSocket frame (a `{"type": "profile"}`
+control frame) to run under cProfile. Every SQL query issued while the
+profile is active is recorded with its offset and duration, including
+queries run in database_sync_to_async threads. The result is saved under
+PROFILE_ROOT as JSON (call tree, flamegraph layout, SQL timeline) plus the
+raw .prof file, and is listed on the admin page at /admin/profiles/.
+
+Only one profile runs per process at a time; requests that ask for one
+while another is running are served unprofiled.
+"""
+import cProfile
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from django.conf import settings
+from django.utils import timezone
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = '_profile'
+PROFILE_ID_RE = re.compile(r'^[0-9]{14}-[0-9a-f]{8}$')
+
+# Edges below this share of the total are folded away in the call tree
+MIN_FRACTION = 0.005
+MAX_DEPTH = 60
+
+_active = ContextVar('active_profile', default=None)
+_running = threading.Lock()
+
+
+def profile_root():
+    return str(settings.PROFILE_ROOT)
+
+
+def wants_profile(request):
+    """Whether a REST request asks to be profiled (permission is checked separately)"""
+    return bool(request.headers.get(PROFILE_HEADER)) or PROFILE_PARAM in request.GET
+
+
+def can_profile(user):
+    return bool(user and user.is_authenticated and user.is_staff)
+
+
+def is_active():
+    """Whether the calling context runs under a profile"""
+    return _active.get() is not None
+
+
+def record_sql(execute, sql, params, many, context):
+    """Connection execute wrapper: time queries of the active profile, if any"""
+    profile = _active.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        end = time.perf_counter()
+        profile.sql.append({
+            'start_ms': round((start - profile.start) * 1000, 3),
+            'duration_ms': round((end - start) * 1000, 3),
+            'sql': sql,
+            'many': many,
+        })
+
+
+class Profiler:
+    """
+    Context manager running its block under cProfile.
+    
+    `active` is False when another profile already runs in this process;
+    the block then runs unprofiled and save() returns None.
+    """
+    
+    def __init__(self, kind, label, user):
+        self.kind = kind
+        self.label = label
+        self.user = user
+        self.sql = []
+        self.active = False
+        self.profile = None
+    
+    def __enter__(self):
+        self.active = _running.acquire(blocking=False)
+        if not self.active:
+            return self
+        self.started_at = timezone.now()
+        self.profile = cProfile.Profile()
+        self._token = _active.set(self)
+        self.start = time.perf_counter()
+        self.profile.enable()
+        return self
+    
+    def __exit__(self, *exc_info):
+        if not self.active:
+            return
+        self.profile.disable()
+        self.duration = time.perf_counter() - self.start
+        _active.reset(self._token)
+        _running.release()
+    
+    def save(self):
+        """Write the profile to PROFILE_ROOT and return its id"""
+        if not self.active:
+            return None
+        
+        profile_id = f"{self.started_at:%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+        root = profile_root()
+        os.makedirs(root, exist_ok=True)
+        
+        stats = pstats.Stats(self.profile)
+        self.profile.dump_stats(os.path.join(root, f'{profile_id}.prof'))
+        tree = call_tree(stats.stats, self.duration)
+        data = {
+            'id': profile_id,
+            'kind': self.kind,
+            'label': self.label,
+            'user': self.user.username,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round(self.duration * 1000, 3),
+            'sql_count': len(self.sql),
+            'sql_ms': round(sum(q['duration_ms'] for q in self.sql), 3),
+            'sql': self.sql,
+            'tree': tree,
+            'top': top_functions(stats.stats),
+        }
+        path = os.path.join(root, f'{profile_id}.json')
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(f'{path}.tmp', path)
+        
+        prune(root, settings.PROFILE_KEEP)
+        return profile_id
+
+
+def function_label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name
+    parts = filename.replace('\\', '/').split('/')
+    return f"{name} ({'/'.join(parts[-2:])}:{line})"
+
+
+def call_tree(raw_stats, duration):
+    """
+    Approximate call tree from cProfile's caller graph.
+    
+    cProfile keeps times per caller/callee edge, not per full stack, so each
+    node's children are its callees with the time recorded on that edge.
+    Recursion is cut at the first repeat of a function on the path.
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in raw_stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, {})[func] = edge[3]
+    
+    roots = [func for func, stat in raw_stats.items() if not stat[4]]
+    total = duration or sum(raw_stats[f][3] for f in roots) or 1e-9
+    
+    def build(func, seconds, path, depth):
+        node = {'name': function_label(func), 'ms': round(seconds * 1000, 3), 'children': []}
+        if depth >= MAX_DEPTH:
+            return node
+        children = sorted(callees.get(func, {}).items(), key=lambda item: -item[1])
+        for child, child_seconds in children:
+            if child in path or child_seconds / total < MIN_FRACTION:
+                continue
+            node['children'].append(build(child, min(child_seconds, seconds), path | {child}, depth + 1))
+        return node
+    
+    root = {'name': 'all', 'ms': round(total * 1000, 3), 'children': []}
+    for func in sorted(roots, key=lambda f: -raw_stats[f][3]):
+        if raw_stats[func][3] / total >= MIN_FRACTION:
+            root['children'].append(build(func, raw_stats[func][3], {func}, 1))
+    return root
+
+
+def top_functions(raw_stats, limit=30):
+    rows = sorted(raw_stats.items(), key=lambda item: -item[1][3])[:limit]
+    return [
+        {
+            'name': function_label(func),
+            'calls': nc,
+            'self_ms': round(tt * 1000, 3),
+            'total_ms': round(ct * 1000, 3),
+        }
+        for func, (cc, nc, tt, ct, _) in rows
+    ]
+
+
+def flame_rows(tree):
+    """Lay the call tree out as icicle boxes: depth, left %, width %"""
+    total = tree['ms'] or 1e-9
+    rows = []
+    
+    def place(node, depth, left):
+        width = node['ms'] / total * 100
+        rows.append({
+            'depth': depth,
+            'left': round(left, 4),
+            'width': round(width, 4),
+            'name': node['name'],
+            'ms': node['ms'],
+        })
+        offset = left
+        for child in node['children']:
+            place(child, depth + 1, offset)
+            offset += child['ms'] / total * 100
+    
+    place(tree, 0, 0.0)
+    return rows
+
+
+def tree_rows(tree):
+    """Flatten the call tree depth-first for an indented listing"""
+    total = tree['ms'] or 1e-9
+    rows = []
+    
+    def walk(node, depth):
+        rows.append({
+            'depth': depth,
+            'name': node['name'],
+            'ms': node['ms'],
+            'percent': round(node['ms'] / total * 100, 1),
+        })
+        for child in node['children']:
+            walk(child, depth + 1)
+    
+    walk(tree, 0)
+    return rows
+
+
+def list_profiles():
+    """Metadata of saved profiles, newest first"""
+    root = profile_root()
+    if not os.path.isdir(root):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(root), reverse=True):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(root, name)) as f:
+            data = json.load(f)
+        profiles.append({key: data[key] for key in (
+            'id', 'kind', 'label', 'user', 'started_at', 'duration_ms', 'sql_count', 'sql_ms'
+        )})
+    return profiles
+
+
+def load_profile(profile_id):
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(profile_root(), f'{profile_id}.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def prof_path(profile_id):
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    path = os.path.join(profile_root(), f'{profile_id}.prof')
+    return path if os.path.exists(path) else None
+
+
+def prune(root, keep):
+    saved = sorted(name[:-5] for name in os.listdir(root) if name.endswith('.json'))
+    for profile_id in saved[:-max(keep, 1)]:
+        for ext in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(root, profile_id + ext))
+            except FileNotFoundError:
+                pass
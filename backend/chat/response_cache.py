@@ -0,0 +1,165 @@
+"""
+Per-user cache of serialized conversation list pages.
+
+A user's inbox only changes through the writes that bump their inbox
+version (see chat.versioning), so a page serialized under one version can
+be served again until the version moves. Entries are keyed by user and
+request (host, path and query string) and remember the version they were
+built under; a lookup under any other version is a miss. Because the
+version is read before the page is built, an entry can be newer than its
+version but never older, so no write that has bumped the version is ever
+answered from the cache.
+
+CHAT_INBOX_CACHE selects the store:
+- 'memory' (default): an LRU per process, capped at
+  CHAT_INBOX_CACHE_MAX_BYTES of serialized payload
+- 'shared': the Django cache, with the version in the key and entries
+  expiring after CHAT_INBOX_CACHE_TTL seconds
+- '' (empty): no caching
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from . import metrics
+
+lookups = metrics.Counter(
+    'chat_inbox_cache_lookups_total', 'Conversation list cache lookups', ['result']
+)
+
+
+class MemoryResponseCache:
+    """LRU over (user, request) entries, bounded by payload bytes"""
+    shared = False
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, user_id, variant, version):
+        key = (user_id, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != version:
+                # Superseded; it can never be served again
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def set(self, user_id, variant, version, data, size):
+        # One page must not flush everyone else's
+        if size > self.max_bytes // 4:
+            return
+        key = (user_id, variant)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (version, data, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+    
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+class SharedResponseCache:
+    """Entries in the Django cache, shared by every worker"""
+    shared = True
+    
+    def __init__(self, timeout):
+        self.timeout = timeout
+    
+    @staticmethod
+    def key(user_id, variant, version):
+        digest = hashlib.sha1(variant.encode()).hexdigest()
+        return f'inbox-page:{user_id}:{version}:{digest}'
+    
+    def get(self, user_id, variant, version):
+        return cache.get(self.key(user_id, variant, version))
+    
+    def set(self, user_id, variant, version, data, size):
+        cache.set(self.key(user_id, variant, version), data, self.timeout)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """The configured store, or None when caching is off"""
+    global _cache
+    backend = settings.CHAT_INBOX_CACHE
+    if not backend:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            if backend == 'shared':
+                _cache = SharedResponseCache(settings.CHAT_INBOX_CACHE_TTL)
+            else:
+                _cache = MemoryResponseCache(settings.CHAT_INBOX_CACHE_MAX_BYTES)
+    return _cache
+
+
+def cached_data(store, request, version):
+    """The cached page data for `request` under inbox `version`, or None"""
+    variant = f'{request.get_host()}{request.get_full_path()}'
+    data = store.get(request.user.id, variant, version)
+    lookups.inc('miss' if data is None else 'hit')
+    return data
+
+
+def remember(store, request, version, response):
+    """Keep a 200 response for the next request under the same version"""
+    if response.status_code != 200:
+        return
+    # A plain copy, encoded the way the JSON renderer does: serializer
+    # output keeps its serializer (and the page of instances) alive
+    variant = f'{request.get_host()}{request.get_full_path()}'
+    encoded = json.dumps(response.data, cls=JSONEncoder)
+    store.set(request.user.id, variant, version, json.loads(encoded), len(encoded))
+
+
+def cached_response(request, version, build):
+    """
+    The response for `request` under inbox `version`: a cached page, or
+    `build()` stored for the next request when it returns a 200.
+    """
+    store = get_response_cache()
+    if store is None:
+        return build()
+    
+    data = cached_data(store, request, version)
+    if data is not None:
+        return Response(data)
+    
+    response = build()
+    remember(store, request, version, response)
+    return response
+
+
+@metrics.register_collector
+def _cache_stats():
+    store = _cache
+    if isinstance(store, MemoryResponseCache):
+        yield 'chat_inbox_cache_entries', 'gauge', 'Conversation list pages cached in this worker', len(store)
+        yield 'chat_inbox_cache_bytes', 'gauge', 'Payload bytes cached in this worker', store.bytes
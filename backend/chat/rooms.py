@@ -0,0 +1,63 @@
+"""
+Room groups and the events sent to them.
+
+Every connection to conversation <id> receives the `chat_<id>` group,
+either directly or through its process's relay (see chat.fanout). Every
+connection of user <id> also joins `user_<id>`, for events addressed to the
+user rather than the room, and `inbox_<id>` for each large room of theirs
+(see chat.inbox). Events carry their group name and their payload
+pre-encoded in every wire format (see chat.codecs).
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from . import codecs, metrics
+
+
+def room_group_name(conversation_id):
+    return f'chat_{conversation_id}'
+
+
+def user_group_name(user_id):
+    return f'user_{user_id}'
+
+
+def inbox_group_name(conversation_id):
+    return f'inbox_{conversation_id}'
+
+
+def room_event(conversation_id, handler, payload, **extra):
+    """Channel-layer event for consumer method `handler` carrying `payload`"""
+    return {
+        'type': handler,
+        'group': room_group_name(conversation_id),
+        'frames': codecs.encode_frames(payload),
+        **extra
+    }
+
+
+def send_to_room_on_commit(conversation_id, handler, payload, **extra):
+    """Broadcast to a room from sync code once the transaction commits"""
+    event = room_event(conversation_id, handler, payload, **extra)
+    
+    def send():
+        with metrics.channel_layer_send_seconds.time(handler):
+            async_to_sync(get_channel_layer().group_send)(event['group'], event)
+    
+    transaction.on_commit(send)
+
+
+def send_to_user_on_commit(user_id, handler, payload, **extra):
+    """Send to every connection of a user once the transaction commits"""
+    event = {
+        'type': handler,
+        'group': user_group_name(user_id),
+        'frames': codecs.encode_frames(payload),
+        **extra
+    }
+    
+    def send():
+        with metrics.channel_layer_send_seconds.time(handler):
+            async_to_sync(get_channel_layer().group_send)(event['group'], event)
+    
+    transaction.on_commit(send)
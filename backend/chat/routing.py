@@ -3,5 +3,6 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<conversation_id>\d+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/inbox/$', consumers.InboxConsumer.as_asgi()),
 ]
 
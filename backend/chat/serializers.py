@@ -1,34 +1,128 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import Conversation, Participant, Message
+from django.db import transaction
+from django.urls import reverse
+from rest_framework.utils.urls import replace_query_param
+from accounts.serializers import AvatarField, DynamicFieldsMixin, UserSearchSerializer
+from .idempotency import NONCE_MAX_LENGTH
+from .membership import add_members, listed_members
+from .models import Attachment, Conversation, Participant, Message, UploadSession
+from .pagination import ParticipantPagination
 
 User = get_user_model()
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class AttachmentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Serializer for uploaded attachments"""
+    size = serializers.IntegerField(source='blob.size', read_only=True)
+    sha256 = serializers.CharField(source='blob.sha256', read_only=True)
+    
+    class Meta:
+        model = Attachment
+        fields = ['id', 'filename', 'content_type', 'size', 'sha256', 'created_at']
+        read_only_fields = fields
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Serializer for resumable upload sessions"""
+    complete = serializers.BooleanField(source='is_complete', read_only=True)
+    attachment = AttachmentSerializer(read_only=True)
+    
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'filename', 'content_type', 'size', 'received',
+            'complete', 'attachment', 'created_at'
+        ]
+        read_only_fields = ['id', 'received', 'complete', 'attachment', 'created_at']
+    
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Size must be positive.")
+        if value > settings.ATTACHMENT_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"Attachments are limited to {settings.ATTACHMENT_MAX_SIZE} bytes."
+            )
+        return value
+
+
+class MessageSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for messages"""
     sender_username = serializers.CharField(source='sender.username', read_only=True)
     sender_name = serializers.CharField(source='sender.full_name', read_only=True)
-    sender_avatar = serializers.ImageField(source='sender.avatar', read_only=True)
+    sender_avatar = AvatarField(source='sender')
+    attachments = AttachmentSerializer(many=True, read_only=True)
+    attachment_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        write_only=True,
+        required=False
+    )
+    nonce = serializers.CharField(
+        source='client_nonce',
+        max_length=NONCE_MAX_LENGTH,
+        required=False,
+        allow_null=True
+    )
     
     class Meta:
         model = Message
         fields = [
             'id', 'conversation', 'sender', 'sender_username',
-            'sender_name', 'sender_avatar', 'content', 'is_read',
-            'created_at', 'updated_at'
+            'sender_name', 'sender_avatar', 'content', 'attachments',
+            'attachment_ids', 'nonce', 'is_read', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'sender', 'created_at', 'updated_at']
+        expandable_fields = {
+            'sender': (UserSearchSerializer, {}),
+        }
+    
+    def validate_conversation(self, value):
+        """Only members may post to a conversation"""
+        user = self.context['request'].user
+        if not value.participants.filter(user=user).exists():
+            raise serializers.ValidationError("Not a participant.")
+        return value
+    
+    def validate_attachment_ids(self, value):
+        """Only the uploader may attach a file to a message"""
+        user = self.context['request'].user
+        ids = set(value)
+        owned = set(Attachment.objects.filter(
+            id__in=ids,
+            uploaded_by=user
+        ).values_list('id', flat=True))
+        if owned != ids:
+            raise serializers.ValidationError("Unknown attachment id.")
+        return list(ids)
+    
+    def validate(self, attrs):
+        if self.partial:
+            return attrs
+        content = attrs.get('content', '').strip()
+        if not content and not attrs.get('attachment_ids'):
+            raise serializers.ValidationError({
+                "content": "A message needs text or an attachment."
+            })
+        return attrs
+    
+    def create(self, validated_data):
+        attachment_ids = validated_data.pop('attachment_ids', [])
+        with transaction.atomic():
+            message = super().create(validated_data)
+            if attachment_ids:
+                message.attachments.set(attachment_ids)
+        return message
 
 
-class ParticipantSerializer(serializers.ModelSerializer):
+class ParticipantSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for conversation participants"""
     user_id = serializers.IntegerField(source='user.id', read_only=True)
     username = serializers.CharField(source='user.username', read_only=True)
     full_name = serializers.CharField(source='user.full_name', read_only=True)
-    avatar = serializers.ImageField(source='user.avatar', read_only=True)
+    avatar = AvatarField(source='user')
     is_online = serializers.BooleanField(source='user.is_online', read_only=True)
-    unread_count = serializers.IntegerField(read_only=True)
+    unread_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Participant
@@ -36,15 +130,36 @@ class ParticipantSerializer(serializers.ModelSerializer):
             'id', 'user_id', 'username', 'full_name', 'avatar',
             'is_online', 'joined_at', 'last_read_at', 'unread_count'
         ]
+    
+    def get_unread_count(self, obj):
+        # Counting is per row, so only the requesting user's row gets one
+        request = self.context.get('request')
+        if request is None or obj.user_id != request.user.id:
+            return None
+        return obj.unread_count
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if data.get('unread_count', 0) is None:
+            del data['unread_count']
+        return data
 
 
-class ConversationSerializer(serializers.ModelSerializer):
-    """Serializer for conversations"""
-    participants = ParticipantSerializer(many=True, read_only=True)
+class ConversationSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """
+    Serializer for conversations.
+    
+    Only the first page of participants is embedded; `participants_next`
+    links to the participants endpoint for the rest.
+    """
+    participants = serializers.SerializerMethodField()
+    participants_count = serializers.SerializerMethodField()
+    participants_next = serializers.SerializerMethodField()
     participant_ids = serializers.ListField(
         child=serializers.IntegerField(),
         write_only=True,
-        required=False
+        required=False,
+        max_length=settings.CHAT_BULK_MEMBERS_LIMIT
     )
     last_message = MessageSerializer(read_only=True)
     created_by_username = serializers.CharField(
@@ -56,10 +171,55 @@ class ConversationSerializer(serializers.ModelSerializer):
         model = Conversation
         fields = [
             'id', 'name', 'is_group', 'created_by', 'created_by_username',
-            'participants', 'participant_ids', 'last_message',
-            'created_at', 'updated_at'
+            'participants', 'participants_count', 'participants_next',
+            'participant_ids', 'last_message', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_by', 'created_at', 'updated_at']
+        expandable_fields = {
+            'created_by': (UserSearchSerializer, {}),
+        }
+    
+    def _participant_page(self, obj):
+        """First page of participants (one row extra to detect a next page)"""
+        if not hasattr(obj, '_participant_page'):
+            size = settings.CHAT_PARTICIPANTS_PAGE_SIZE
+            rows = list(
+                obj.participants.select_related('user').order_by(*ParticipantPagination.ordering)[:size + 1]
+            )
+            obj._participant_page = (rows[:size], len(rows) > size)
+        return obj._participant_page
+    
+    def get_participants(self, obj):
+        page, _ = self._participant_page(obj)
+        only = self._field_spec[0] or {}
+        return ParticipantSerializer(
+            page,
+            many=True,
+            context=self.context,
+            fields=only.get('participants') or None,
+            expand={}
+        ).data
+    
+    def get_participants_count(self, obj):
+        page, has_more = self._participant_page(obj)
+        if not has_more:
+            return len(page)
+        return obj.participants.count()
+    
+    def get_participants_next(self, obj):
+        page, has_more = self._participant_page(obj)
+        if not has_more:
+            return None
+        pagination = ParticipantPagination()
+        url = reverse('conversation-participants', args=[obj.pk])
+        request = self.context.get('request')
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        return replace_query_param(
+            url,
+            pagination.cursor_query_param,
+            pagination.encode_cursor(0, pagination._key(page[-1]))
+        )
     
     def create(self, validated_data):
         from django.db.models import Count, Q
@@ -95,31 +255,41 @@ class ConversationSerializer(serializers.ModelSerializer):
                     # Found existing 1-on-1 conversation
                     return conv
         
-        # Create conversation
-        conversation = Conversation.objects.create(
-            created_by=user,
-            **validated_data
-        )
-        
-        # Add creator as participant
-        Participant.objects.create(conversation=conversation, user=user)
-        
-        # Add other participants
-        for user_id in other_participant_ids:
-            try:
-                participant_user = User.objects.get(id=user_id)
-                Participant.objects.create(
-                    conversation=conversation,
-                    user=participant_user
-                )
-            except User.DoesNotExist:
-                pass
+        with transaction.atomic():
+            # Create conversation
+            conversation = Conversation.objects.create(
+                created_by=user,
+                **validated_data
+            )
+            
+            # Add creator and other participants; unknown ids are skipped
+            add_members(
+                conversation,
+                [user.id, *other_participant_ids],
+                actor=user,
+                notify=False
+            )
         
         return conversation
 
 
-class ConversationListSerializer(serializers.ModelSerializer):
-    """Simplified serializer for conversation list"""
+class MembershipSerializer(serializers.Serializer):
+    """Body of the bulk add/remove member actions"""
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=settings.CHAT_BULK_MEMBERS_LIMIT
+    )
+
+
+class ConversationListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """
+    Simplified serializer for conversation list.
+    
+    Only the first CHAT_LIST_PARTICIPANTS other members are listed. The
+    list view annotates `member_count` and prefetches `listed_members` and
+    `own_participants`; without them each falls back to a query.
+    """
     participants_count = serializers.SerializerMethodField()
     last_message_preview = serializers.SerializerMethodField()
     unread_count = serializers.SerializerMethodField()
@@ -134,6 +304,8 @@ class ConversationListSerializer(serializers.ModelSerializer):
         ]
     
     def get_participants_count(self, obj):
+        if hasattr(obj, 'member_count'):
+            return obj.member_count
         return obj.participants.count()
     
     def get_last_message_preview(self, obj):
@@ -149,14 +321,19 @@ class ConversationListSerializer(serializers.ModelSerializer):
     
     def get_unread_count(self, obj):
         user = self.context['request'].user
-        try:
-            participant = obj.participants.get(user=user)
+        participants = getattr(obj, 'own_participants', None)
+        if participants is None:
+            participants = obj.participants.filter(user_id=user.id)
+        for participant in participants:
             return participant.unread_count
-        except Participant.DoesNotExist:
-            return 0
+        return 0
     
     def get_other_participants(self, obj):
         user = self.context['request'].user
-        participants = obj.participants.exclude(user=user)
+        participants = getattr(obj, 'listed_members', None)
+        if participants is None:
+            participants = listed_members(user.id).filter(
+                conversation=obj
+            )[:settings.CHAT_LIST_PARTICIPANTS]
         return ParticipantSerializer(participants, many=True).data
 
@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .archive import remove_archive
+from .inbox import push_message_on_commit
+from .models import Conversation, Message, Participant
+from .profiling import record_sql
+from .versioning import bump_conversation, bump_user
+
+
+@receiver(connection_created)
+def install_profiler_hook(sender, connection, **kwargs):
+    """Let an active profile see the queries of every connection"""
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """Apply SQLITE_PRAGMAS to each new SQLite connection"""
+    if connection.vendor != 'sqlite':
+        return
+
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def message_changed(sender, instance, **kwargs):
+    bump_conversation(instance.conversation_id)
+
+
+@receiver(post_save, sender=Message)
+def message_created(sender, instance, created, **kwargs):
+    if created:
+        push_message_on_commit(instance)
+
+
+@receiver(post_save, sender=Conversation)
+def conversation_changed(sender, instance, **kwargs):
+    bump_conversation(instance.id)
+
+
+@receiver(post_delete, sender=Conversation)
+def conversation_deleted(sender, instance, **kwargs):
+    conversation_id = instance.id
+    transaction.on_commit(lambda: remove_archive(conversation_id))
+
+
+@receiver(post_save, sender=Participant)
+def participant_saved(sender, instance, created, **kwargs):
+    # A new member's inbox now includes this conversation
+    bump_conversation(instance.conversation_id, [instance.user_id] if created else ())
+
+
+@receiver(post_delete, sender=Participant)
+def participant_deleted(sender, instance, **kwargs):
+    # The removed member's inbox no longer includes it
+    bump_conversation(instance.conversation_id, [instance.user_id])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, created, **kwargs):
+    if not created:
+        bump_user(instance.id)
@@ -0,0 +1,31 @@
+"""
+Helpers for streaming responses under ASGI.
+
+Django 4.2 buffers a StreamingHttpResponse whose content is a synchronous
+iterator into a list before sending it to an ASGI server. Wrapping the
+iterator with `iterate_in_thread` keeps memory bounded by pulling one chunk
+at a time from a worker thread.
+"""
+from asgiref.sync import sync_to_async
+
+_EXHAUSTED = object()
+
+
+async def iterate_in_thread(iterator, thread_sensitive=True):
+    """
+    Adapt a synchronous iterator into an async one, one item per hop.
+
+    Keep `thread_sensitive=True` for iterators that use the ORM, so every
+    chunk runs on the same thread and database connection.
+    """
+    advance = sync_to_async(next, thread_sensitive=thread_sensitive)
+    try:
+        while True:
+            chunk = await advance(iterator, _EXHAUSTED)
+            if chunk is _EXHAUSTED:
+                break
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=thread_sensitive)()
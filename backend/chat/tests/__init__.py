@@ -0,0 +1,7 @@
+from django.test import override_settings
+
+# Tests need no Redis: channel layer and cache are in process memory
+without_redis = override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
@@ -0,0 +1,102 @@
+"""
+A reconnect storm against chat.admission, scaled down from
+benchmarks/bench_reconnect_storm.py.
+"""
+import asyncio
+import json
+from unittest import mock
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.test import TransactionTestCase, override_settings
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from chat import admission
+from chat.models import Conversation, Participant
+from chat_project.asgi import application
+from . import without_redis
+
+CLIENTS = 60
+ROOM_SIZE = 10
+CONCURRENCY = 4
+QUEUE = 8
+
+
+@without_redis
+@override_settings(
+    CHAT_RATE_LIMITS={name: (1e9, 1e9) for name in settings.CHAT_RATE_LIMITS},
+    CHAT_LARGE_ROOM_SIZE=1,
+    CHAT_HANDSHAKE_CONCURRENCY=CONCURRENCY,
+    CHAT_HANDSHAKE_QUEUE=QUEUE,
+    CHAT_HANDSHAKE_QUEUE_TIMEOUT=0.5,
+    CHAT_HANDSHAKE_RETRY_AFTER=0.01,
+    # No jitter, so the spreading of retries is visible in the hints
+    CHAT_HANDSHAKE_RETRY_JITTER=0,
+)
+class ReconnectStormTests(TransactionTestCase):
+    """CLIENTS clients opening a socket at the same instant"""
+
+    def setUp(self):
+        users = User.objects.bulk_create([
+            User(username=f'storm_{i}', email=f'storm_{i}@example.com')
+            for i in range(CLIENTS)
+        ])
+        rooms = Conversation.objects.bulk_create([
+            Conversation(name=f'Room {i}', is_group=True, created_by=users[0])
+            for i in range(0, CLIENTS, ROOM_SIZE)
+        ])
+        Participant.objects.bulk_create([
+            Participant(conversation=rooms[i // ROOM_SIZE], user=user)
+            for i, user in enumerate(users)
+        ])
+        self.credentials = [
+            (generate_access_token(user), rooms[i // ROOM_SIZE].id)
+            for i, user in enumerate(users)
+        ]
+
+    async def connect(self, token, room_id, hints):
+        """Connect until admitted, following every retry_after hint"""
+        while True:
+            communicator = WebsocketCommunicator(
+                application, f'/ws/chat/{room_id}/?token={token}',
+                headers=[(b'host', b'testserver'), (b'origin', b'http://testserver')]
+            )
+            connected, _ = await communicator.connect(timeout=30)
+            self.assertTrue(connected)
+            # A rejected handshake is followed at once by the hint and the close
+            if await communicator.receive_nothing(0.05):
+                return communicator
+            hint = json.loads((await communicator.receive_output())['text'])
+            close = await communicator.receive_output()
+            self.assertEqual(hint['reason'], 'busy')
+            self.assertEqual(close['code'], admission.CLOSE_TRY_AGAIN_LATER)
+            hints.append(hint['retry_after'])
+            await asyncio.sleep(hint['retry_after'])
+
+    async def test_storm_is_admitted_in_bounded_batches(self):
+        hints = []
+        sent = []
+        reject = admission.reject
+
+        async def recording_reject(scope, receive, send, delay):
+            sent.append(delay)
+            await reject(scope, receive, send, delay)
+
+        with mock.patch.object(admission, 'reject', recording_reject):
+            communicators = await asyncio.gather(*(
+                self.connect(token, room_id, hints) for token, room_id in self.credentials
+            ))
+            control = admission.get_admission()
+            await asyncio.gather(*(c.disconnect() for c in communicators))
+
+        # Every client got in, never more than CONCURRENCY handshakes at once
+        self.assertEqual(len(communicators), CLIENTS)
+        self.assertLessEqual(control.peak_in_flight, CONCURRENCY)
+        self.assertEqual(control.in_flight, 0)
+
+        # The storm overflowed the queue, and the clients turned away
+        # together were told to come back one after another
+        first_wave = sent[:CLIENTS - CONCURRENCY - QUEUE - 10]
+        self.assertTrue(first_wave)
+        self.assertEqual(sorted(hints), sorted(sent))
+        self.assertEqual(first_wave, sorted(set(first_wave)))
+        self.assertGreater(first_wave[-1], settings.CHAT_HANDSHAKE_RETRY_AFTER)
@@ -0,0 +1,86 @@
+"""
+The hot REST endpoints under ASGI, on the REST threads and off them
+(see chat.async_views).
+"""
+import json
+import threading
+from unittest import mock
+from channels.testing import HttpCommunicator
+from django.conf import settings
+from django.test import TransactionTestCase, override_settings
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from chat.models import Conversation, Message, Participant
+from chat.views import ConversationViewSet
+from chat_project.asgi import application
+from . import without_redis
+
+
+@without_redis
+@override_settings(
+    CHAT_RATE_LIMITS={name: (1e9, 1e9) for name in settings.CHAT_RATE_LIMITS},
+    CHAT_INBOX_CACHE='',
+)
+class RestThreadTests(TransactionTestCase):
+
+    def setUp(self):
+        self.alice, self.bob, self.carol = User.objects.bulk_create([
+            User(username=name, email=f'{name}@example.com') for name in ('alice', 'bob', 'carol')
+        ])
+        self.room = Conversation.objects.create(name='Room', is_group=True, created_by=self.alice)
+        Participant.objects.bulk_create([
+            Participant(conversation=self.room, user=self.alice),
+            Participant(conversation=self.room, user=self.bob),
+        ])
+        Message.objects.create(conversation=self.room, sender=self.bob, content='hello')
+
+    async def request(self, method, path, user, body=None):
+        headers = [
+            (b'host', b'testserver'),
+            (b'authorization', f'Bearer {generate_access_token(user)}'.encode()),
+        ]
+        if body is not None:
+            headers.append((b'content-type', b'application/json'))
+        communicator = HttpCommunicator(
+            application, method, path, body=json.dumps(body).encode() if body is not None else b'',
+            headers=headers
+        )
+        response = await communicator.get_response(timeout=10)
+        return response['status'], response['body']
+
+    async def both_ways(self, method, path, user, body=None):
+        """The response from the REST threads and from the plain view"""
+        with self.settings(CHAT_ASYNC_VIEWS=True):
+            pooled = await self.request(method, path, user, body)
+        with self.settings(CHAT_ASYNC_VIEWS=False):
+            plain = await self.request(method, path, user, body)
+        return pooled, plain
+
+    async def test_view_runs_on_a_rest_thread(self):
+        threads = []
+        list_view = ConversationViewSet.list
+
+        def recording_list(view, request, *args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return list_view(view, request, *args, **kwargs)
+
+        with mock.patch.object(ConversationViewSet, 'list', recording_list):
+            pooled, plain = await self.both_ways('GET', '/api/chat/conversations/', self.alice)
+        self.assertEqual(pooled, plain)
+        self.assertEqual(pooled[0], 200)
+        self.assertTrue(threads[0].startswith('rest-db'), threads)
+        self.assertFalse(threads[1].startswith('rest-db'), threads)
+
+    async def test_responses_match_the_plain_views(self):
+        for method, path, user in [
+            ('GET', f'/api/chat/messages/?conversation={self.room.id}', self.alice),
+            ('HEAD', f'/api/chat/messages/?conversation={self.room.id}', self.alice),
+            ('GET', f'/api/chat/messages/?conversation={self.room.id}', self.carol),
+            ('POST', f'/api/chat/conversations/{self.room.id}/mark_read/', self.carol),
+        ]:
+            with self.subTest(method=method, path=path, user=user.username):
+                pooled, plain = await self.both_ways(method, path, user)
+                self.assertEqual(pooled, plain)
+
+        status, _ = await self.request('POST', f'/api/chat/conversations/{self.room.id}/mark_read/', self.bob)
+        self.assertEqual(status, 200)
@@ -0,0 +1,83 @@
+"""
+Client frames and server pushes on the chat and inbox sockets.
+"""
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.test import TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from chat.models import Conversation, Message, Participant
+from chat_project.asgi import application
+from . import without_redis
+
+HEADERS = [(b'host', b'testserver'), (b'origin', b'http://testserver')]
+
+
+@without_redis
+@override_settings(CHAT_RATE_LIMITS={name: (1e9, 1e9) for name in settings.CHAT_RATE_LIMITS})
+class ConsumerTests(TransactionTestCase):
+
+    def setUp(self):
+        self.alice, self.bob = User.objects.bulk_create([
+            User(username='alice', email='alice@example.com'),
+            User(username='bob', email='bob@example.com'),
+        ])
+        self.room = Conversation.objects.create(name='Room', is_group=True, created_by=self.alice)
+        Participant.objects.bulk_create([
+            Participant(conversation=self.room, user=self.alice),
+            Participant(conversation=self.room, user=self.bob),
+        ])
+
+    async def open(self, path, user):
+        communicator = WebsocketCommunicator(
+            application, f'{path}?token={generate_access_token(user)}', headers=HEADERS
+        )
+        connected, _ = await communicator.connect(timeout=10)
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_malformed_attachment_ids_get_an_error_frame(self):
+        chat = await self.open(f'/ws/chat/{self.room.id}/', self.alice)
+        self.assertEqual((await chat.receive_json_from(timeout=5))['type'], 'user_status')
+        for attachment_ids in (5, '1,2', [1, 'x'], [True], {'id': 1}):
+            with self.subTest(attachment_ids=attachment_ids):
+                await chat.send_json_to({'type': 'message', 'content': 'hi', 'attachment_ids': attachment_ids})
+                reply = await chat.receive_json_from(timeout=5)
+                self.assertEqual(reply['type'], 'error')
+                self.assertEqual(reply['field'], 'attachment_ids')
+        self.assertFalse(await Message.objects.aexists())
+
+        # The socket is still usable
+        await chat.send_json_to({'type': 'message', 'content': 'hi', 'attachment_ids': []})
+        while (await chat.receive_json_from(timeout=5))['type'] != 'message':
+            pass
+        await chat.disconnect()
+
+    async def test_inbox_only_socket_gets_deltas(self):
+        inbox = await self.open('/ws/inbox/', self.bob)
+        chat = await self.open(f'/ws/chat/{self.room.id}/', self.alice)
+        self.assertEqual((await chat.receive_json_from(timeout=5))['type'], 'user_status')
+
+        await chat.send_json_to({'type': 'message', 'content': 'hello bob'})
+        delta = await inbox.receive_json_from(timeout=5)
+        self.assertEqual(delta['type'], 'inbox')
+        self.assertEqual(delta['conversation_id'], self.room.id)
+        self.assertEqual(delta['unread_count'], 1)
+        self.assertEqual(delta['last_message']['content'], 'hello bob')
+        self.assertFalse(delta['last_message']['has_attachments'])
+
+        # A send over REST reaches it too
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(self.alice)}')
+        response = await sync_to_async(client.post)(
+            '/api/chat/messages/', {'conversation': self.room.id, 'content': 'again'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        delta = await inbox.receive_json_from(timeout=5)
+        self.assertEqual(delta['unread_count'], 2)
+        self.assertEqual(delta['last_message']['content'], 'again')
+
+        await chat.disconnect()
+        await inbox.disconnect()
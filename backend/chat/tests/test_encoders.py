@@ -0,0 +1,131 @@
+"""
+chat.encoders must produce exactly what the DRF serializers produce.
+"""
+import shutil
+import tempfile
+from datetime import timedelta
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from chat.archive import run_retention
+from chat.encoders import encode_messages, message_row
+from chat.models import Attachment, AttachmentBlob, Conversation, Message, Participant
+from chat.serializers import MessageSerializer
+from . import without_redis
+
+# Stored avatar names and thumbnails, including ones that need quoting
+AVATARS = [
+    ('', {}),
+    ('avatars/plain.png', {}),
+    ('avatars/with space ü.png', {}),
+    ('avatars/thumbed.png', {'source': 'avatars/thumbed.png', 'sm': 'avatars/thumbs/thumbed_sm.webp'}),
+    ('avatars/replaced.png', {'source': 'avatars/old.png', 'sm': 'avatars/thumbs/old_sm.webp'}),
+]
+
+CONVERSATIONS = 4
+# More than CHAT_LIST_PARTICIPANTS, so the list items are capped
+PARTICIPANTS = 12
+MESSAGES = 120
+
+
+@without_redis
+@override_settings(
+    CHAT_RATE_LIMITS={name: (1e9, 1e9) for name in settings.CHAT_RATE_LIMITS},
+    CHAT_INBOX_CACHE='',
+    CHAT_RETENTION_DAYS=180,
+    # The REST threads cannot see this TestCase's uncommitted rows
+    CHAT_ASYNC_VIEWS=False,
+    REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'PAGE_SIZE': 25},
+)
+class EncoderOutputTests(TestCase):
+    """The encoders on and off, over the API and for broadcasts"""
+
+    def setUp(self):
+        archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_root, ignore_errors=True)
+        archive_settings = self.settings(CHAT_ARCHIVE_ROOT=archive_root)
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+
+        self.users = User.objects.bulk_create([
+            User(username=f'user_{i}', email=f'user_{i}@example.com',
+                 first_name='User' if i % 3 else '', last_name=str(i) if i % 2 else '',
+                 avatar=AVATARS[i % len(AVATARS)][0], avatar_variants=AVATARS[i % len(AVATARS)][1])
+            for i in range(PARTICIPANTS)
+        ])
+        owner = self.users[0]
+        convs = Conversation.objects.bulk_create([
+            Conversation(name=f'Room {i}' if i % 2 else None, is_group=True, created_by=owner)
+            for i in range(CONVERSATIONS)
+        ])
+        # The last room is missing some members, so counts differ
+        Participant.objects.bulk_create([
+            Participant(conversation=conv, user=user)
+            for conv in convs for user in self.users[:PARTICIPANTS - 3 * (conv == convs[-1])]
+        ])
+        blobs = AttachmentBlob.objects.bulk_create([
+            AttachmentBlob(sha256=f'{i:064x}', path=f'00/00/{i:064x}', size=1024 * (i + 1))
+            for i in range(3)
+        ])
+        attachments = [
+            Attachment.objects.create(blob=blob, uploaded_by=owner, filename=f'file {i}.txt', content_type='text/plain')
+            for i, blob in enumerate(blobs)
+        ]
+
+        now = timezone.now()
+        self.room = convs[0]
+        created = Message.objects.bulk_create([
+            Message(conversation=self.room, sender=self.users[i % PARTICIPANTS], content=f'message {i} ' * 4,
+                    client_nonce=f'nonce-{i}' if i % 3 == 0 else None, is_read=i % 2 == 0)
+            for i in range(MESSAGES)
+        ] + [
+            Message(conversation=conv, sender=self.users[1], content='latest ' * 30)
+            for conv in convs[1:]
+        ])
+        # created_at is auto_now_add; spread the history over a year
+        for i, message in enumerate(created[:MESSAGES]):
+            message.created_at = message.updated_at = now - timedelta(days=365) * (MESSAGES - i) / MESSAGES
+        Message.objects.bulk_update(created[:MESSAGES], ['created_at', 'updated_at'])
+        Message.attachments.through.objects.bulk_create([
+            Message.attachments.through(message_id=message.id, attachment_id=attachment.id)
+            for message in created[:MESSAGES:5] for attachment in attachments[:1 + message.id % 3]
+        ])
+        # Older messages move to the archive, which history pages read too
+        self.assertTrue(sum(moved for _, moved in run_retention()))
+
+    def pages(self, client, url):
+        """Raw bodies of every page from `url` on"""
+        bodies = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            bodies.append(response.content)
+            url = response.json()['next']
+        return bodies
+
+    def test_api_pages_match_byte_for_byte(self):
+        history = [
+            f'/api/chat/messages/?conversation={self.room.id}',
+            f'/api/chat/messages/?conversation={self.room.id}&compact=1',
+        ]
+        for user in self.users:
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(user)}')
+            for url in ['/api/chat/conversations/'] + (history if user == self.users[0] else []):
+                with self.subTest(user=user.username, url=url):
+                    with self.settings(CHAT_FAST_ENCODERS=False):
+                        expected = self.pages(client, url)
+                    with self.settings(CHAT_FAST_ENCODERS=True):
+                        actual = self.pages(client, url)
+                    self.assertEqual(actual, expected)
+
+    def test_broadcasts_match(self):
+        messages = list(Message.objects.select_related('sender'))
+        for zone in ('UTC', 'America/St_Johns'):
+            with timezone.override(zone):
+                for message in messages:
+                    with self.subTest(zone=zone, message=message.id):
+                        self.assertEqual(encode_messages([message_row(message)])[0], MessageSerializer(message).data)
@@ -0,0 +1,121 @@
+"""
+The conversation list cache must never serve a page older than the last
+write that changed it (see chat.response_cache and chat.versioning).
+"""
+import random
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from chat import membership, response_cache
+from chat.models import Conversation, Message, Participant
+from chat.versioning import bump_presence
+from . import without_redis
+
+LIST_URLS = [
+    '/api/chat/conversations/',
+    '/api/chat/conversations/?fields=id,name,unread_count,last_message_preview',
+]
+
+
+def client_for(user):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(user)}')
+    return client
+
+
+@without_redis
+@override_settings(CHAT_RATE_LIMITS={name: (1e9, 1e9) for name in settings.CHAT_RATE_LIMITS})
+class InboxCacheWriteReplayTests(TransactionTestCase):
+    """Random writes, each followed by comparing the cached list with a fresh one"""
+
+    conversations = 5
+    participants = 4
+    writes = 60
+
+    def setUp(self):
+        cache.clear()
+        response_cache._cache = None
+        self.users = User.objects.bulk_create([
+            User(username=f'user_{i}', email=f'user_{i}@example.com', first_name='User', last_name=str(i))
+            for i in range(self.participants * 2)
+        ])
+        self.owner = self.users[0]
+        self.convs = Conversation.objects.bulk_create([
+            Conversation(name=f'Room {i}', is_group=True, created_by=self.owner)
+            for i in range(self.conversations)
+        ])
+        Participant.objects.bulk_create([
+            Participant(conversation=conv, user=user)
+            for conv in self.convs for user in self.users[:self.participants]
+        ])
+        Message.objects.bulk_create([
+            Message(conversation=conv, sender=self.users[1], content=f'hello from {conv.name}')
+            for conv in self.convs
+        ])
+
+    def tearDown(self):
+        response_cache._cache = None
+
+    def random_write(self, rng):
+        """Change something the owner's inbox shows; return a description"""
+        conv = rng.choice(self.convs)
+        members = set(Participant.objects.filter(conversation=conv).values_list('user_id', flat=True))
+        others = [u for u in self.users if u.id in members and u.id != self.owner.id]
+        kind = rng.choice(['message', 'message', 'own_message', 'read', 'edit', 'delete',
+                           'add', 'remove', 'rename', 'presence'])
+        if not others:
+            # Everyone else has been removed
+            kind = 'add'
+        else:
+            other = rng.choice(others)
+        if kind == 'message':
+            client_for(other).post('/api/chat/messages/', {'conversation': conv.id, 'content': f'm{rng.random()}'}, format='json')
+        elif kind == 'own_message':
+            client_for(self.owner).post('/api/chat/messages/', {'conversation': conv.id, 'content': 'mine'}, format='json')
+        elif kind == 'read':
+            client_for(self.owner).post(f'/api/chat/conversations/{conv.id}/mark_read/')
+        elif kind == 'edit':
+            message = Message.objects.filter(conversation=conv).first()
+            if message:
+                message.content = f'edited {rng.random()}'
+                message.save()
+        elif kind == 'delete':
+            message = Message.objects.filter(conversation=conv).first()
+            if message:
+                message.delete()
+        elif kind == 'add':
+            outsiders = [u.id for u in self.users if u.id not in members]
+            if outsiders:
+                membership.add_members(conv, rng.sample(outsiders, 1), actor=self.owner)
+        elif kind == 'remove':
+            membership.remove_members(conv, [other.id], actor=self.owner)
+        elif kind == 'rename':
+            other.first_name = f'Renamed{rng.randint(0, 999)}'
+            other.save()
+        elif kind == 'presence':
+            User.objects.filter(id=other.id).update(is_online=rng.random() < 0.5)
+            bump_presence(other.id)
+        return f'{kind} in conversation {conv.id}'
+
+    def replay(self, backend):
+        rng = random.Random(1)
+        client = client_for(self.owner)
+        for write in range(self.writes):
+            description = self.random_write(rng)
+            for url in LIST_URLS:
+                with self.settings(CHAT_INBOX_CACHE=backend):
+                    # Twice: the first request may fill the cache, the second reads it
+                    client.get(url)
+                    cached = client.get(url).json()
+                with self.settings(CHAT_INBOX_CACHE=''):
+                    fresh = client.get(url).json()
+                self.assertEqual(cached, fresh, f'stale page after write {write} ({description}) at {url}')
+
+    def test_memory_cache_is_never_stale(self):
+        self.replay('memory')
+
+    def test_shared_cache_is_never_stale(self):
+        self.replay('shared')
@@ -0,0 +1,59 @@
+"""
+MessageSendThrottle on REST sends (see chat.throttling).
+"""
+from unittest import mock
+from django.conf import settings
+from django.test import TransactionTestCase
+from rest_framework.test import APIClient
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from chat import throttling
+from chat.models import Conversation, Message, Participant
+from . import without_redis
+
+
+def client_for(user):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(user)}')
+    return client
+
+
+@without_redis
+class MessageSendThrottleTests(TransactionTestCase):
+
+    def setUp(self):
+        self.alice, self.carol = User.objects.bulk_create([
+            User(username=name, email=f'{name}@example.com') for name in ('alice', 'carol')
+        ])
+        self.room = Conversation.objects.create(name='Room', is_group=True, created_by=self.alice)
+        Participant.objects.create(conversation=self.room, user=self.alice)
+
+        # Generous everywhere but the room's bucket, which holds two sends
+        limits = {name: (1e9, 1e9) for name in settings.CHAT_RATE_LIMITS}
+        limits['conversation_messages'] = (0.001, 2)
+        limiter = throttling.RateLimiter(limits, throttling.MemoryBucketStore())
+        patcher = mock.patch.object(throttling, '_limiter', limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send(self, user, data):
+        return client_for(user).post('/api/chat/messages/', data, format='json')
+
+    def test_non_object_bodies_are_rejected_not_crashed(self):
+        for body in ([], [{'conversation': self.room.id}], 'text', 5):
+            with self.subTest(body=body):
+                self.assertEqual(self.send(self.alice, body).status_code, 400)
+
+    def test_outsiders_do_not_drain_a_room_bucket(self):
+        for _ in range(5):
+            response = self.send(self.carol, {'conversation': self.room.id, 'content': 'spam'})
+            self.assertEqual(response.status_code, 400)
+        for key in (self.room.id, str(self.room.id), 'x', None):
+            self.send(self.carol, {'conversation': key, 'content': 'spam'})
+
+        for _ in range(2):
+            response = self.send(self.alice, {'conversation': self.room.id, 'content': 'hi'})
+            self.assertEqual(response.status_code, 201)
+        response = self.send(self.alice, {'conversation': self.room.id, 'content': 'hi'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(Message.objects.count(), 2)
@@ -0,0 +1,49 @@
+"""
+Which versions a presence change moves (see chat.versioning).
+"""
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from accounts.models import User
+from chat.models import Conversation, Participant
+from chat.versioning import bump_presence, get_conversation_version, get_inbox_version, get_members_version
+from . import without_redis
+
+
+@without_redis
+@override_settings(CHAT_LIST_PARTICIPANTS=1)
+class PresenceVersionTests(TestCase):
+    """List items show the first two members of a room here"""
+
+    def setUp(self):
+        cache.clear()
+        self.users = User.objects.bulk_create([
+            User(username=f'user_{i}', email=f'user_{i}@example.com') for i in range(4)
+        ])
+        self.room = Conversation.objects.create(name='Room', is_group=True, created_by=self.users[0])
+        for user in self.users:
+            Participant.objects.create(conversation=self.room, user=user)
+
+    def versions(self):
+        return (
+            get_inbox_version(self.users[0].id),
+            get_conversation_version(self.room.id),
+            get_members_version(self.room.id),
+        )
+
+    def bump(self, user):
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_presence(user.id)
+
+    def test_unlisted_member_moves_only_the_member_listings(self):
+        inbox, messages, members = self.versions()
+        self.bump(self.users[3])
+        self.assertEqual(self.versions()[:2], (inbox, messages))
+        self.assertNotEqual(self.versions()[2], members)
+
+    def test_listed_member_moves_the_inbox_too(self):
+        inbox, messages, members = self.versions()
+        self.bump(self.users[1])
+        new_inbox, new_messages, new_members = self.versions()
+        self.assertNotEqual(new_inbox, inbox)
+        self.assertEqual(new_messages, messages)
+        self.assertNotEqual(new_members, members)
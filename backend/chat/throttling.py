@@ -0,0 +1,198 @@
+"""
+Token-bucket rate limiting shared by the REST API and ChatConsumer.
+
+Buckets live in process memory by default. Set CHAT_RATE_LIMIT_REDIS_URL
+to keep them in Redis instead, so every worker draws from the same bucket;
+the refill-and-take step runs as one Lua script and is therefore atomic.
+A request checked against several buckets takes a token from all of them
+or from none, so a rejection costs nothing.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from rest_framework.throttling import BaseThrottle
+from .models import Participant
+
+logger = logging.getLogger(__name__)
+
+# KEYS are the buckets; ARGV holds rate, burst and cost for each in turn.
+# Returns {index of the first bucket short of tokens (0 if none), retry}.
+REDIS_TOKEN_BUCKETS = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tokens = {}
+local short, retry = 0, 0
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[3 * i - 2])
+    local burst = tonumber(ARGV[3 * i - 1])
+    local cost = tonumber(ARGV[3 * i])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local ts = tonumber(state[2]) or now
+    tokens[i] = math.min(burst, (tonumber(state[1]) or burst) + math.max(0, now - ts) * rate)
+    if short == 0 and tokens[i] < cost then
+        short = i
+        retry = (cost - tokens[i]) / rate
+    end
+end
+for i = 1, #KEYS do
+    if short == 0 then
+        tokens[i] = tokens[i] - tonumber(ARGV[3 * i])
+    end
+    redis.call('HSET', KEYS[i], 'tokens', tokens[i], 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], math.ceil(tonumber(ARGV[3 * i - 1]) / tonumber(ARGV[3 * i - 2]) * 1000) + 1000)
+end
+return {short, tostring(retry)}
+"""
+
+
+class MemoryBucketStore:
+    """Buckets for this process only, capped at `max_keys` (LRU)"""
+    shared = False
+    
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def take_all(self, buckets, cost=1):
+        """
+        Take `cost` tokens from every (key, rate, burst) bucket, or from
+        none. Returns (None, 0) if allowed, else the index of the first
+        bucket short of tokens and the seconds until it has them.
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            short, retry_after = None, 0.0
+            for i, (key, rate, burst) in enumerate(buckets):
+                tokens, updated = self._buckets.pop(key, (burst, now))
+                tokens = min(burst, tokens + (now - updated) * rate)
+                levels.append(tokens)
+                if short is None and tokens < cost:
+                    short, retry_after = i, (cost - tokens) / rate
+            
+            for (key, _, _), tokens in zip(buckets, levels):
+                self._buckets[key] = (tokens - cost if short is None else tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return short, retry_after
+
+
+class RedisBucketStore:
+    """Buckets shared by every worker, falling back to memory on errors"""
+    shared = True
+    
+    def __init__(self, url, prefix='ratelimit:'):
+        import redis
+        
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, socket_timeout=0.25)
+        self.script = self.client.register_script(REDIS_TOKEN_BUCKETS)
+        self.fallback = MemoryBucketStore()
+    
+    def take_all(self, buckets, cost=1):
+        args = []
+        for _, rate, burst in buckets:
+            args += [rate, burst, cost]
+        try:
+            short, retry_after = self.script(keys=[self.prefix + key for key, _, _ in buckets], args=args)
+        except Exception:
+            logger.warning('Rate limit backend unavailable, using local buckets', exc_info=True)
+            return self.fallback.take_all(buckets, cost)
+        return (int(short) - 1, float(retry_after)) if int(short) else (None, 0.0)
+
+
+class RateLimiter:
+    """Named limits from CHAT_RATE_LIMITS, e.g. {'user_messages': (5, 20)}"""
+    
+    def __init__(self, limits, store):
+        self.limits = limits
+        self.store = store
+    
+    def check(self, *checks):
+        """
+        Take a token from every (limit_name, key) bucket, or from none.
+
+        Returns (None, 0) when every bucket allows the request, otherwise
+        the name of the first limit hit and the seconds until it refills.
+        """
+        if not checks:
+            return None, 0
+        short, retry_after = self.store.take_all([
+            (f'{name}:{key}', *self.limits[name]) for name, key in checks
+        ])
+        if short is not None:
+            return checks[short][0], retry_after
+        return None, 0
+
+
+_limiter = None
+
+
+def get_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        url = getattr(settings, 'CHAT_RATE_LIMIT_REDIS_URL', '')
+        store = RedisBucketStore(url) if url else MemoryBucketStore()
+        _limiter = RateLimiter(settings.CHAT_RATE_LIMITS, store)
+    return _limiter
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """DRF throttle backed by the shared RateLimiter"""
+    
+    def get_checks(self, request, view):
+        raise NotImplementedError('.get_checks() must be overridden')
+    
+    def allow_request(self, request, view):
+        checks = self.get_checks(request, view)
+        if not checks:
+            return True
+        self.scope, self.retry_after = get_rate_limiter().check(*checks)
+        return self.scope is None
+    
+    def wait(self):
+        return self.retry_after
+
+
+class UserApiThrottle(TokenBucketThrottle):
+    """Overall API budget per user (or per client address)"""
+    
+    def get_checks(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return [('user_api', request.user.id)]
+        return [('anon_api', self.get_ident(request))]
+
+
+class MessageSendThrottle(TokenBucketThrottle):
+    """
+    Message creation budget per sender and per conversation. Only members
+    draw from a conversation's bucket, so outsiders cannot drain it.
+    """
+    
+    def get_checks(self, request, view):
+        if request.method != 'POST' or not request.user.is_authenticated:
+            return []
+        checks = [('user_messages', request.user.id)]
+        data = request.data
+        conversation_id = data.get('conversation') if isinstance(data, Mapping) else None
+        if conversation_id:
+            conversation_id = member_conversation_id(request.user.id, conversation_id)
+        if conversation_id:
+            checks.append(('conversation_messages', conversation_id))
+        return checks
+
+
+def member_conversation_id(user_id, conversation_id):
+    """`conversation_id` as stored if `user_id` is a member of it, else None"""
+    try:
+        return Participant.objects.filter(
+            conversation_id=conversation_id,
+            user_id=user_id
+        ).values_list('conversation_id', flat=True).first()
+    except (TypeError, ValueError, ValidationError):
+        return None
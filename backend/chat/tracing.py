@@ -0,0 +1,91 @@
+"""
+Per-stage latency of chat messages, from the sender's frame to delivery.
+
+Every message records how long it spent in each stage:
+- persist: frame received until the row is saved and serialized, with
+  the `insert` (commit included) and `serialize` parts also recorded alone
+- publish: saved until the channel layer accepted the group_send
+- deliver: handed to the layer until the recipient's send() returned,
+  including queueing in the recipient's outbound buffer
+- total: frame received until the recipient's send() returned
+
+Stages inside one process use the monotonic clock. Delivery usually
+happens in another worker, so the event carries wall-clock stamps for
+the cross-process stages. Those stages are only as accurate as the
+workers' clock sync.
+
+A CHAT_TRACE_SAMPLE_RATE fraction of messages also gets a trace id. The
+id travels in the group event, and each stage is logged as one JSON line
+on the `chat.trace` logger.
+"""
+import json
+import logging
+import random
+import time
+import uuid
+from django.conf import settings
+from . import metrics
+
+logger = logging.getLogger('chat.trace')
+
+stage_seconds = metrics.Histogram(
+    'chat_message_stage_seconds', 'Message latency per pipeline stage', ['stage']
+)
+
+
+def log_stage(trace_id, stage, **fields):
+    logger.info(json.dumps({'trace_id': trace_id, 'stage': stage, **fields}, default=str))
+
+
+class MessageTrace:
+    """Timestamps for one inbound message on the sending side"""
+    
+    def __init__(self):
+        self.received = time.perf_counter()
+        self.received_at = time.time()
+        self.persisted = None
+        self.trace_id = None
+        if random.random() < settings.CHAT_TRACE_SAMPLE_RATE:
+            self.trace_id = uuid.uuid4().hex[:16]
+    
+    def mark_persisted(self):
+        self.persisted = time.perf_counter()
+        stage_seconds.observe(self.persisted - self.received, 'persist')
+    
+    def event_data(self):
+        """Trace context to send along with the group event"""
+        return {
+            'id': self.trace_id,
+            'received_at': self.received_at,
+            'published_at': time.time(),
+        }
+    
+    def mark_published(self, message_id, conversation_id):
+        published = time.perf_counter()
+        stage_seconds.observe(published - self.persisted, 'publish')
+        if self.trace_id:
+            log_stage(
+                self.trace_id, 'publish',
+                message_id=message_id,
+                conversation_id=conversation_id,
+                persist_ms=round((self.persisted - self.received) * 1000, 3),
+                publish_ms=round((published - self.persisted) * 1000, 3),
+            )
+
+
+def mark_delivered(trace, channel_name):
+    """Record delivery of a traced event to one recipient connection"""
+    if not trace:
+        return
+    now = time.time()
+    deliver = max(0.0, now - trace['published_at'])
+    total = max(0.0, now - trace['received_at'])
+    stage_seconds.observe(deliver, 'deliver')
+    stage_seconds.observe(total, 'total')
+    if trace.get('id'):
+        log_stage(
+            trace['id'], 'deliver',
+            channel=channel_name,
+            deliver_ms=round(deliver * 1000, 3),
+            total_ms=round(total * 1000, 3),
+        )
@@ -1,12 +1,15 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ConversationViewSet, MessageViewSet
+from .async_views import with_fast_paths
+from .views import AttachmentViewSet, ConversationViewSet, MessageViewSet, UploadViewSet
 
 router = DefaultRouter()
 router.register(r'conversations', ConversationViewSet, basename='conversation')
 router.register(r'messages', MessageViewSet, basename='message')
+router.register(r'uploads', UploadViewSet, basename='upload')
+router.register(r'attachments', AttachmentViewSet, basename='attachment')
 
 urlpatterns = [
-    path('', include(router.urls)),
+    path('', include(with_fast_paths(router.urls))),
 ]
 
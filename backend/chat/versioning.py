@@ -0,0 +1,223 @@
+"""
+Change counters for conversations and per-user inboxes.
+
+Every write that can change what a user sees stores a fresh version for
+the affected conversation. An inbox version is made from the user's own
+version (bumped when they join or leave a conversation) and the versions
+of their conversations, so a message bumps one key however large the
+room.
+
+Presence is versioned apart from content, since every connect and
+disconnect changes it. A member going online or offline bumps the
+presence key of each of their conversations, which only the member
+listings (conversation detail and participants) read, and the listed
+presence key of those where conversation list items show them (the first
+CHAT_LIST_PARTICIPANTS + 1 members), which inboxes read. Message pages
+and most co-members' inboxes keep their versions.
+
+Readers turn the current version into an ETag before touching the
+database, so an unchanged resource costs a couple of cache lookups and no
+queries.
+
+Ordering matters: writers bump only after their transaction commits and
+readers fetch the version before querying. A reader racing a writer can
+then only pair new data with an old version (a wasted 200), never old data
+with a new version (a stale 304).
+"""
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+
+# Versions are only compared for equality; losing one just forces a 200
+VERSION_TIMEOUT = 7 * 24 * 3600
+
+# Bumps collected by an active coalesce_bumps() block on this thread
+_local = threading.local()
+
+
+def conversation_key(conversation_id):
+    return f'version:conversation:{conversation_id}'
+
+
+def inbox_key(user_id):
+    return f'version:inbox:{user_id}'
+
+
+def presence_key(conversation_id):
+    return f'version:presence:{conversation_id}'
+
+
+def listed_presence_key(conversation_id):
+    return f'version:presence:{conversation_id}:listed'
+
+
+def new_version():
+    return time.time_ns()
+
+
+def get_version(key):
+    """Current version for `key`, starting a new one if none is stored"""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(keys):
+    """Current versions for `keys`, in order, starting any that are missing"""
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, new_version(), VERSION_TIMEOUT)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+def get_conversation_version(conversation_id):
+    return get_version(conversation_key(conversation_id))
+
+
+def combine(versions, *parts):
+    """
+    One version standing for all of `versions` (and identifying `parts`).
+    
+    The result keeps the newest version's millisecond, so Last-Modified
+    stays meaningful, and a digest of every version below it, so a bump
+    that does not raise the newest one still changes it.
+    """
+    digest = hashlib.sha1(':'.join(map(str, [*parts, *versions])).encode()).digest()
+    newest = max(versions)
+    return newest - newest % 1_000_000 + int.from_bytes(digest[:8], 'big') % 1_000_000
+
+
+def get_members_version(conversation_id):
+    """A conversation's version including its members' presence"""
+    return combine(get_versions([conversation_key(conversation_id), presence_key(conversation_id)]))
+
+
+def inbox_conversation_ids(user_id, version):
+    """Ids of the user's conversations, cached under their own `version`"""
+    key = f'{inbox_key(user_id)}:conversations:{version}'
+    conversation_ids = cache.get(key)
+    if conversation_ids is None:
+        from .models import Participant
+        
+        conversation_ids = sorted(Participant.objects.filter(
+            user_id=user_id
+        ).values_list('conversation_id', flat=True))
+        cache.set(key, conversation_ids, VERSION_TIMEOUT)
+    return conversation_ids
+
+
+def get_inbox_version(user_id):
+    """
+    The user's own version combined with each of their conversations'
+    content and listed presence versions
+    """
+    own = get_version(inbox_key(user_id))
+    conversation_ids = inbox_conversation_ids(user_id, own)
+    keys = [conversation_key(c) for c in conversation_ids]
+    keys += [listed_presence_key(c) for c in conversation_ids]
+    return combine([own] + get_versions(keys), *conversation_ids)
+
+
+def make_etag(*parts):
+    digest = hashlib.sha1(':'.join(str(p) for p in parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def _store(conversation_ids, user_ids, presence_ids=(), listed_ids=()):
+    version = new_version()
+    keys = [conversation_key(c) for c in conversation_ids]
+    keys += [inbox_key(u) for u in user_ids]
+    keys += [presence_key(c) for c in presence_ids]
+    keys += [listed_presence_key(c) for c in listed_ids]
+    if keys:
+        cache.set_many({key: version for key in keys}, VERSION_TIMEOUT)
+
+
+@contextmanager
+def coalesce_bumps():
+    """
+    Merge the bumps made inside the block into one store after commit.
+    
+    Bulk operations that fire per-row signals (e.g. deleting a thousand
+    participants) would otherwise write the cache once per row.
+    """
+    if getattr(_local, 'batch', None) is not None:
+        yield
+        return
+    
+    batch = _local.batch = {'conversations': set(), 'users': set()}
+    try:
+        yield
+    finally:
+        _local.batch = None
+    
+    conversation_ids, user_ids = batch['conversations'], batch['users']
+    if conversation_ids or user_ids:
+        transaction.on_commit(lambda: _store(conversation_ids, user_ids))
+
+
+def bump_conversation(conversation_id, user_ids=()):
+    """
+    Mark a conversation as changed once the current transaction commits.
+    Pass `user_ids` for users who joined or left it, whose own inbox
+    versions must change too.
+    """
+    user_ids = list(user_ids)
+    batch = getattr(_local, 'batch', None)
+    if batch is not None:
+        batch['conversations'].add(conversation_id)
+        batch['users'].update(user_ids)
+        return
+    transaction.on_commit(lambda: _store([conversation_id], user_ids))
+
+
+def bump_user(user_id):
+    """
+    Mark everything that displays `user_id` (name, avatar) as changed:
+    each of their conversations, which co-members' inboxes include, and
+    their own inbox. Presence changes go through bump_presence().
+    """
+    def bump():
+        from .models import Participant
+        
+        conversation_ids = Participant.objects.filter(
+            user_id=user_id
+        ).values_list('conversation_id', flat=True)
+        _store(list(conversation_ids), [user_id])
+    
+    transaction.on_commit(bump)
+
+
+def bump_presence(user_id):
+    """
+    Mark the member listings that show whether `user_id` is online as
+    changed, leaving conversation content alone
+    """
+    def bump():
+        from .models import Participant
+        
+        # Members joined before this one (list items show members in id order)
+        ahead = Participant.objects.filter(
+            conversation_id=OuterRef('conversation_id'),
+            id__lt=OuterRef('id')
+        ).order_by().values('conversation_id').annotate(count=Count('id')).values('count')
+        rows = list(Participant.objects.filter(user_id=user_id).annotate(
+            ahead=Subquery(ahead)
+        ).values_list('conversation_id', 'ahead'))
+        _store(
+            [], [],
+            presence_ids=[c for c, _ in rows],
+            listed_ids=[c for c, count in rows if (count or 0) <= settings.CHAT_LIST_PARTICIPANTS]
+        )
+    
+    transaction.on_commit(bump)
@@ -1,14 +1,120 @@
-from rest_framework import viewsets, status, permissions
+import functools
+import os
+from rest_framework import mixins, viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.conf import settings
 from django.db.models import Q, Count, Max, Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils import timezone
-from .models import Conversation, Message, Participant
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+from django.utils.cache import parse_etags
+from accounts.serializers import requested_fields, wants_field
+from accounts.thumbnails import avatar_url
+from . import attachments as attachment_storage
+from . import membership
+from .archive import MessageHistory
+from .encoders import (
+    CONVERSATION_COLUMNS,
+    MESSAGE_COLUMNS,
+    encode_conversations,
+    encode_messages,
+    encode_senders,
+    message_rows,
+    use_encoders
+)
+from .export import FORMATS, export_chunks, export_filename
+from .idempotency import create_once
+from .inbox import push_read_on_commit
+from .models import Attachment, Conversation, Message, Participant, UploadSession
+from .pagination import ParticipantPagination
+from .response_cache import cached_response
 from .serializers import (
+    AttachmentSerializer,
     ConversationSerializer,
     ConversationListSerializer,
-    MessageSerializer
+    MembershipSerializer,
+    MessageSerializer,
+    ParticipantSerializer,
+    UploadSessionSerializer
 )
+from .streaming import iterate_in_thread
+from .throttling import MessageSendThrottle, UserApiThrottle
+from .versioning import get_conversation_version, get_inbox_version, get_members_version, make_etag
+
+# Per-message sender details replaced by the `senders` table in compact mode
+COMPACT_SENDER_FIELDS = ('sender_username', 'sender_name', 'sender_avatar')
+
+
+def validators(request, version):
+    """
+    (etag, last_modified, not_modified) of a resource at `version`:
+    `not_modified` when the client's conditional headers show it has it
+    """
+    etag = make_etag(
+        request.user.id,
+        version,
+        request.get_full_path(),
+        request.META.get('HTTP_ACCEPT', '')
+    )
+    last_modified = version // 1_000_000_000
+    
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        not_modified = etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+    else:
+        # Second granularity: only dates strictly after the last
+        # change prove the client has it
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        not_modified = since is not None and last_modified < since
+    return etag, last_modified, not_modified
+
+
+def add_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def versioned(get_version):
+    """
+    Answer conditional GETs from a change counter.
+
+    `get_version(view, request, *args, **kwargs)` must be cheap: when the
+    client's ETag (or Last-Modified date) is still current, the wrapped
+    method never runs, so no query or serialization happens at all.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            version = self.resource_version = get_version(self, request, *args, **kwargs)
+            etag, last_modified, not_modified = validators(request, version)
+            
+            if not_modified:
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = method(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+            return add_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
+
+
+def inbox_version(view, request, *args, **kwargs):
+    return get_inbox_version(request.user.id)
+
+
+def conversation_version(view, request, *args, **kwargs):
+    return get_members_version(kwargs['pk'])
+
+
+def message_list_version(view, request, *args, **kwargs):
+    conversation_id = request.query_params.get('conversation')
+    if conversation_id:
+        return get_conversation_version(conversation_id)
+    return get_inbox_version(request.user.id)
 
 
 class ConversationViewSet(viewsets.ModelViewSet):
@@ -22,12 +128,50 @@ class ConversationViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         user = self.request.user
-        return Conversation.objects.filter(
-            participants__user=user
-        ).prefetch_related(
-            'participants__user',
-            'messages'
-        ).distinct()
+        queryset = Conversation.objects.filter(participants__user=user).distinct()
+        if self.action == 'list' and use_encoders(self.request):
+            # encode_conversations() loads the rest per page
+            return queryset.annotate(member_count=membership.member_count()).values(*CONVERSATION_COLUMNS)
+        
+        # Only load relations that the (possibly sparse) response shows.
+        # Detail views page their participants themselves, so only the list
+        # loads members, and only the user's own row and the listed ones.
+        fields, expand = requested_fields(self.request)
+        if self.action in ('list', 'stats'):
+            if wants_field(fields, 'participants_count'):
+                queryset = queryset.annotate(member_count=membership.member_count())
+            if wants_field(fields, 'unread_count'):
+                queryset = queryset.prefetch_related(Prefetch(
+                    'participants',
+                    queryset=Participant.objects.filter(user=user),
+                    to_attr='own_participants'
+                ))
+            if wants_field(fields, 'other_participants'):
+                queryset = queryset.prefetch_related(Prefetch(
+                    'participants',
+                    queryset=membership.listed_members(user.id)[:settings.CHAT_LIST_PARTICIPANTS],
+                    to_attr='listed_members'
+                ))
+        if 'created_by' in expand or wants_field(fields, 'created_by_username'):
+            queryset = queryset.select_related('created_by')
+        return queryset
+    
+    @versioned(inbox_version)
+    def list(self, request, *args, **kwargs):
+        def build():
+            queryset = self.filter_queryset(self.get_queryset())
+            return self.page_response(self.paginate_queryset(queryset))
+        return cached_response(request, self.resource_version, build)
+    
+    def page_response(self, page):
+        if use_encoders(self.request):
+            return self.get_paginated_response(encode_conversations(page, self.request.user))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
+    @versioned(conversation_version)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     def create(self, request, *args, **kwargs):
         """Create a new conversation or return existing one"""
@@ -78,6 +222,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
         serializer.save(created_by=self.request.user)
     
     @action(detail=False, methods=['get'])
+    @versioned(inbox_version)
     def stats(self, request):
         """Get conversation statistics for dashboard"""
         user = request.user
@@ -112,6 +257,81 @@ class ConversationViewSet(viewsets.ModelViewSet):
             ).data
         })
     
+    @action(detail=True, methods=['get'])
+    @versioned(conversation_version)
+    def participants(self, request, pk=None):
+        """
+        Members of a conversation with presence, keyset paginated in join
+        order. `?online=1` lists only members who are online.
+        """
+        conversation = self.get_object()
+        queryset = conversation.participants.select_related('user')
+        if request.query_params.get('online') in ('1', 'true'):
+            queryset = queryset.filter(user__is_online=True)
+        
+        paginator = ParticipantPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = ParticipantSerializer(
+            page,
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
+    
+    @action(detail=True, methods=['post'], url_path='members/add')
+    def add_members(self, request, pk=None):
+        """Add up to CHAT_BULK_MEMBERS_LIMIT users to a group; only its creator may"""
+        conversation = self.get_object()
+        if not conversation.is_group:
+            return Response(
+                {'error': 'Members can only be changed in group conversations'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = MembershipSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        if conversation.created_by_id != request.user.id:
+            return Response(
+                {'error': 'Only the group creator can add members'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        added, ignored = membership.add_members(
+            conversation,
+            serializer.validated_data['user_ids'],
+            actor=request.user
+        )
+        return Response({
+            'added': added,
+            'ignored': ignored,
+            'participants_count': conversation.participants.count()
+        })
+    
+    @action(detail=True, methods=['post'], url_path='members/remove')
+    def remove_members(self, request, pk=None):
+        """Remove users from a group; only its creator may remove others"""
+        conversation = self.get_object()
+        if not conversation.is_group:
+            return Response(
+                {'error': 'Members can only be changed in group conversations'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = MembershipSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_ids = serializer.validated_data['user_ids']
+        
+        if set(user_ids) - {request.user.id} and conversation.created_by_id != request.user.id:
+            return Response(
+                {'error': 'Only the group creator can remove other members'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        removed = membership.remove_members(conversation, user_ids, actor=request.user)
+        return Response({
+            'removed': removed,
+            'participants_count': conversation.participants.count()
+        })
+    
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         """Mark all messages in conversation as read"""
@@ -120,18 +340,46 @@ class ConversationViewSet(viewsets.ModelViewSet):
             participant = conversation.participants.get(user=request.user)
             participant.last_read_at = timezone.now()
             participant.save()
+            push_read_on_commit(request.user.id, conversation.id)
             return Response({'status': 'messages marked as read'})
         except Participant.DoesNotExist:
             return Response(
                 {'error': 'Not a participant'},
                 status=status.HTTP_403_FORBIDDEN
             )
+    
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """
+        Stream the full history, archive included, oldest first.
+
+        `?output=ndjson` (default) or `csv`; `?gzip=1` compresses on the fly.
+        """
+        conversation = self.get_object()
+        output = request.query_params.get('output', 'ndjson')
+        if output not in FORMATS:
+            return Response(
+                {'error': f"output must be one of: {', '.join(FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        
+        response = StreamingHttpResponse(
+            iterate_in_thread(export_chunks(conversation.id, output, compress)),
+            content_type='application/gzip' if compress else f'{FORMATS[output]}; charset=utf-8'
+        )
+        response['Content-Disposition'] = content_disposition_header(
+            True, export_filename(conversation.id, output, compress)
+        )
+        response['Cache-Control'] = 'private, no-store'
+        return response
 
 
 class MessageViewSet(viewsets.ModelViewSet):
     """ViewSet for managing messages"""
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [UserApiThrottle, MessageSendThrottle]
     
     def get_queryset(self):
         user = self.request.user
@@ -139,13 +387,238 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         queryset = Message.objects.filter(
             conversation__participants__user=user
-        ).select_related('sender', 'conversation')
+        )
+        
+        fields, expand = requested_fields(self.request)
+        if 'sender' in expand or self.is_compact() or wants_field(
+            fields, 'sender_username', 'sender_name', 'sender_avatar'
+        ):
+            queryset = queryset.select_related('sender')
+        if wants_field(fields, 'attachments'):
+            queryset = queryset.prefetch_related('attachments__blob')
         
         if conversation_id:
             queryset = queryset.filter(conversation_id=conversation_id)
         
+        if self.action == 'list' and use_encoders(self.request):
+            return queryset.values(*MESSAGE_COLUMNS).distinct()
         return queryset.distinct()
     
+    def is_compact(self):
+        return self.action == 'list' and self.request.query_params.get('compact') in ('1', 'true')
+    
+    def with_archive(self, queryset):
+        """A single conversation's history goes on into its archive"""
+        conversation_id = self.request.query_params.get('conversation', '')
+        if conversation_id.isdigit():
+            return MessageHistory(queryset, int(conversation_id), self.request.user)
+        return queryset
+    
+    def paginate_queryset(self, queryset):
+        return super().paginate_queryset(self.with_archive(queryset))
+    
+    @versioned(message_list_version)
+    def list(self, request, *args, **kwargs):
+        """
+        Message history. With `?compact=1` sender details are sent once
+        per page in a `senders` table instead of on every message.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.page_response(self.paginate_queryset(queryset))
+    
+    def page_response(self, page):
+        request = self.request
+        if use_encoders(request):
+            # Pages hold rows, plus Message objects from the archive
+            rows = message_rows(page)
+            response = self.get_paginated_response(encode_messages(rows, request, self.is_compact()))
+            if self.is_compact():
+                response.data['senders'] = encode_senders(rows, request)
+            return response
+        
+        if not self.is_compact():
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        
+        serializer = self.get_serializer(page, many=True, omit=COMPACT_SENDER_FIELDS)
+        
+        senders = {}
+        for message in page:
+            if message.sender_id not in senders:
+                senders[message.sender_id] = {
+                    'username': message.sender.username,
+                    'name': message.sender.full_name,
+                    'avatar': avatar_url(message.sender, 'sm', request),
+                }
+        
+        response = self.get_paginated_response(serializer.data)
+        response.data['senders'] = senders
+        return response
+    
+    def create(self, request, *args, **kwargs):
+        """
+        Send a message. A retry carrying the `nonce` of an earlier send
+        gets that message back (200) instead of storing another one.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        message, created = create_once(
+            request.user.id,
+            serializer.validated_data['conversation'].id,
+            serializer.validated_data.get('client_nonce'),
+            lambda: serializer.save(sender=request.user)
+        )
+        if not created:
+            return Response(self.get_serializer(message).data, status=status.HTTP_200_OK)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+
+class UploadViewSet(mixins.CreateModelMixin,
+                    mixins.RetrieveModelMixin,
+                    viewsets.GenericViewSet):
+    """
+    Resumable chunked uploads.
+
+    POST creates a session from {filename, content_type, size}. Each PATCH
+    sends the raw bytes of one chunk with a `Content-Range: bytes a-b/size`
+    header. GET reports how many bytes have arrived, so an interrupted
+    client knows where to resume.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_parsers(self):
+        # Chunk bodies are read straight from the request stream
+        if self.request.method == 'POST':
+            return [parser() for parser in self.settings.DEFAULT_PARSER_CLASSES]
+        return []
+    
+    def get_queryset(self):
+        return UploadSession.objects.filter(
+            user=self.request.user
+        ).select_related('attachment__blob')
+    
     def perform_create(self, serializer):
-        serializer.save(sender=self.request.user)
+        serializer.save(user=self.request.user)
+    
+    def retrieve(self, request, *args, **kwargs):
+        session = self.get_object()
+        if not session.is_complete:
+            session.received = attachment_storage.received_bytes(session)
+        return Response(self.get_serializer(session).data)
+    
+    def partial_update(self, request, *args, **kwargs):
+        session = self.get_object()
+        if session.is_complete:
+            return Response(self.get_serializer(session).data)
+        
+        content_range = attachment_storage.parse_content_range(
+            request.META.get('HTTP_CONTENT_RANGE')
+        )
+        if content_range is None:
+            return Response(
+                {'error': 'Content-Range header is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        offset, length, total = content_range
+        if total != session.size or offset + length > session.size:
+            return Response(
+                {'error': 'Content-Range does not match the upload size'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if length > settings.ATTACHMENT_CHUNK_MAX_SIZE:
+            return Response(
+                {'error': f'Chunks are limited to {settings.ATTACHMENT_CHUNK_MAX_SIZE} bytes'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        
+        try:
+            received = attachment_storage.write_chunk(
+                session, request.stream, offset, length
+            )
+        except attachment_storage.UploadOffsetMismatch as e:
+            return Response(
+                {'error': 'Unexpected offset', 'received': e.expected},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        if received == session.size:
+            attachment_storage.complete_upload(session)
+            return Response(
+                self.get_serializer(session).data,
+                status=status.HTTP_201_CREATED
+            )
+        
+        session.received = received
+        session.save(update_fields=['received', 'updated_at'])
+        return Response(self.get_serializer(session).data)
+
 
+class AttachmentViewSet(viewsets.ReadOnlyModelViewSet):
+    """Attachment metadata and downloads"""
+    serializer_class = AttachmentSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        user = self.request.user
+        return Attachment.objects.filter(
+            Q(uploaded_by=user) |
+            Q(messages__conversation__participants__user=user)
+        ).select_related('blob').distinct()
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """
+        Serve the file, honouring single-range `Range` requests.
+
+        With ATTACHMENT_SENDFILE_HEADER set, the front-end server streams
+        the file itself (zero-copy, with its own Range support). Otherwise
+        the file is streamed from a worker thread in fixed-size blocks.
+        """
+        attachment = self.get_object()
+        blob = attachment.blob
+        disposition = content_disposition_header(True, attachment.filename)
+        content_type = attachment.content_type or 'application/octet-stream'
+        
+        if settings.ATTACHMENT_SENDFILE_HEADER:
+            response = HttpResponse(content_type=content_type)
+            response[settings.ATTACHMENT_SENDFILE_HEADER] = (
+                settings.ATTACHMENT_SENDFILE_PREFIX + blob.path
+            )
+            response['Content-Disposition'] = disposition
+            return response
+        
+        try:
+            byte_range = attachment_storage.parse_range(
+                request.META.get('HTTP_RANGE'), blob.size
+            )
+        except ValueError:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{blob.size}'
+            return response
+        
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if byte_range and if_range and if_range.strip('"') != blob.sha256:
+            # Stale validator: send the whole file instead
+            byte_range = None
+        start, length = byte_range or (0, blob.size)
+        
+        path = os.path.join(attachment_storage.attachment_root(), blob.path)
+        response = StreamingHttpResponse(
+            iterate_in_thread(
+                attachment_storage.read_file_range(path, start, length),
+                thread_sensitive=False
+            ),
+            status=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+            content_type=content_type
+        )
+        response['Content-Length'] = str(length)
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = f'"{blob.sha256}"'
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        response['Content-Disposition'] = disposition
+        if byte_range:
+            response['Content-Range'] = f'bytes {start}-{start + length - 1}/{blob.size}'
+        return response
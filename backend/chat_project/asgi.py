@@ -12,14 +12,17 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_project.settings')
 django_asgi_app = get_asgi_application()
 
 from chat.routing import websocket_urlpatterns
+from chat.admission import AdmissionMiddleware
 from chat.middleware import JWTAuthMiddleware
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AllowedHostsOriginValidator(
-        JWTAuthMiddleware(
-            URLRouter(
-                websocket_urlpatterns
+        AdmissionMiddleware(
+            JWTAuthMiddleware(
+                URLRouter(
+                    websocket_urlpatterns
+                )
             )
         )
     ),
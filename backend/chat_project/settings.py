@@ -39,12 +39,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'chat.middleware.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -71,11 +73,69 @@ WSGI_APPLICATION = 'chat_project.wsgi.application'
 ASGI_APPLICATION = 'chat_project.asgi.application'
 
 # Database
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE selects the backend: 'sqlite' (default, single node) or 'postgresql'.
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+
+# Size of Daphne's sync thread pool (read by Daphne from the same variable).
+# Every thread that runs ORM code holds its own persistent connection, so
+# PostgreSQL needs max_connections >= workers * (ASGI_THREADS +
+# CHAT_REST_DB_THREADS + CHAT_WS_DB_THREADS + 1).
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', min(32, (os.cpu_count() or 1) + 4)))
+
+# Database threads of the hot REST views and of the consumers (see chat.pools)
+CHAT_REST_DB_THREADS = int(os.getenv('CHAT_REST_DB_THREADS', '8'))
+CHAT_WS_DB_THREADS = int(os.getenv('CHAT_WS_DB_THREADS', '4'))
+
+# Serve the hot REST endpoints from their own threads (see chat.async_views)
+CHAT_ASYNC_VIEWS = os.getenv('CHAT_ASYNC_VIEWS', 'True') == 'True'
+
+# Encode message and conversation list pages without the DRF serializers
+# (see chat.encoders)
+CHAT_FAST_ENCODERS = os.getenv('CHAT_FAST_ENCODERS', 'True') == 'True'
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'chat'),
+            'USER': os.getenv('DB_USER', 'chat'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', '127.0.0.1'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            # Keep one connection per worker thread open instead of
+            # reconnecting on every database_sync_to_async call.
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '600')),
+            'CONN_HEALTH_CHECKS': True,
+            # Behind PgBouncer in transaction mode, server-side cursors
+            # cannot survive across transactions.
+            'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_POOLER', '') == 'pgbouncer',
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '600')),
+            'OPTIONS': {
+                # Seconds a writer waits for the lock before raising
+                # "database is locked".
+                'timeout': int(os.getenv('SQLITE_TIMEOUT', '20')),
+            },
+        }
     }
+
+# PRAGMAs applied to every new SQLite connection (see chat.signals).
+# WAL lets readers run alongside the single writer, and synchronous=NORMAL
+# is durable across application crashes in WAL mode.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'normal'),
+    'busy_timeout': int(os.getenv('SQLITE_TIMEOUT', '20')) * 1000,
+    'temp_store': 'memory',
 }
 
 # Password validation
@@ -107,6 +167,33 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Message attachments live outside MEDIA_ROOT so they are never served
+# publicly; downloads go through an access-checked view.
+ATTACHMENT_ROOT = Path(os.getenv('ATTACHMENT_ROOT', BASE_DIR / 'attachments'))
+ATTACHMENT_MAX_SIZE = int(os.getenv('ATTACHMENT_MAX_SIZE', 100 * 1024 * 1024))
+ATTACHMENT_CHUNK_MAX_SIZE = int(os.getenv('ATTACHMENT_CHUNK_MAX_SIZE', 8 * 1024 * 1024))
+# Unfinished uploads are deleted after this many idle seconds
+# (manage.py expire_uploads)
+ATTACHMENT_UPLOAD_EXPIRY = int(os.getenv('ATTACHMENT_UPLOAD_EXPIRY', 24 * 60 * 60))
+# Hand downloads to the front-end server for zero-copy sendfile and Range
+# handling, e.g. 'X-Accel-Redirect' (nginx) or 'X-Sendfile' (Apache).
+ATTACHMENT_SENDFILE_HEADER = os.getenv('ATTACHMENT_SENDFILE_HEADER', '')
+ATTACHMENT_SENDFILE_PREFIX = os.getenv('ATTACHMENT_SENDFILE_PREFIX', '/protected/attachments/')
+
+# Message retention (see chat.archive): days of history kept in the Message
+# table unless a conversation sets its own (0 keeps everything), where
+# older messages are archived, and how many move per transaction
+CHAT_RETENTION_DAYS = int(os.getenv('CHAT_RETENTION_DAYS', '0'))
+CHAT_ARCHIVE_ROOT = Path(os.getenv('CHAT_ARCHIVE_ROOT', BASE_DIR / 'archive'))
+CHAT_ARCHIVE_BATCH_SIZE = int(os.getenv('CHAT_ARCHIVE_BATCH_SIZE', '500'))
+
+# Rows fetched per round trip by conversation exports (see chat.export)
+CHAT_EXPORT_CHUNK_SIZE = int(os.getenv('CHAT_EXPORT_CHUNK_SIZE', '2000'))
+
+# Avatar thumbnails, rendered off the request thread (see accounts.thumbnails)
+AVATAR_THUMBNAIL_SIZES = {'sm': 64, 'md': 128, 'lg': 256}
+AVATAR_THUMBNAIL_WORKERS = int(os.getenv('AVATAR_THUMBNAIL_WORKERS', '2'))
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -119,6 +206,9 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'chat.throttling.UserApiThrottle',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 50,
     'DATETIME_FORMAT': '%Y-%m-%dT%H:%M:%S.%fZ',
@@ -142,6 +232,15 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Cache shared by all workers. It holds the change counters behind
+# conditional GETs, so it must not be per-process in a multi-worker setup.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{os.getenv('REDIS_HOST', '127.0.0.1')}:6379/1",
+    },
+}
+
 # For development without Redis, use in-memory channel layer
 if DEBUG and os.getenv('USE_MEMORY_CHANNELS', 'False') == 'True':
     CHANNEL_LAYERS = {
@@ -149,6 +248,97 @@ if DEBUG and os.getenv('USE_MEMORY_CHANNELS', 'False') == 'True':
             'BACKEND': 'channels.layers.InMemoryChannelLayer'
         }
     }
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+    }
+
+# Per-connection outbound queues (see chat.outbound). Typing and presence
+# events are shed first; a client above the limit for longer than the
+# timeout, or above the hard limit at all, is disconnected.
+CHAT_OUTBOUND_QUEUE_SIZE = int(os.getenv('CHAT_OUTBOUND_QUEUE_SIZE', '100'))
+CHAT_OUTBOUND_HARD_LIMIT = int(os.getenv('CHAT_OUTBOUND_HARD_LIMIT', '500'))
+CHAT_SLOW_CONSUMER_TIMEOUT = float(os.getenv('CHAT_SLOW_CONSUMER_TIMEOUT', '10'))
+# Unacknowledged frames after which the writer waits for a client that
+# sends acks
+CHAT_OUTBOUND_ACK_WINDOW = int(os.getenv('CHAT_OUTBOUND_ACK_WINDOW', '200'))
+
+# WebSocket handshake admission and shutdown drain (see chat.admission)
+CHAT_HANDSHAKE_CONCURRENCY = int(os.getenv('CHAT_HANDSHAKE_CONCURRENCY', '50'))
+CHAT_HANDSHAKE_QUEUE = int(os.getenv('CHAT_HANDSHAKE_QUEUE', '500'))
+CHAT_HANDSHAKE_QUEUE_TIMEOUT = float(os.getenv('CHAT_HANDSHAKE_QUEUE_TIMEOUT', '5'))
+CHAT_HANDSHAKE_RETRY_AFTER = float(os.getenv('CHAT_HANDSHAKE_RETRY_AFTER', '2'))
+CHAT_HANDSHAKE_RETRY_JITTER = float(os.getenv('CHAT_HANDSHAKE_RETRY_JITTER', '8'))
+CHAT_DRAIN_SECONDS = float(os.getenv('CHAT_DRAIN_SECONDS', '20'))
+
+# Token-bucket limits as (tokens per second, burst size), see chat.throttling.
+# Buckets are per process unless CHAT_RATE_LIMIT_REDIS_URL is set.
+CHAT_RATE_LIMITS = {
+    'user_messages': (float(os.getenv('RATE_USER_MESSAGES', '5')), 20),
+    'conversation_messages': (float(os.getenv('RATE_CONVERSATION_MESSAGES', '50')), 200),
+    'user_typing': (2, 10),
+    'user_api': (float(os.getenv('RATE_USER_API', '20')), 100),
+    'anon_api': (5, 20),
+}
+CHAT_RATE_LIMIT_REDIS_URL = os.getenv('CHAT_RATE_LIMIT_REDIS_URL', '')
+
+# Conversation detail embeds only the first page of participants; the rest
+# are paged from /api/chat/conversations/<id>/participants/
+CHAT_PARTICIPANTS_PAGE_SIZE = int(os.getenv('CHAT_PARTICIPANTS_PAGE_SIZE', '50'))
+
+# Conversation list items embed at most this many other participants;
+# participants_count still gives the total
+CHAT_LIST_PARTICIPANTS = int(os.getenv('CHAT_LIST_PARTICIPANTS', '10'))
+
+# Most user ids accepted by one group creation or bulk add/remove request
+CHAT_BULK_MEMBERS_LIMIT = int(os.getenv('CHAT_BULK_MEMBERS_LIMIT', '5000'))
+
+# Rooms with at least this many members are fanned out once per worker
+# process (see chat.fanout) and get no typing or presence events
+CHAT_LARGE_ROOM_SIZE = int(os.getenv('CHAT_LARGE_ROOM_SIZE', '1000'))
+
+# Bearer token required by GET /metrics. If empty, the endpoint is only
+# served when DEBUG is on
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Fraction of chat messages that get a trace id and JSON stage logs on the
+# chat.trace logger (stage latency histograms cover every message)
+CHAT_TRACE_SAMPLE_RATE = float(os.getenv('CHAT_TRACE_SAMPLE_RATE', '0'))
+
+# Serialized conversation list pages, keyed by inbox version (see
+# chat.response_cache): 'memory' per process, 'shared' in CACHES, or '' off
+CHAT_INBOX_CACHE = os.getenv('CHAT_INBOX_CACHE', 'memory')
+CHAT_INBOX_CACHE_MAX_BYTES = int(os.getenv('CHAT_INBOX_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+CHAT_INBOX_CACHE_TTL = int(os.getenv('CHAT_INBOX_CACHE_TTL', '300'))
+
+# How long message nonces are remembered in the cache; later retries are
+# still caught by the database constraint (see chat.idempotency)
+CHAT_NONCE_TTL = int(os.getenv('CHAT_NONCE_TTL', '600'))
+
+# Seconds a worker trusts its own "not revoked" answer for a token before
+# asking the shared cache again (see accounts.revocation)
+AUTH_REVOCATION_LOCAL_TTL = float(os.getenv('AUTH_REVOCATION_LOCAL_TTL', '5'))
+
+# Staff-only profiler (see chat.profiling): where profiles are saved and
+# how many of the newest are kept
+PROFILE_ROOT = os.getenv('PROFILE_ROOT', str(BASE_DIR / 'profiles'))
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'trace': {'class': 'logging.StreamHandler', 'formatter': 'message'},
+    },
+    'loggers': {
+        'chat.trace': {'handlers': ['trace'], 'level': 'INFO', 'propagate': False},
+    },
+}
 
 AUTH_USER_MODEL = 'accounts.User'
 
@@ -5,11 +5,17 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from chat.admin import profile_detail, profile_download, profile_list
+from chat.metrics import metrics_view
 
 urlpatterns = [
+    path('admin/profiles/', admin.site.admin_view(profile_list), name='admin-profiles'),
+    path('admin/profiles/<str:profile_id>/', admin.site.admin_view(profile_detail), name='admin-profile-detail'),
+    path('admin/profiles/<str:profile_id>/download/', admin.site.admin_view(profile_download), name='admin-profile-download'),
     path('admin/', admin.site.urls),
     path('api/auth/', include('accounts.urls')),
     path('api/chat/', include('chat.urls')),
+    path('metrics', metrics_view),
 ]
 
 if settings.DEBUG:
@@ -41,12 +41,18 @@ const ChatWindow = ({ conversation, user, onMessageSent }) => {
     const wsURL = getWebSocketURL(conversation.id, token);
     
     const websocket = new WebSocket(wsURL);
+    let received = 0;
 
     websocket.onopen = () => {
       console.log('WebSocket connected');
     };
 
     websocket.onmessage = (event) => {
+      // Acknowledge frames so the server can pace delivery
+      received += 1;
+      if (received % 20 === 0) {
+        websocket.send(JSON.stringify({ type: 'ack', received }));
+      }
       const data = JSON.parse(event.data);
       
       if (data.type === 'message') {